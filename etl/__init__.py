@@ -0,0 +1,22 @@
+"""ETL processing for COVID-19 datasets.
+
+    import etl
+
+    etl.run({'input': {'source': '/datasets/'},
+             'output': {'repository': '/covid19-ccaa/'}})
+
+See main.run. The modules of this package import each other relatively,
+as etl.config, etl.stages..., so they never shadow the modules of the
+application using it. Importing the package loads nothing else; the
+command-line scripts are run as modules, e.g. python -m etl.main.
+
+"""
+
+
+def __getattr__(name):
+    """Import run from main.py when first used."""
+    if name != 'run':
+        raise AttributeError(
+            "module '%s' has no attribute '%s'" % (__name__, name))
+    from .main import run
+    return run
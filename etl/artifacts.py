@@ -0,0 +1,149 @@
+"""Pre-compressed and content-hashed copies of the output files.
+
+For every output file it writes:
+
+- .gz and .br siblings next to the file, e.g. todos_ccaa_acumulado.json-stat.gz
+- a copy named after its content hash, plus its .gz and .br siblings, in
+  the dist directory, e.g. dist/todos_ccaa_acumulado.3f2a9c1b0d4e.json-stat
+
+and a manifest mapping every logical file name to its hashed copies, so
+that they can be served with immutable caching:
+
+    {
+        "todos_ccaa_acumulado.json-stat": {
+            "sha256": "3f2a9c1b0d4e...",
+            "size": 64704,
+            "file": "dist/todos_ccaa_acumulado.3f2a9c1b0d4e.json-stat",
+            "gzip": "dist/todos_ccaa_acumulado.3f2a9c1b0d4e.json-stat.gz",
+            "br": "dist/todos_ccaa_acumulado.3f2a9c1b0d4e.json-stat.br"
+        }
+    }
+
+Files whose hash did not change since the manifest was written are skipped.
+Files of compressed formats, such as Parquet, only get the hashed copy.
+Brotli output requires the brotli package of the Pipfile; without it only
+the .gz siblings are written.
+
+"""
+
+from collections import OrderedDict
+
+import gzip
+
+import hashlib
+
+import io
+
+import json
+
+import os
+
+from .profiling import record_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+EXTENSIONS = {'gzip': '.gz', 'br': '.br'}
+
+# Formats compressed already, not worth compressing again
+COMPRESSED = ('.parquet',)
+
+
+def compress(data, encoding):
+    """Compress bytes with gzip or brotli, deterministically."""
+    if encoding == 'gzip':
+        # gzip.compress only takes mtime from Python 3.8
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9,
+                           mtime=0) as file:
+            file.write(data)
+        return buffer.getvalue()
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    raise ValueError('Unknown encoding: ' + encoding)
+
+
+def hashed_name(file_name, digest):
+    """Insert a content hash before the extension of a file name."""
+    name, dot, extension = file_name.partition('.')
+    return name + '.' + digest[:12] + dot + extension
+
+
+def write_bytes(data, file_name):
+    """Write bytes to a file, creating its directory if needed."""
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    with open(file_name, 'wb') as file:
+        file.write(data)
+    record_file(len(data))
+
+
+def load_manifest(file_name):
+    """Read a manifest, or return an empty one."""
+    try:
+        with open(file_name) as file:
+            return json.load(file, object_pairs_hook=OrderedDict)
+    except (IOError, ValueError):
+        return OrderedDict()
+
+
+def build_artifacts(path, files, encodings, dist='dist/',
+                    manifest_name='manifest.json'):
+    """Write compressed and hashed copies of the output files.
+
+        path (str): directory of the output files
+        files (list): output file names, relative to path
+        encodings (list): 'gzip' and/or 'br'
+        dist (str): directory of the hashed copies, relative to path
+        manifest_name (str): manifest file name, relative to path
+
+    Returns:
+        list: names of the files whose artifacts were rebuilt
+    """
+    if 'br' in encodings and brotli is None:
+        print("Paquete brotli no instalado: no se generan ficheros .br")
+        encodings = [e for e in encodings if e != 'br']
+    os.makedirs(path + dist, exist_ok=True)
+    previous = load_manifest(path + manifest_name)
+    manifest = OrderedDict()
+    rebuilt = []
+    for name in sorted(files):
+        if not os.path.exists(path + name):
+            continue
+        with open(path + name, 'rb') as file:
+            data = file.read()
+        digest = hashlib.sha256(data).hexdigest()
+        hashed = dist + hashed_name(name, digest)
+        entry = OrderedDict([
+            ('sha256', digest),
+            ('size', len(data)),
+            ('file', hashed)])
+        file_encodings = [] if name.endswith(COMPRESSED) else encodings
+        for encoding in file_encodings:
+            entry[encoding] = hashed + EXTENSIONS[encoding]
+        old = previous.get(name, {})
+        targets = [name + EXTENSIONS[e] for e in file_encodings] + \
+            [entry[key] for key in ['file'] + list(file_encodings)]
+        if dict(old) == dict(entry) and \
+                all(os.path.exists(path + t) for t in targets):
+            manifest[name] = old
+            continue
+        write_bytes(data, path + hashed)
+        for encoding in file_encodings:
+            compressed = compress(data, encoding)
+            write_bytes(compressed, path + name + EXTENSIONS[encoding])
+            write_bytes(compressed, path + entry[encoding])
+        # Remove the hashed copies of the previous version
+        for key in ['file'] + list(EXTENSIONS):
+            stale = old.get(key)
+            if stale and stale not in entry.values() and \
+                    os.path.exists(path + stale):
+                os.remove(path + stale)
+        manifest[name] = entry
+        rebuilt.append(name)
+    if rebuilt or list(previous) != list(manifest):
+        with open(path + manifest_name, 'w') as file:
+            json.dump(manifest, file, indent=2)
+    return rebuilt
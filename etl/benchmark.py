@@ -0,0 +1,394 @@
+"""Benchmarks of the ETL stages on synthetic data.
+
+Generates datadista-shaped .csv files for every input in
+etl_cfg.input.files, runs the stages on them offline (no git pull, no
+publish, every output and the history database in a temporary directory)
+and appends the results to a JSON lines file, one line per scale:
+
+    python -m etl.benchmark [--scale K [K ...]] [--jobs N] [--repeat R]
+                              [--export-workers W] [--only STAGE ...]
+                              [--results FILE]
+
+At scale 1 the inputs are about the size of the real datasets (90 days of
+19 autonomous communities, 5761 service stations...). At scale K the
+series have K times as many days and the point datasets K times as many
+rows. Every line of the results file stores the metrics of each stage
+(see profiling.py) and the best time of some transforms, and each run is
+printed next to the previous run at the same scale.
+
+"""
+
+import argparse
+
+from collections import OrderedDict
+
+from datetime import datetime
+
+import json
+
+import os
+
+import platform
+
+import tempfile
+
+import time
+
+from .config import etl_cfg
+
+from git import InvalidGitRepositoryError, Repo
+
+from .jsonstat import long_to_jsonstat, to_jsonstat
+
+import numpy as np
+
+import pandas as pd
+
+from .pipeline import run_stages, with_dependents
+
+from .stages import (
+    STAGES, Export, ccaa_long, export_jsonstat, load, prepare_series,
+    replace_file, streamed_inputs)
+
+from .transforms import deacumulate, delay_date
+
+from .validation import validate
+
+
+DAYS = 90
+FIRST_DAY = '2020-02-20'
+CCAA = ['Andalucía', 'Aragón', 'Asturias', 'Baleares', 'Canarias',
+        'Cantabria', 'Castilla La Mancha', 'Castilla y León', 'Cataluña',
+        'Ceuta', 'C. Valenciana', 'Extremadura', 'Galicia', 'Madrid',
+        'Melilla', 'Murcia', 'Navarra', 'País Vasco', 'La Rioja']
+AGE_RANGES = ['0-9', '10-19', '20-29', '30-39', '40-49', '50-59', '60-69',
+              '70-79', '80-89', '90 y +', 'Total']
+POINTS = {'eess': 5761, 'restauracion': 1484, 'alojamientos': 364}
+
+
+def _dates(days):
+    """Consecutive dates as strings, from FIRST_DAY."""
+    return pd.date_range(FIRST_DAY, periods=days).strftime('%Y-%m-%d')
+
+
+def _cumulative(rng, size, mean):
+    """Non-decreasing series of accumulated counts."""
+    return rng.poisson(mean, size).cumsum()
+
+
+def _labels(rng, prefix, count, size):
+    """Random choice among count labels."""
+    return np.char.add(prefix, rng.integers(count, size=size).astype(str))
+
+
+def _coordinates(rng, size, low, high, decimal='.'):
+    """Random coordinates as text, as in the source files."""
+    values = pd.Series(rng.uniform(low, high, size)).round(6).astype(str)
+    return values.str.replace('.', decimal, regex=False)
+
+
+def synthetic_inputs(scale, seed=0):
+    """Build datadista-shaped input dataframes.
+
+        scale (int): multiplier of the number of days and points
+        seed (int): random seed
+
+    Returns:
+        dict: dataframe of every input in etl_cfg.input.files
+    """
+    rng = np.random.default_rng(seed)
+    days = DAYS * scale
+    dates = _dates(days)
+    inputs = {}
+
+    # fecha,cod_ine,CCAA,total
+    for name in ['casos', 'altas', 'fallecidos', 'hospital', 'uci']:
+        inputs[name] = pd.DataFrame({
+            'fecha': np.tile(dates, len(CCAA)),
+            'cod_ine': np.repeat(np.arange(1, len(CCAA) + 1), days),
+            'CCAA': np.repeat(CCAA, days),
+            'total': np.concatenate([
+                _cumulative(rng, days, 50) for _ in CCAA])})
+
+    inputs['nacional'] = pd.DataFrame(OrderedDict(
+        [('fecha', dates)] +
+        [(column, _cumulative(rng, days, 1000)) for column in [
+            'casos_total', 'altas', 'fallecimientos', 'ingresos_uci',
+            'hospitalizados']]))
+
+    sexes = ['ambos', 'hombres', 'mujeres']
+    counts = OrderedDict()
+    for column in ['casos_confirmados', 'hospitalizados', 'ingresos_uci',
+                   'fallecidos']:
+        # Accumulated series of every age range and sex, day by day; the
+        # 'Total' range and 'ambos' sex add up the others
+        series = np.zeros((days, len(AGE_RANGES), len(sexes)), dtype=int)
+        series[:, :-1, 1:] = np.stack([
+            _cumulative(rng, days, 10)
+            for _ in range((len(AGE_RANGES) - 1) * (len(sexes) - 1))],
+            axis=1).reshape(days, len(AGE_RANGES) - 1, len(sexes) - 1)
+        series[:, -1] = series[:, :-1].sum(axis=1)
+        series[:, :, 0] = series[:, :, 1:].sum(axis=2)
+        counts[column] = series.ravel()
+    inputs['nacional_edad'] = pd.DataFrame(OrderedDict(
+        [('fecha', np.repeat(dates, len(AGE_RANGES) * len(sexes))),
+         ('rango_edad', np.tile(np.repeat(AGE_RANGES, len(sexes)), days)),
+         ('sexo', np.tile(sexes, days * len(AGE_RANGES)))] +
+        list(counts.items())))
+
+    size = POINTS['eess'] * scale
+    inputs['eess'] = pd.DataFrame(OrderedDict([
+        ('Horario', _labels(rng, 'L-D: 07:00-', 20, size)),
+        ('Provincia', _labels(rng, 'PROVINCIA ', 52, size)),
+        ('Municipio', _labels(rng, 'MUNICIPIO ', 3000, size)),
+        ('Código\nPostal', rng.integers(1000, 52999, size)),
+        ('Dirección', _labels(rng, 'CALLE ', size, size)),
+        ('Margen', rng.choice(['D', 'I', 'N'], size)),
+        ('Rótulo', _labels(rng, 'ROTULO ', 300, size)),
+        ('Latitud', _coordinates(rng, size, 36, 43.8, ',')),
+        ('Longitud', _coordinates(rng, size, -9.3, 3.3, ','))]))
+
+    size = POINTS['restauracion'] * scale
+    inputs['restauracion'] = pd.DataFrame(OrderedDict([
+        ('NOMBRE', _labels(rng, 'Restaurante ', size, size)),
+        ('Tipo', rng.choice(['Restaurante', 'Bar', 'Cafetería'], size)),
+        ('Direccion', _labels(rng, 'Carretera N-', size, size)),
+        ('Municipio', _labels(rng, 'Municipio ', 1000, size)),
+        ('Provincia', _labels(rng, 'Provincia ', 52, size)),
+        ('Latitud', _coordinates(rng, size, 36, 43.8)),
+        ('Longitud', _coordinates(rng, size, -9.3, 3.3)),
+        ('Comentarios', rng.choice(['', 'Sólo para llevar'], size)),
+        ('Horario', _labels(rng, '24 horas ', 10, size)),
+        ('Telefono', rng.integers(600000000, 999999999, size)),
+        ('Bocata_Bebida_Caliente', rng.choice(['Sí', 'No'], size)),
+        ('Comida_Preparada', rng.choice(['Sí', 'No'], size)),
+        ('Ducha', rng.choice(['Sí', 'No'], size))]))
+
+    size = POINTS['alojamientos'] * scale
+    inputs['alojamientos'] = pd.DataFrame(OrderedDict([
+        ('CCAA', rng.choice(CCAA, size)),
+        ('provincia', rng.choice(['Santander', 'Madrid', 'Asturias'], size)),
+        ('localidad', _labels(rng, 'Localidad ', 500, size)),
+        ('nombre', _labels(rng, 'Hotel ', size, size)),
+        ('lat', _coordinates(rng, size, 36, 43.8)),
+        ('long', _coordinates(rng, size, -9.3, 3.3))]))
+    return inputs
+
+
+def write_inputs(inputs, dir_path):
+    """Write the synthetic inputs with the file names of the source."""
+    for name, df in inputs.items():
+        df.to_csv(dir_path + etl_cfg.input.files[name], index=False)
+
+
+def best_time(func, repeat):
+    """Best wall time of several calls of a function, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return round(min(times), 4)
+
+
+def time_exports(ccaa, repeat, workers):
+    """Time the export of the series of every region, one file each.
+
+        ccaa (dict): prepared series of every variable
+        workers (int): processes of the pooled export
+
+    The same datasets are written one by one with to_jsonstat, and in a
+    batch with export_jsonstat in this process and in a process pool.
+    """
+    exports = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for variable, df in ccaa.items():
+            for cod_ine, region in df.groupby('cod_ine'):
+                exports.append(Export(
+                    region, ['fecha'], ['total'], None,
+                    os.path.join(tmp_dir, '%s_%d.json-stat' % (
+                        variable, cod_ine))))
+        source = etl_cfg.metadata.source
+
+        def one_by_one():
+            for frame, id_vars, value_vars, unit, file_name in exports:
+                replace_file(to_jsonstat(
+                    frame, id_vars, value_vars, source, unit=unit),
+                    file_name)
+
+        return OrderedDict([
+            ('export_one_by_one', best_time(one_by_one, repeat)),
+            ('export_batch', best_time(
+                lambda: export_jsonstat(exports, 1), repeat)),
+            ('export_pool', best_time(
+                lambda: export_jsonstat(exports, workers), repeat))])
+
+
+def time_transforms(inputs, repeat, workers=1):
+    """Time the transforms shared by the stages on the synthetic series."""
+    fechas = inputs['casos'][['fecha']].copy()
+    casos = prepare_series(inputs['casos']).rename(
+        columns={'total': 'casos-acumulado'})
+    ccaa = {
+        name: prepare_series(inputs[name])
+        for name in ['casos', 'altas', 'fallecidos', 'hospital', 'uci']}
+
+    def merge():
+        return ccaa_long(
+            ccaa, ['casos', 'altas', 'fallecidos', 'hospital', 'uci'])
+
+    todos = merge()
+    source = etl_cfg.metadata.source
+    checked = dict(
+        ccaa, nacional=delay_date(inputs['nacional'].copy()),
+        nacional_edad=inputs['nacional_edad'])
+    # merge_ccaa and to_json build and write the todos_ccaa_acumulado cube,
+    # validate checks the inputs as main.update does before the stages
+    return OrderedDict([
+        ('delay_date', best_time(lambda: delay_date(fechas), repeat)),
+        ('deacumulate', best_time(lambda: deacumulate(
+            casos, 'casos-acumulado', 'casos', by='cod_ine'), repeat)),
+        ('merge_ccaa', best_time(merge, repeat)),
+        ('to_json', best_time(lambda: long_to_jsonstat(
+            todos, ['fecha', 'ccaa'], 'total', source), repeat)),
+        ('validate', best_time(
+            lambda: validate(checked, list(checked)), repeat))] +
+        list(time_exports(ccaa, repeat, workers).items()))
+
+
+def git_revision():
+    """Current commit of the repository, if any."""
+    try:
+        return Repo(search_parent_directories=True).head.commit.hexsha
+    except (InvalidGitRepositoryError, ValueError):
+        return None
+
+
+def run_benchmark(scale, stages, jobs=1, repeat=3, workers=1):
+    """Run the stages on synthetic inputs of the given scale.
+
+    workers is the number of processes of the pooled export timed by
+    time_exports.
+
+    Returns:
+        OrderedDict: result of the benchmark
+    """
+    inputs = synthetic_inputs(scale)
+    settings = [('input', 'dir_path'), ('output', 'path'),
+                ('output', 'cache'), ('output', 'history')]
+    saved = [etl_cfg[section][key] for section, key in settings]
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            etl_cfg.input['dir_path'] = os.path.join(tmp_dir, 'input/')
+            etl_cfg.output['path'] = os.path.join(tmp_dir, 'output/')
+            etl_cfg.output['cache'] = os.path.join(tmp_dir, 'cache/')
+            # The historial stage must not record synthetic releases in the
+            # real history
+            etl_cfg.output['history'] = os.path.join(
+                tmp_dir, 'historial.sqlite')
+            os.makedirs(etl_cfg.input.dir_path)
+            os.makedirs(etl_cfg.output.path)
+            write_inputs(inputs, etl_cfg.input.dir_path)
+            start = time.perf_counter()
+            metrics = [m for _, m in run_stages(
+                stages, load, jobs, streamed=streamed_inputs())]
+            wall_time = time.perf_counter() - start
+            transforms = time_transforms(inputs, repeat, workers)
+    finally:
+        for (section, key), value in zip(settings, saved):
+            etl_cfg[section][key] = value
+    return OrderedDict([
+        ('date', datetime.today().isoformat()),
+        ('commit', git_revision()),
+        ('python', platform.python_version()),
+        ('pandas', pd.__version__),
+        ('scale', scale),
+        ('jobs', jobs),
+        ('export_workers', workers),
+        ('rows', OrderedDict(
+            (name, len(df)) for name, df in sorted(inputs.items()))),
+        ('wall_time', round(wall_time, 4)),
+        ('stages', metrics),
+        ('transforms', transforms)])
+
+
+def load_results(file_name):
+    """Read the results of previous runs."""
+    try:
+        with open(file_name) as file:
+            return [json.loads(line) for line in file if line.strip()]
+    except IOError:
+        return []
+
+
+def print_result(result, previous=None):
+    """Print the times of a run, next to those of a previous run."""
+    def row(name, seconds, before):
+        change = '' if before is None else \
+            '%+.0f%%' % (100 * (seconds - before) / before) if before else ''
+        print('  %-20s %10.4f %10s %8s' % (
+            name, seconds, '' if before is None else '%.4f' % before,
+            change))
+
+    old_stages = {}
+    old_transforms = {}
+    if previous:
+        old_stages = {s['name']: s['wall_time'] for s in previous['stages']}
+        old_transforms = previous['transforms']
+    print('Escala %dx: %.2f s' % (result['scale'], result['wall_time']))
+    print('  %-20s %10s %10s' % ('', 'actual', 'anterior'))
+    for stage in result['stages']:
+        row(stage['name'], stage['wall_time'], old_stages.get(stage['name']))
+    for name, seconds in result['transforms'].items():
+        row(name, seconds, old_transforms.get(name))
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Benchmarks of the ETL stages on synthetic data.')
+    parser.add_argument(
+        '--scale', type=int, nargs='+', default=[1, 10, 100], metavar='K',
+        help='size of the inputs relative to the real ones '
+             '(default: 1 10 100)')
+    parser.add_argument(
+        '--jobs', type=int, default=1, metavar='N',
+        help='number of stages run concurrently (default: 1)')
+    parser.add_argument(
+        '--export-workers', type=int, default=os.cpu_count(), metavar='W',
+        help='processes of the pooled export of the regional series '
+             '(default: number of CPUs)')
+    parser.add_argument(
+        '--repeat', type=int, default=3, metavar='R',
+        help='calls of every timed transform (default: 3)')
+    parser.add_argument(
+        '--only', action='append', metavar='STAGE',
+        choices=[stage.name for stage in STAGES],
+        help='run only this stage')
+    parser.add_argument(
+        '--results', default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'benchmarks.jsonl'),
+        metavar='FILE', help='results file (default: etl/benchmarks.jsonl)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the benchmarks and append their results."""
+    args = parse_args(argv)
+    stages = STAGES
+    if args.only:
+        stages = with_dependents(
+            STAGES, [stage for stage in STAGES if stage.name in args.only])
+    results = load_results(args.results)
+    for scale in args.scale:
+        result = run_benchmark(
+            scale, stages, args.jobs, args.repeat, args.export_workers)
+        previous = [r for r in results if r['scale'] == scale]
+        print_result(result, previous[-1] if previous else None)
+        with open(args.results, 'a') as file:
+            file.write(json.dumps(result) + '\n')
+        results.append(result)
+
+
+if __name__ == '__main__':
+    main()
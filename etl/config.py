@@ -1,14 +1,27 @@
+"""Settings of the ETL process, as the etl_cfg tree.
+
+SOURCE and REPOSITORY are read from the environment (or a .env file) and
+may be left unset when the settings are given to main.run instead; see
+configure.
+
+"""
+
 from beautifuldict.baseconfig import Baseconfig
 
 from decouple import config
 
-from pkg_resources import resource_filename
+import os
+
+
+def resource_filename(name):
+    """Path of a file or directory next to this module."""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
 
 
 params = {
     'input': {
-        'source': config('SOURCE'),
-        'dir_path': config('SOURCE') + 'COVID 19/',
+        'source': config('SOURCE', default=''),
+        'dir_path': config('SOURCE', default='') + 'COVID 19/',
         'files': {
             'alojamientos': 'alojamientos_turisticos_boe_2020_4194.csv',
             'altas': 'ccaa_covid19_altas_long.csv',
@@ -20,45 +33,175 @@ params = {
             'nacional_edad': 'nacional_covid19_rango_edad.csv',
             'restauracion': 'puntos_restauracion_comida_para_llevar.csv',
             'uci': 'ccaa_covid19_uci_long.csv'
-        }
+        },
+        # Population of every CCAA (INE, 1 January 2019), by cod_ine
+        'population': resource_filename('poblacion_ccaa.csv')
+    },
+    'regions': {
+        1: 'andalucia',
+        2: 'aragon',
+        3: 'asturias',
+        4: 'baleares',
+        5: 'canarias',
+        6: 'cantabria',
+        7: 'castilla-la-mancha',
+        8: 'castilla-y-leon',
+        9: 'cataluna',
+        10: 'ceuta',
+        11: 'c-valenciana',
+        12: 'extremadura',
+        13: 'galicia',
+        14: 'madrid',
+        15: 'melilla',
+        16: 'murcia',
+        17: 'navarra',
+        18: 'pais-vasco',
+        19: 'la-rioja'
     },
     'output': {
-        'path': resource_filename(__name__, 'data/'),
-        'repository': config('REPOSITORY')
+        'path': resource_filename('data/'),
+        'state': resource_filename('etl_state.json'),
+        # Parsed snapshots of the input files (see ingest.py)
+        'cache': resource_filename('cache/'),
+        # Append-only history of the figures of every release (history.py)
+        'history': resource_filename('historial.sqlite'),
+        # Run report with the metrics of every stage, and cProfile stats
+        'report': resource_filename('run_report.json'),
+        'profile': resource_filename('profile/'),
+        # Formats of the point-of-interest datasets: 'jsonstat', 'columns'
+        'points': ['jsonstat', 'columns'],
+        # Side, in degrees, of the grid tiles of the point-of-interest
+        # shards (see stages.write_shards)
+        'tile_size': 0.5,
+        # Rows per chunk of the point-of-interest exports, which are then
+        # streamed from the .csv files; None reads them whole
+        'chunksize': 20000,
+        # Decimals of the figures without 'decimals' in their metadata
+        # (see jsonstat.py); None keeps them whole, e.g. coordinates
+        'decimals': None,
+        # Processes serializing the small datasets of a stage, such as the
+        # series of every region (see stages.export_jsonstat); they add to
+        # the stages run concurrently with --jobs
+        'export_workers': 1,
+        # Other formats of some datasets, by output file name without
+        # extension (see writers.py): 'csv', 'ndjson', 'parquet'
+        'formats': {
+            'todos_ccaa_acumulado': ['csv', 'ndjson', 'parquet'],
+            'todos_nacional_acumulado': ['csv', 'ndjson', 'parquet'],
+            'indicadores_ccaa': ['csv', 'ndjson', 'parquet'],
+            'eess_horario_flexible_habitual': ['csv', 'parquet'],
+            'puntos_restauracion': ['csv', 'parquet'],
+            'alojamientos_turisticos': ['csv', 'parquet']
+        },
+        # Maximum rows of every Parquet row group
+        'row_group_size': 10000,
+        # Pre-compressed copies of the outputs: 'gzip', 'br'
+        'compression': ['gzip', 'br'],
+        'repository': config('REPOSITORY', default='')
+    },
+    'github': {
+        'api_url': 'https://api.github.com/gists/',
+        # Token with the gist scope; gists are not updated without it
+        'api_token': config('GITHUB_TOKEN', default=''),
+        # Gists updated after every run (see gist.py): gist id as key, with
+        # its description and the output files it holds
+        'gists': {},
+        # Gists updated concurrently, and retries of every request
+        'jobs': 4,
+        'retries': 3,
+        'timeout': 30
+    },
+    'validation': {
+        # Severity of the checks of the inputs (see validation.py):
+        # 'error', 'warning' or None to skip the check
+        'checks': {
+            'schema': 'error',
+            'regions': 'error',
+            'duplicates': 'error',
+            'continuity': 'warning',
+            # Sources revise accumulated figures down now and then
+            'monotonic': 'warning'
+        },
+        # Neither run the stages nor publish if a check fails with an error
+        'block': True,
+        # Rows of every issue kept as examples in the run report
+        'examples': 5
+    },
+    'server': {
+        # Address of the query server (see server.py), and number of
+        # responses kept in its cache
+        'host': '127.0.0.1',
+        'port': 8000,
+        'cache_size': 256
     },
     'metadata': {
-        'source': 'Ministerio de Sanidad, Consumo y Bienestar Social. A partir de ficheros de datos elaborados por DATADISTA.COM',
+        'source': 'Ministerio de Sanidad, Consumo y Bienestar Social. '
+                  'A partir de ficheros de datos elaborados por DATADISTA.COM',
+        # Daily series of every variable (*_diario datasets)
+        'diario': {
+            'altas': {'decimals': 0, 'label': 'Número de personas'},
+            'casos': {'decimals': 0, 'label': 'Número de personas'},
+            'fallecidos': {'decimals': 0, 'label': 'Número de personas'},
+            'hospital': {'decimals': 0, 'label': 'Número de personas'},
+            'uci': {'decimals': 0, 'label': 'Número de personas'}
+        },
+        'fallecidos_acumulado': {
+            'fallecidos': {
+                'decimals': 0, 'label': 'Número de personas acumulado'}
+        },
         'todos_cantabria': {
             'casos': {'decimals': 0, 'label': 'Número de personas acumulado'},
             'altas': {'decimals': 0, 'label': 'Número de personas acumulado'},
-            'fallecidos': {'decimals': 0, 'label': 'Número de personas acumulado'},
+            'fallecidos': {
+                'decimals': 0, 'label': 'Número de personas acumulado'},
             'uci': {'decimals': 0, 'label': 'Número de personas acumulado'}
         },
+        'indicadores': {
+            'casos-duplicacion': {
+                'decimals': 1,
+                'label': 'Días en duplicarse los casos, al ritmo de los '
+                         'últimos 7 días'},
+            'casos-ia-14d': {
+                'decimals': 1,
+                'label': 'Casos en 14 días por 100.000 habitantes'},
+            'casos-media-7d': {
+                'decimals': 1, 'label': 'Media de casos diarios en 7 días'},
+            'fallecidos-ia-14d': {
+                'decimals': 2,
+                'label': 'Fallecidos en 14 días por 100.000 habitantes'},
+            'fallecidos-media-7d': {
+                'decimals': 1,
+                'label': 'Media de fallecidos diarios en 7 días'}
+        },
+        'variacion': {
+            'variacion': {
+                'decimals': 2, 'label': 'Tasa de variación diaria (%)'}
+        },
         'casos_cantabria_espana': {
-            'casos-espana': {'decimals': 0, 'label': 'Número de personas acumulado'},
-            'casos-cantabria': {'decimals': 0, 'label': 'Número de personas acumulado'}
+            'casos-espana': {
+                'decimals': 0, 'label': 'Número de personas acumulado'},
+            'casos-cantabria': {
+                'decimals': 0, 'label': 'Número de personas acumulado'}
         }
     }
 }
 
 etl_cfg = Baseconfig(params)
 
-"""
-    files = {
-    cfg.output.hospitalizations: {
-        "content": hospitalizations_json
-    },
-    cfg.output.ucis: {
-        "content": ucis_json
-    },
-    cfg.output.sanitarians: {
-        "content": sanitarians_json
-    },
-    cfg.output.elder: {
-        "content": elder_json
-    }
-    utils.publish_gist(files,
-                   cfg.labels.hospitalizations_gist,
-                   cfg.github.hospitalizations_gist_id)
-    }
-"""
\ No newline at end of file
+
+def configure(settings):
+    """Override some settings of etl_cfg.
+
+        settings (dict): section of etl_cfg as key and dict of the settings
+                         to change as value, e.g.
+                         {'input': {'source': '/datasets/'}}
+
+    The directory of the input files follows the source repository unless
+    it is also given.
+    """
+    for section, values in settings.items():
+        for key, value in values.items():
+            etl_cfg[section][key] = value
+    source = settings.get('input', {})
+    if 'source' in source and 'dir_path' not in source:
+        etl_cfg.input['dir_path'] = source['source'] + 'COVID 19/'
@@ -1,21 +1,145 @@
-from config import etl_cfg
+"""Publish output files to GitHub gists.
+
+Every gist in etl_cfg.github.gists lists the output files it holds:
+
+    'gists': {
+        '<gist id>': {
+            'description': 'COVID-19 Cantabria',
+            'files': ['todos_cantabria.json-stat', ...]
+        }
+    }
+
+Only the files whose content changed since they were last sent are
+published, all of them in a single PATCH request per gist. Gists are
+updated concurrently over a pooled HTTP session, and requests failing with
+a connection error or a 429/5xx status are retried with exponential
+backoff. The git blob SHA-1 of every file sent is kept in the state file
+(see state.py), so a gist that fails is sent again in the next run.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import json
+
+import os
 
 import requests
 
+from requests.adapters import HTTPAdapter
+
+from .state import blob_sha
+
+from urllib3.util.retry import Retry
+
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def make_session(token, jobs=4, retries=3, backoff=1):
+    """Return an authenticated HTTP session for the GitHub API.
+
+        token (str): GitHub token with the gist scope
+        jobs (int): connections kept open to the API
+        retries (int): times a failed request is retried
+        backoff (float): backoff factor, in seconds, between retries
+    """
+    session = requests.Session()
+    session.headers.update({
+        'Authorization': 'token ' + token,
+        'Accept': 'application/vnd.github.v3+json'})
+    # A PATCH with the whole content of the files is idempotent
+    retry = Retry(
+        total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUS,
+        allowed_methods=frozenset(['PATCH']))
+    adapter = HTTPAdapter(
+        pool_connections=1, pool_maxsize=jobs, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def changed_files(files, path, sent):
+    """Return the files of a gist changed since they were last sent.
+
+        files (list): file names
+        path (str): directory of the files
+        sent (dict): file name as key and hash of the content sent as value
+
+    Files not built yet are left out.
+
+    Returns:
+        dict: file name as key and hash of its current content as value
+    """
+    hashes = {
+        name: blob_sha(path + name) for name in files
+        if os.path.exists(path + name)}
+    return {name: sha for name, sha in hashes.items()
+            if sent.get(name) != sha}
+
+
+def publish_gist(session, api_url, gist_id, description, files, path,
+                 timeout=30):
+    """Update some files of a gist with one PATCH request.
+
+        session (Session): see make_session
+        api_url (str): URL of the gists API, ending with a slash
+        gist_id (str): gist to update
+        description (str): description of the gist
+        files (list): names of the files to send
+        path (str): directory of the files
+        timeout (float): seconds to wait for the server
+
+    Raises:
+        requests.RequestException: if the request fails after the retries
+    """
+    contents = {}
+    for name in files:
+        with open(path + name, encoding='utf-8') as file:
+            contents[name] = {'content': file.read()}
+    payload = {'description': description, 'files': contents}
+    response = session.patch(
+        api_url + gist_id, data=json.dumps(payload), timeout=timeout)
+    response.raise_for_status()
+
+
+def publish_gists(gists, path, sent, session, api_url, jobs=4, timeout=30):
+    """Publish the changed files of every gist.
+
+        gists (dict): gist id as key; description and file names as value
+        path (str): directory of the files
+        sent (dict): gist id as key and the hashes of the files last sent
+                     to it as value, as saved in the state file
+        session (Session): see make_session
+        api_url (str): URL of the gists API, ending with a slash
+        jobs (int): gists updated concurrently
+        timeout (float): seconds to wait for the server
 
-def publish_gist(json_files, description, gist_id):
-    # print headers,parameters,payload
-    headers = {'Authorization': f'token {etl_cfg.github.api_token}'}
-    params = {'scope': 'gist'}
-    payload = {"description": description,
-               "public": True,
-               "files": json_files
-               }
-
-    # make a request
-    print(payload)
-    res = requests.patch(etl_cfg.github.api_url + gist_id,
-                         headers=headers,
-                         params=params,
-                         data=json.dumps(payload))
-    print(res)
\ No newline at end of file
+    Returns:
+        tuple: dict with the hashes of the files sent to every gist updated,
+               to merge into `sent`, and dict with the error of every gist
+               that failed
+    """
+    pending = {}
+    for gist_id, gist in gists.items():
+        changed = changed_files(gist['files'], path, sent.get(gist_id, {}))
+        if changed:
+            pending[gist_id] = changed
+    published, errors = {}, {}
+    if not pending:
+        return published, errors
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            gist_id: executor.submit(
+                publish_gist, session, api_url, gist_id,
+                gists[gist_id]['description'], sorted(changed), path,
+                timeout)
+            for gist_id, changed in pending.items()}
+        for gist_id, future in futures.items():
+            try:
+                future.result()
+            except requests.RequestException as error:
+                errors[gist_id] = error
+            else:
+                published[gist_id] = pending[gist_id]
+    return published, errors
@@ -0,0 +1,233 @@
+"""Append-only history of the published figures, in a SQLite database.
+
+Every release of the source data that changes a figure adds a row to
+`releases` and, for each changed cell of a fecha x ccaa x variable cube,
+one row to `cells` with its new value. A cell removed from a dataset gets
+a NULL value. Unchanged cells add nothing, so the database grows with the
+revisions, not with the number of runs:
+
+    releases (release, released, commit_sha)
+    cells (dataset, fecha, ccaa, variable, release, value)
+
+National datasets have no ccaa dimension; their cells have ccaa ''.
+
+The primary key of `cells` serves both queries without reading anything
+else: the figures of a dataset as of a release (as_of) and the revisions
+of one cell (revisions). From the command line:
+
+    python -m etl.history as-of todos_ccaa_acumulado 2020-05-01
+    python -m etl.history revisions todos_ccaa_acumulado 2020-04-01 \
+        Madrid casos
+
+"""
+
+import argparse
+
+from .config import etl_cfg
+
+import csv
+
+from itertools import product
+
+import json
+
+import sqlite3
+
+import sys
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS releases (
+    release INTEGER PRIMARY KEY,
+    released TEXT NOT NULL,
+    commit_sha TEXT NOT NULL DEFAULT '',
+    UNIQUE (released, commit_sha)
+);
+CREATE TABLE IF NOT EXISTS cells (
+    dataset TEXT NOT NULL,
+    fecha TEXT NOT NULL,
+    ccaa TEXT NOT NULL,
+    variable TEXT NOT NULL,
+    release INTEGER NOT NULL REFERENCES releases,
+    value,
+    PRIMARY KEY (dataset, fecha, ccaa, variable, release)
+) WITHOUT ROWID;
+'''
+
+
+def connect(file_name):
+    """Open the history database, creating its tables if needed."""
+    connection = sqlite3.connect(file_name, timeout=60)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def jsonstat_cells(document):
+    """Cells of a JSON-stat dataset with fecha, Variables and maybe ccaa.
+
+    Returns:
+        dict: (fecha, ccaa, variable) as key and value as value, without
+              the null cells
+    """
+    dimensions = [
+        sorted(document['dimension'][name]['category']['index'],
+               key=document['dimension'][name]['category']['index'].get)
+        for name in document['id']]
+    cells = {}
+    for key, value in zip(product(*dimensions), document['value']):
+        if value is None:
+            continue
+        key = dict(zip(document['id'], key))
+        cells[key['fecha'], key.get('ccaa', ''), key['Variables']] = value
+    return cells
+
+
+def latest(connection, dataset, release=None):
+    """Figures of a dataset as of a release, the last one by default.
+
+    Returns:
+        dict: (fecha, ccaa, variable) as key and value as value
+    """
+    # SQLite takes the bare columns from the row holding MAX(release)
+    rows = connection.execute(
+        'SELECT fecha, ccaa, variable, value, MAX(release) FROM cells '
+        'WHERE dataset = ? AND release <= ? '
+        'GROUP BY fecha, ccaa, variable',
+        (dataset, sys.maxsize if release is None else release))
+    return {(fecha, ccaa, variable): value
+            for fecha, ccaa, variable, value, _ in rows
+            if value is not None}
+
+
+def record(connection, dataset, cells, released, commit=''):
+    """Store the cells of a dataset that changed since the last release.
+
+        connection (Connection): see connect
+        dataset (str): dataset name
+        cells (dict): current figures, as returned by jsonstat_cells
+        released (str): ISO date and time of the release
+        commit (str): commit of the source data, if known
+
+    Datasets recorded with the same released and commit share a release.
+    The first figures recorded for a release are kept: recording the
+    dataset again with the same released and commit stores nothing, and
+    the figures that differ are recorded with the next release.
+
+    Returns:
+        int: number of cells stored
+    """
+    previous = latest(connection, dataset)
+    changes = [(key, value) for key, value in cells.items()
+               if previous.get(key) != value]
+    changes += [(key, None) for key in previous if key not in cells]
+    if not changes:
+        return 0
+    with connection:
+        connection.execute(
+            'INSERT OR IGNORE INTO releases (released, commit_sha) '
+            'VALUES (?, ?)', (released, commit))
+        release = connection.execute(
+            'SELECT release FROM releases '
+            'WHERE released = ? AND commit_sha = ?',
+            (released, commit)).fetchone()[0]
+        if connection.execute(
+                'SELECT 1 FROM cells WHERE dataset = ? AND release = ?',
+                (dataset, release)).fetchone():
+            return 0
+        stored = connection.executemany(
+            'INSERT OR IGNORE INTO cells VALUES (?, ?, ?, ?, ?, ?)',
+            [(dataset, fecha, ccaa, variable, release, value)
+             for (fecha, ccaa, variable), value in sorted(changes)])
+    return stored.rowcount
+
+
+def as_of(connection, dataset, released):
+    """Figures of a dataset as published at a date.
+
+        released (str): ISO date, or date and time; a date includes the
+                        releases of that day
+
+    Returns:
+        list: (fecha, ccaa, variable, value) tuples, sorted
+    """
+    release = connection.execute(
+        'SELECT MAX(release) FROM releases WHERE substr(released, 1, ?) <= ?',
+        (len(released), released)).fetchone()[0]
+    if release is None:
+        return []
+    return sorted((fecha, ccaa, variable, value) for (fecha, ccaa, variable),
+                  value in latest(connection, dataset, release).items())
+
+
+def revisions(connection, dataset, fecha, ccaa, variable):
+    """Every value published for one cell.
+
+    Returns:
+        list: (released, commit, value) tuples, oldest first; value is None
+              when the cell was removed
+    """
+    return connection.execute(
+        'SELECT released, commit_sha, value FROM cells '
+        'JOIN releases USING (release) '
+        'WHERE dataset = ? AND fecha = ? AND ccaa = ? AND variable = ? '
+        'ORDER BY release',
+        (dataset, fecha, ccaa, variable)).fetchall()
+
+
+def record_files(file_name, path, datasets, released, commit=''):
+    """Record JSON-stat output files in the history database.
+
+        file_name (str): history database
+        path (str): directory of the output files
+        datasets (list): dataset names; files are <name>.json-stat
+        released (str): ISO date and time of the release
+        commit (str): commit of the source data, if known
+
+    Returns:
+        dict: dataset name as key and number of cells stored as value
+    """
+    connection = connect(file_name)
+    try:
+        stored = {}
+        for dataset in datasets:
+            with open(path + dataset + '.json-stat', encoding='utf-8') as file:
+                cells = jsonstat_cells(json.load(file))
+            stored[dataset] = record(
+                connection, dataset, cells, released, commit)
+        return stored
+    finally:
+        connection.close()
+
+
+def main(argv=None):
+    """Print a query of the history database as CSV."""
+    parser = argparse.ArgumentParser(
+        description='Query the history of the published figures.')
+    commands = parser.add_subparsers(dest='command')
+    command = commands.add_parser(
+        'as-of', help='figures of a dataset as published at a date')
+    command.add_argument('dataset')
+    command.add_argument('released', help='ISO date, e.g. 2020-05-01')
+    command = commands.add_parser(
+        'revisions', help='values published for one cell')
+    command.add_argument('dataset')
+    command.add_argument('fecha')
+    command.add_argument('ccaa', help="'' for national datasets")
+    command.add_argument('variable')
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error('a command is required')
+    connection = connect(etl_cfg.output.history)
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    if args.command == 'as-of':
+        writer.writerow(['fecha', 'ccaa', 'variable', 'value'])
+        writer.writerows(as_of(connection, args.dataset, args.released))
+    else:
+        writer.writerow(['released', 'commit', 'value'])
+        writer.writerows(revisions(
+            connection, args.dataset, args.fecha, args.ccaa, args.variable))
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
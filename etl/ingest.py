@@ -0,0 +1,170 @@
+"""Typed reading of the input .csv files, with a snapshot cache.
+
+Every input in etl_cfg.input.files is parsed with an explicit schema:
+dates as datetime64, counts as nullable integers (Int64) and repeated
+labels (CCAA, provincia, sexo, rango_edad) as categoricals. Columns not
+listed in the schema keep the types inferred by pandas.
+
+The parsed dataframe is saved as a Feather snapshot named after the git
+blob SHA-1 of the source file, e.g. cache/casos.3f2a9c1b0d4e.feather, so
+that later runs memory-map the snapshot instead of parsing the .csv file
+again. Snapshots require the pyarrow package of the Pipfile; without it
+every run parses the .csv files.
+
+Large files can also be read in chunks of rows with read_chunks, which
+keeps the dtypes of the whole file in every chunk.
+
+"""
+
+import glob
+
+import os
+
+import pandas as pd
+
+from .state import blob_sha
+
+try:
+    from pyarrow import feather
+except ImportError:
+    feather = None
+
+
+CCAA_SERIES = {
+    'fecha': 'date', 'cod_ine': 'Int64', 'CCAA': 'category', 'total': 'Int64'}
+
+SCHEMAS = {
+    'alojamientos': {'CCAA': 'category', 'provincia': 'category'},
+    'altas': CCAA_SERIES,
+    'casos': CCAA_SERIES,
+    'eess': {'Provincia': 'category'},
+    'fallecidos': CCAA_SERIES,
+    'hospital': CCAA_SERIES,
+    'nacional': {
+        'fecha': 'date', 'casos_total': 'Int64', 'altas': 'Int64',
+        'fallecimientos': 'Int64', 'ingresos_uci': 'Int64',
+        'hospitalizados': 'Int64'},
+    'nacional_edad': {
+        'fecha': 'date', 'rango_edad': 'category', 'sexo': 'category',
+        'casos_confirmados': 'Int64', 'hospitalizados': 'Int64',
+        'ingresos_uci': 'Int64', 'fallecidos': 'Int64'},
+    'restauracion': {'Provincia': 'category'},
+    'uci': CCAA_SERIES
+}
+
+
+def _parse_dates(df, schema):
+    """Parse the date columns of a schema."""
+    for column, dtype in schema.items():
+        if dtype == 'date':
+            df[column] = pd.to_datetime(df[column], format='%Y-%m-%d')
+    return df
+
+
+def _dtypes(schema):
+    """Column types to give to pandas.read_csv."""
+    return {
+        column: dtype for column, dtype in schema.items() if dtype != 'date'}
+
+
+def read_csv(file_name, schema):
+    """Parse a .csv file with the given column types.
+
+        file_name (str): .csv file
+        schema (dict): column name as key and dtype as value; 'date'
+                       parses the column as %Y-%m-%d dates
+    """
+    df = pd.read_csv(file_name, sep=',', dtype=_dtypes(schema))
+    return _parse_dates(df, schema)
+
+
+def infer_dtypes(file_name, schema, chunksize):
+    """Infer, chunk by chunk, the dtypes pandas gives to the whole file.
+
+    Columns in the schema keep their type. Every other column is int64 if
+    it is an integer column in every chunk, float64 if it is numeric in
+    every chunk, bool if it is boolean in every chunk and text otherwise.
+
+    Returns:
+        dict: dtype of every column, for pandas.read_csv
+    """
+    dtype = _dtypes(schema)
+    kinds = {}
+    for chunk in pd.read_csv(
+            file_name, sep=',', dtype=dtype, chunksize=chunksize):
+        for column in chunk.columns:
+            if column not in schema:
+                kinds.setdefault(column, set()).add(chunk[column].dtype.kind)
+    for column, kind in kinds.items():
+        if kind == {'i'}:
+            dtype[column] = 'int64'
+        elif kind <= {'i', 'f'}:
+            dtype[column] = 'float64'
+        elif kind == {'b'}:
+            dtype[column] = 'bool'
+        else:
+            dtype[column] = str
+    return dtype
+
+
+def read_chunks(name, file_name, chunksize, prepare=None):
+    """Read an input file in chunks of rows.
+
+        name (str): input name, key of SCHEMAS
+        file_name (str): .csv file
+        chunksize (int): number of rows of every chunk
+        prepare (function): applied to every chunk
+
+    Every chunk has the dtypes of the whole file (see infer_dtypes) and
+    keeps the row numbers of the file as index. Memory use depends on the
+    chunk size, not on the size of the file.
+
+    Returns:
+        function: returns a new iterator over the chunks on every call
+    """
+    schema = SCHEMAS.get(name, {})
+    dtype = infer_dtypes(file_name, schema, chunksize)
+
+    def chunks():
+        for chunk in pd.read_csv(
+                file_name, sep=',', dtype=dtype, chunksize=chunksize):
+            chunk = _parse_dates(chunk, schema)
+            yield prepare(chunk) if prepare else chunk
+    return chunks
+
+
+def snapshot_name(cache_path, name, sha):
+    """File name of the snapshot of an input with the given hash."""
+    return cache_path + name + '.' + sha[:12] + '.feather'
+
+
+def read_input(name, file_name, cache_path=None):
+    """Read an input file, from its snapshot if there is one.
+
+        name (str): input name, key of SCHEMAS
+        file_name (str): .csv file
+        cache_path (str): directory of the snapshots; None disables them
+
+    Returns:
+        DataFrame: parsed input
+    """
+    schema = SCHEMAS.get(name, {})
+    if cache_path is None or feather is None:
+        return read_csv(file_name, schema)
+    snapshot = snapshot_name(cache_path, name, blob_sha(file_name))
+    if os.path.exists(snapshot):
+        return feather.read_table(snapshot, memory_map=True).to_pandas()
+    df = read_csv(file_name, schema)
+    os.makedirs(cache_path, exist_ok=True)
+    # Snapshots of previous versions of the input
+    for stale in glob.glob(snapshot_name(cache_path, name, '*')):
+        if stale != snapshot:
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+    # Stages run in parallel may write the same snapshot
+    tmp_name = '%s.%d.tmp' % (snapshot, os.getpid())
+    feather.write_feather(df, tmp_name)
+    os.replace(tmp_name, snapshot)
+    return df
@@ -0,0 +1,369 @@
+"""Direct JSON-stat 2.0 writer.
+
+Builds the id/size/dimension/value structure straight from the columns of
+a dataframe, so every dataset is serialized once, without melting the
+dataframe nor going through pyjstat.
+
+Output is equivalent to pyjstat.Dataset.read(melted_df).write() for the
+datasets of this project: categories sorted by value, a 'Variables'
+dimension with the metric names as last dimension, and values in
+row-major order of the dimensions. Long-format tables, with one row per
+cell, are written directly with long_to_jsonstat. stream_jsonstat writes
+tables of records chunk by chunk to a file. columns_to_jsonstat writes
+the same datasets as to_jsonstat from plain column arrays, without
+pandas, for the many small datasets exported in batches.
+
+Output is canonical, so that a dataset whose figures did not change is
+written with the same bytes: keys in a fixed order, compact separators,
+whole numbers as integers (1268, not 1268.0) and other numbers rounded to
+the 'decimals' of their unit metadata, or to a default precision.
+
+"""
+
+from collections import OrderedDict
+
+from datetime import datetime
+
+import json
+
+import tempfile
+
+import numpy as np
+
+import pandas as pd
+
+
+def _default(obj):
+    """Encode numpy scalars found in object columns."""
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    raise TypeError(repr(obj) + ' is not JSON serializable')
+
+
+# Separators of the compact JSON output
+SEPARATORS = (',', ':')
+
+# Types of numeric variables, as given by pandas.api.types.infer_dtype
+_NUMERIC = {'integer', 'floating', 'mixed-integer-float', 'decimal'}
+
+
+def _canonical(value, variables, unit=None, decimals=None):
+    """Write the numbers of every variable in canonical form, in place.
+
+        value (ndarray): object array of values in row-major order, with
+                         'Variables' as last dimension and None as nulls
+        variables (list): categories of the 'Variables' dimension
+        unit (dict): unit metadata of the variables, with their 'decimals'
+        decimals (int): decimals of the variables without unit metadata;
+                        None leaves them unrounded
+
+    Whole numbers become integers; text values are left as they are.
+    """
+    table = value.reshape(-1, len(variables))
+    for j, variable in enumerate(variables):
+        column = table[:, j]
+        present = pd.notnull(column)
+        numbers = column[present]
+        if not len(numbers) or \
+                pd.api.types.infer_dtype(numbers) not in _NUMERIC:
+            continue
+        numbers = numbers.astype('float64')
+        places = (unit or {}).get(variable, {}).get('decimals', decimals)
+        if places is not None:
+            numbers = numbers.round(places)
+        whole = np.isfinite(numbers) & (numbers == np.floor(numbers))
+        canonical = numbers.astype(object)
+        canonical[whole] = numbers[whole].astype('int64').astype(object)
+        column[present] = canonical
+    return value
+
+
+def _codes(values):
+    """Return the position of every value among its sorted categories.
+
+        values (Series): column of a dimension
+
+    Returns:
+        tuple: array of codes and list of categories, sorted by value
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype) and \
+            not values.cat.categories.is_monotonic_increasing:
+        values = values.astype(object)
+    codes, categories = pd.factorize(values, sort=True)
+    return codes, list(categories)
+
+
+def _dimension(name, categories, unit=None):
+    """Build a JSON-stat dimension object."""
+    keys = [str(category) for category in categories]
+    category = OrderedDict([
+        ('index', OrderedDict((key, i) for i, key in enumerate(keys))),
+        ('label', OrderedDict((key, key) for key in keys))])
+    # Metadata of these categories, in their order
+    unit = OrderedDict(
+        (key, OrderedDict(sorted(unit[key].items())))
+        for key in keys if key in (unit or {}))
+    if unit:
+        category['unit'] = unit
+    return OrderedDict([('label', name), ('category', category)])
+
+
+def _dataset(dimension, value, size, source, updated=None):
+    """Assemble a JSON-stat dataset, 'Variables' being the last dimension."""
+    return OrderedDict([
+        ('dimension', dimension),
+        ('value', value.tolist()),
+        ('version', '2.0'),
+        ('class', 'dataset'),
+        ('updated', (updated or datetime.today()).isoformat()),
+        ('source', source),
+        ('id', list(dimension)),
+        ('size', size),
+        ('role', {'metric': ['Variables']})])
+
+
+def to_jsonstat(df, id_vars, value_vars, source, unit=None, updated=None,
+                decimals=None):
+    """Encode a dataframe as a JSON-stat 2.0 dataset.
+
+        df (DataFrame): one row per combination of the id_vars
+        id_vars (list): index columns (dimensions)
+        value_vars (list): numeric variables (metrics), which become the
+                           categories of the 'Variables' dimension
+        source (str): source metadata
+        unit (dict): optional unit metadata of the metrics
+        updated (datetime): update date, defaults to now
+        decimals (int): decimals of the metrics without unit metadata
+
+    Returns:
+        str: serialized JSON-stat dataset
+    """
+    variables = sorted(value_vars)
+    codes, categories = zip(*[_codes(df[column]) for column in id_vars]) \
+        if id_vars else ((), ())
+    size = [len(c) for c in categories] + [len(variables)]
+
+    # Position of every cell in the row-major value array
+    rows = np.ravel_multi_index(codes, size[:-1]) if id_vars else \
+        np.zeros(len(df), dtype=int)
+    cells = (rows[:, None] * len(variables) + np.arange(len(variables)))
+
+    # Same common dtype as DataFrame.melt (e.g. int and float -> float)
+    data = df[variables].to_numpy()
+    value = np.full(int(np.prod(size)), None, dtype=object)
+    value[cells.ravel()] = data.astype(object).ravel()
+    value[pd.isnull(value)] = None
+    _canonical(value, variables, unit, decimals)
+
+    dimension = OrderedDict(
+        (column, _dimension(column, c))
+        for column, c in zip(id_vars, categories))
+    dimension['Variables'] = _dimension('Variables', variables, unit)
+    dataset = _dataset(dimension, value, size, source, updated)
+    return json.dumps(dataset, default=_default, separators=SEPARATORS)
+
+
+def long_to_jsonstat(df, id_vars, value, source, unit=None, updated=None,
+                     decimals=None):
+    """Encode a long-format dataframe as a JSON-stat 2.0 dataset.
+
+        df (DataFrame): one row per cell, with a 'Variables' column naming
+                        the metric of the cell
+        id_vars (list): index columns (dimensions), besides 'Variables'
+        value (str): column with the value of every cell
+        source (str): source metadata
+        unit (dict): optional unit metadata of the metrics
+        updated (datetime): update date, defaults to now
+        decimals (int): decimals of the metrics without unit metadata
+
+    Cells missing from df are null. The dataset is the same that
+    to_jsonstat writes for the wide table with one column per metric.
+
+    Returns:
+        str: serialized JSON-stat dataset
+    """
+    columns = list(id_vars) + ['Variables']
+    codes, categories = zip(*[_codes(df[column]) for column in columns])
+    size = [len(c) for c in categories]
+    values = np.full(int(np.prod(size)), None, dtype=object)
+    values[np.ravel_multi_index(codes, size)] = \
+        df[value].to_numpy().astype(object)
+    values[pd.isnull(values)] = None
+    _canonical(values, categories[-1], unit, decimals)
+
+    dimension = OrderedDict(
+        (column, _dimension(column, c))
+        for column, c in zip(id_vars, categories))
+    dimension['Variables'] = _dimension('Variables', categories[-1], unit)
+    dataset = _dataset(dimension, values, size, source, updated)
+    return json.dumps(dataset, default=_default, separators=SEPARATORS)
+
+
+def column_arrays(frame, id_vars, value_vars):
+    """Extract the columns of a dataset as compact arrays.
+
+        frame (DataFrame or dict): columns by name, as Series or arrays
+        id_vars (list): index columns (dimensions)
+        value_vars (list): variables (metrics)
+
+    Dimensions become object arrays of their values and numeric variables
+    float64 arrays with NaN as null, which are cheap to pickle and to
+    serialize with columns_to_jsonstat.
+
+    Returns:
+        dict: column name as key and array as value
+    """
+    columns = {}
+    for column in id_vars:
+        columns[column] = np.asarray(frame[column], dtype=object)
+    for column in value_vars:
+        values = frame[column]
+        if not pd.api.types.is_numeric_dtype(values.dtype) or \
+                pd.api.types.is_bool_dtype(values.dtype):
+            columns[column] = np.asarray(values, dtype=object)
+        elif hasattr(values, 'to_numpy'):
+            columns[column] = values.to_numpy(
+                dtype='float64', na_value=np.nan)
+        else:
+            columns[column] = np.asarray(values, dtype='float64')
+    return columns
+
+
+def _canonical_floats(table, variables, unit=None, decimals=None):
+    """Canonical values of a float table, with NaN as null.
+
+        table (ndarray): one column per variable
+
+    Returns:
+        ndarray: object array, as written by _canonical
+    """
+    value = np.full(table.shape, None, dtype=object)
+    for j, variable in enumerate(variables):
+        numbers = table[:, j]
+        places = (unit or {}).get(variable, {}).get('decimals', decimals)
+        if places is not None:
+            numbers = numbers.round(places)
+        present = ~np.isnan(numbers)
+        whole = np.isfinite(numbers) & (numbers == np.floor(numbers))
+        value[present, j] = numbers[present].astype(object)
+        value[whole, j] = numbers[whole].astype('int64').astype(object)
+    return value.ravel()
+
+
+def columns_to_jsonstat(columns, id_vars, value_vars, source, unit=None,
+                        updated=None, decimals=None):
+    """Encode column arrays as a JSON-stat 2.0 dataset.
+
+        columns (dict): arrays of the columns, as returned by column_arrays
+
+    The other arguments and the output are those of to_jsonstat, but only
+    numpy is used, which saves most of the cost of small datasets.
+
+    Returns:
+        str: serialized JSON-stat dataset
+    """
+    variables = sorted(value_vars)
+    codes, categories = [], []
+    for column in id_vars:
+        uniques, inverse = np.unique(columns[column], return_inverse=True)
+        codes.append(inverse)
+        categories.append(uniques.tolist())
+    size = [len(c) for c in categories] + [len(variables)]
+    length = len(columns[variables[0]])
+    rows = np.ravel_multi_index(codes, size[:-1]) if id_vars else \
+        np.zeros(length, dtype=int)
+
+    data = [columns[variable] for variable in variables]
+    if all(column.dtype.kind == 'f' for column in data):
+        table = np.full((int(np.prod(size[:-1])), len(variables)), np.nan)
+        table[rows] = np.column_stack(data)
+        value = _canonical_floats(table, variables, unit, decimals)
+    else:
+        value = np.full(int(np.prod(size)), None, dtype=object)
+        cells = rows[:, None] * len(variables) + np.arange(len(variables))
+        value[cells.ravel()] = np.column_stack(data).astype(object).ravel()
+        value[pd.isnull(value)] = None
+        _canonical(value, variables, unit, decimals)
+
+    dimension = OrderedDict(
+        (column, _dimension(column, c))
+        for column, c in zip(id_vars, categories))
+    dimension['Variables'] = _dimension('Variables', variables, unit)
+    dataset = _dataset(dimension, value, size, source, updated)
+    return json.dumps(dataset, default=_default, separators=SEPARATORS)
+
+
+# Placeholders of the parts of a dataset written by stream_jsonstat
+_INDEX, _LABEL, _VALUE = '@@index@@', '@@label@@', '@@value@@'
+
+
+def stream_jsonstat(file, chunks, id_var, value_vars, source, unit=None,
+                    updated=None, decimals=None):
+    """Write a table of records as a JSON-stat 2.0 dataset, chunk by chunk.
+
+        file (file): text file to write to
+        chunks (iterable): dataframes with consecutive rows of the table
+        id_var (str): record id column, increasing through all the chunks
+        value_vars (list): variables (metrics) of every record
+        source (str): source metadata
+        unit (dict): optional unit metadata of the metrics
+        updated (datetime): update date, defaults to now
+        decimals (int): decimals of the metrics without unit metadata
+
+    The output is the same as to_jsonstat(table, [id_var], value_vars, ...)
+    for the whole table, but only one chunk is held in memory: ids and
+    values go to temporary files until the size of the dataset is known.
+
+    Returns:
+        int: number of records
+    """
+    variables = sorted(value_vars)
+    rows = 0
+    last = None
+    with tempfile.TemporaryFile('w+') as index, \
+            tempfile.TemporaryFile('w+') as label, \
+            tempfile.TemporaryFile('w+') as values:
+        for chunk in chunks:
+            if not len(chunk):
+                continue
+            ids = chunk[id_var].to_numpy()
+            if (last is not None and ids[0] <= last) or \
+                    (ids[1:] <= ids[:-1]).any():
+                raise ValueError(id_var + ' must be increasing')
+            last = ids[-1]
+            keys = [json.dumps(str(i)) for i in ids.tolist()]
+            separator = ',' if rows else ''
+            index.write(separator + ','.join(
+                '%s:%d' % (key, rows + i) for i, key in enumerate(keys)))
+            label.write(separator + ','.join(
+                '%s:%s' % (key, key) for key in keys))
+            value = chunk[variables].to_numpy().astype(object).ravel()
+            value[pd.isnull(value)] = None
+            _canonical(value, variables, unit, decimals)
+            values.write(separator + json.dumps(
+                value.tolist(), default=_default, separators=SEPARATORS)[1:-1])
+            rows += len(chunk)
+
+        dimension = OrderedDict([(id_var, OrderedDict([
+            ('label', id_var),
+            ('category', OrderedDict([('index', _INDEX), ('label', _LABEL)]))
+        ]))])
+        dimension['Variables'] = _dimension('Variables', variables, unit)
+        dataset = _dataset(
+            dimension, np.array([_VALUE]), [rows, len(variables)], source,
+            updated)
+        text = json.dumps(dataset, default=_default, separators=SEPARATORS)
+        for placeholder, part in [
+                ('"%s"' % _INDEX, index), ('"%s"' % _LABEL, label),
+                ('["%s"]' % _VALUE, values)]:
+            before, text = text.split(placeholder, 1)
+            file.write(before)
+            file.write('{' if part is not values else '[')
+            part.seek(0)
+            for block in iter(lambda: part.read(1 << 20), ''):
+                file.write(block)
+            file.write('}' if part is not values else ']')
+        file.write(text)
+    return rows
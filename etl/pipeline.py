@@ -0,0 +1,182 @@
+"""Small dependency-graph executor for the ETL stages.
+
+A stage is a function that receives a dict with the dataframes of its
+inputs (names of etl_cfg.input.files) and writes its outputs (file names
+relative to etl_cfg.output.path). A stage may also require other stages,
+which are run before it. Stages whose requirements are satisfied run
+concurrently in a process pool.
+
+Each input is loaded once per run and the same dataframe is given to every
+stage that uses it (see Sources). A long-running process may keep the
+Sources between runs and discard only the inputs that changed.
+
+"""
+
+from collections import Counter, namedtuple
+
+from collections.abc import Mapping
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import os
+
+import time
+
+from .profiling import execute_stage
+
+
+Stage = namedtuple('Stage', ['name', 'func', 'inputs', 'outputs', 'requires'])
+Stage.__new__.__defaults__ = ((),)
+
+
+def outdated(stage, changed, output_path):
+    """Check if any input of the stage changed or any output is missing."""
+    return any(name in changed for name in stage.inputs) or \
+        not all(os.path.exists(output_path + o) for o in stage.outputs)
+
+
+def with_dependents(stages, selected):
+    """Add to the selected stages every stage that requires them."""
+    names = set(stage.name for stage in selected)
+    added = True
+    while added:
+        added = False
+        for stage in stages:
+            if stage.name not in names and \
+                    any(name in names for name in stage.requires):
+                names.add(stage.name)
+                added = True
+    return [stage for stage in stages if stage.name in names]
+
+
+def outputs_by_input(stages):
+    """Map every input name to the output files that depend on it."""
+    outputs = {}
+    for stage in stages:
+        for name in stage.inputs:
+            outputs.setdefault(name, set()).update(stage.outputs)
+    return {name: sorted(files) for name, files in outputs.items()}
+
+
+def sort_stages(stages):
+    """Sort stages so that every stage comes after the ones it requires.
+
+    Requirements on stages not in the list are considered satisfied.
+    """
+    pending = {stage.name: stage for stage in stages}
+    done = []
+    while pending:
+        ready = [stage for stage in pending.values()
+                 if not any(name in pending for name in stage.requires)]
+        if not ready:
+            raise ValueError(
+                'Circular requirements between stages: ' + ', '.join(pending))
+        for stage in ready:
+            done.append(stage)
+            del pending[stage.name]
+    return done
+
+
+class Sources(Mapping):
+    """Dataframes of the inputs, each loaded on first access and kept.
+
+    Stages share these dataframes and must treat them as read-only.
+    """
+
+    def __init__(self, load, names=None, frames=None, times=None):
+        self.load = load
+        self.names = names
+        self.frames = {} if frames is None else frames
+        # Seconds spent loading every input
+        self.times = {} if times is None else times
+
+    def select(self, names):
+        """View of some of the inputs, sharing the loaded dataframes."""
+        return Sources(self.load, list(names), self.frames, self.times)
+
+    def discard(self, names):
+        """Forget the dataframes of some inputs, to load them again."""
+        for name in names:
+            self.frames.pop(name, None)
+            self.times.pop(name, None)
+
+    def __getitem__(self, name):
+        if self.names is not None and name not in self.names:
+            raise KeyError(name)
+        if name not in self.frames:
+            start = time.perf_counter()
+            self.frames[name] = self.load(name)
+            self.times[name] = time.perf_counter() - start
+        return self.frames[name]
+
+    def __iter__(self):
+        return iter(self.frames if self.names is None else self.names)
+
+    def __len__(self):
+        return len(self.frames if self.names is None else self.names)
+
+
+# Sources of the current run; worker processes forked after they are
+# loaded share them instead of loading them again
+_sources = None
+
+
+def execute(stage, load, profile_dir=None):
+    """Run a stage with the sources of the run, returning its metrics."""
+    global _sources
+    if _sources is None or _sources.load is not load:
+        _sources = Sources(load)
+    return stage, execute_stage(stage, _sources, profile_dir)
+
+
+def run_stages(stages, load, jobs=1, profile_dir=None, sources=None,
+               streamed=()):
+    """Run stages in dependency order, yielding each one once finished.
+
+        stages (list): stages to run
+        load (function): returns the dataframe of an input, given its name
+        jobs (int): number of worker processes; 1 runs stages sequentially
+                    in the current process
+        profile_dir (str): directory of the cProfile stats, if any
+        sources (Sources): inputs kept from previous runs, if any; inputs
+                           loaded in this process are added to it
+        streamed (list): inputs that the stages read from their files in
+                         chunks; they are not loaded before forking
+
+    Yields:
+        tuple: stage and its metrics (see profiling.py)
+    """
+    global _sources
+    _sources = Sources(load) if sources is None else sources
+    try:
+        yield from _run_stages(
+            sort_stages(stages), load, jobs, profile_dir, streamed)
+    finally:
+        _sources = None
+
+
+def _run_stages(stages, load, jobs, profile_dir, streamed):
+    """Run sorted stages, serially or in a process pool."""
+    if jobs <= 1:
+        for stage in stages:
+            yield execute(stage, load, profile_dir)
+        return
+    # Load the inputs shared by several stages once, before forking
+    uses = Counter(name for stage in stages for name in stage.inputs)
+    for name in sorted(name for name, count in uses.items()
+                       if count > 1 and name not in streamed):
+        _sources[name]
+    pending = {stage.name: stage for stage in stages}
+    running = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for stage in list(pending.values()):
+                if not any(name in pending or name in running.values()
+                           for name in stage.requires):
+                    running[pool.submit(
+                        execute, stage, load, profile_dir)] = stage.name
+                    del pending[stage.name]
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                del running[future]
+                yield future.result()
@@ -0,0 +1,229 @@
+"""Compact column-oriented encoding for point-of-interest datasets.
+
+JSON-stat stores these tables as an id x Variables cube, so every text
+attribute is repeated once per cell. This encoding writes one array per
+column instead:
+
+    {
+        "class": "table",
+        "updated": "...",
+        "source": "...",
+        "size": 5761,
+        "columns": {
+            "provincia": {"categories": ["ÁLAVA", ...], "codes": [0, ...]},
+            "direccion": ["CALLE GASTEIZBIDEA, 59", ...],
+            "Latitud": [42.842917, ...]
+        }
+    }
+
+Categorical columns are dictionary-encoded (a missing value has a null
+code), coordinates are numbers and the row position is the record id.
+
+stream_columns writes the same table chunk by chunk, so that memory use
+does not grow with the number of records.
+
+Records can also be split into shards by province (see slug) and by
+tiles of a regular latitude/longitude grid (see tile_keys), so that
+clients only fetch the records of the area they show.
+
+"""
+
+from collections import OrderedDict
+
+from datetime import datetime
+
+import json
+
+import re
+
+import tempfile
+
+import unicodedata
+
+import numpy as np
+
+import pandas as pd
+
+
+def _nulls(values):
+    """Convert an array to a list, with None for missing values."""
+    values = values.astype(object)
+    values[pd.isnull(values)] = None
+    return values.tolist()
+
+
+def _values(df, column, numeric):
+    """Values of a column, as numbers if it is a numeric column."""
+    values = df[column]
+    if column in numeric:
+        values = pd.to_numeric(values, errors='coerce')
+    return values
+
+
+def _categories(values):
+    """Distinct non-null values, sorted as pandas.factorize does."""
+    return pd.factorize(pd.Series(list(values), dtype=object), sort=True)[1]
+
+
+def to_columns(df, columns, source, categorical=(), numeric=(),
+               updated=None):
+    """Encode a dataframe as a column-oriented JSON table.
+
+        df (DataFrame): one row per record
+        columns (list): columns to export
+        source (str): source metadata
+        categorical (list): columns to dictionary-encode
+        numeric (list): columns to convert to numbers, e.g. coordinates
+        updated (datetime): update date, defaults to now
+
+    Returns:
+        str: serialized table
+    """
+    encoded = OrderedDict()
+    for column in columns:
+        values = _values(df, column, numeric)
+        if column in categorical:
+            # Categories sorted by value, whatever the order of the dtype
+            codes, categories = pd.factorize(values.astype(object), sort=True)
+            codes = codes.astype(object)
+            codes[codes == -1] = None
+            encoded[column] = OrderedDict([
+                ('categories', _nulls(categories.to_numpy())),
+                ('codes', codes.tolist())])
+        else:
+            encoded[column] = _nulls(values.to_numpy())
+    dataset = OrderedDict([
+        ('class', 'table'),
+        ('updated', (updated or datetime.today()).isoformat()),
+        ('source', source),
+        ('size', len(df)),
+        ('columns', encoded)])
+    return json.dumps(dataset, separators=(',', ':'))
+
+
+def stream_columns(file, chunks, columns, source, categorical=(),
+                   numeric=(), updated=None):
+    """Write a table as a column-oriented JSON table, chunk by chunk.
+
+        file (file): text file to write to
+        chunks (function): returns a new iterator over dataframes with
+                           consecutive rows of the table; it is called twice
+        columns (list): columns to export
+        source (str): source metadata
+        categorical (list): columns to dictionary-encode
+        numeric (list): columns to convert to numbers, e.g. coordinates
+        updated (datetime): update date, defaults to now
+
+    The output is the same as to_columns for the whole table. A first pass
+    collects the categories, a second one writes every column to its own
+    temporary file, which are then joined.
+
+    Returns:
+        int: number of records
+    """
+    distinct = {column: set() for column in categorical if column in columns}
+    for chunk in chunks():
+        for column, values in distinct.items():
+            values.update(
+                _values(chunk, column, numeric).dropna().astype(object))
+    categories = {
+        column: _categories(values) for column, values in distinct.items()}
+
+    parts = {column: tempfile.TemporaryFile('w+') for column in columns}
+    try:
+        rows = 0
+        for chunk in chunks():
+            if not len(chunk):
+                continue
+            for column in columns:
+                values = _values(chunk, column, numeric)
+                if column in categories:
+                    codes = pd.Categorical(
+                        values.astype(object),
+                        categories=categories[column]).codes.astype(object)
+                    codes[codes == -1] = None
+                    values = codes.tolist()
+                else:
+                    values = _nulls(values.to_numpy())
+                parts[column].write(
+                    (',' if rows else '') +
+                    json.dumps(values, separators=(',', ':'))[1:-1])
+            rows += len(chunk)
+
+        encoded = OrderedDict()
+        for column in columns:
+            placeholder = '@@%s@@' % column
+            if column in categories:
+                encoded[column] = OrderedDict([
+                    ('categories', _nulls(categories[column].to_numpy())),
+                    ('codes', placeholder)])
+            else:
+                encoded[column] = placeholder
+        dataset = OrderedDict([
+            ('class', 'table'),
+            ('updated', (updated or datetime.today()).isoformat()),
+            ('source', source),
+            ('size', rows),
+            ('columns', encoded)])
+        text = json.dumps(dataset, separators=(',', ':'))
+        for column in columns:
+            before, text = text.split(json.dumps('@@%s@@' % column), 1)
+            file.write(before + '[')
+            parts[column].seek(0)
+            for block in iter(lambda: parts[column].read(1 << 20), ''):
+                file.write(block)
+            file.write(']')
+        file.write(text)
+    finally:
+        for part in parts.values():
+            part.close()
+    return rows
+
+
+def coordinates(df):
+    """Parse the Latitud and Longitud of every record as floats.
+
+    Records with a missing, non-numeric or out of range coordinate get NaN
+    in both.
+
+    Returns:
+        tuple: arrays of latitudes and longitudes
+    """
+    lat = pd.to_numeric(df['Latitud'], errors='coerce').to_numpy('float64')
+    lon = pd.to_numeric(df['Longitud'], errors='coerce').to_numpy('float64')
+    invalid = ~((np.abs(lat) <= 90) & (np.abs(lon) <= 180))
+    lat[invalid] = np.nan
+    lon[invalid] = np.nan
+    return lat, lon
+
+
+def tile_keys(lat, lon, size):
+    """Grid tile of every point, named 'row_column'.
+
+        lat, lon (ndarray): coordinates, NaN if unknown
+        size (float): side of the tiles, in degrees
+
+    Tile 'r_c' spans latitudes [r * size, (r + 1) * size) and longitudes
+    [c * size, (c + 1) * size); points without coordinates get None.
+
+    Returns:
+        ndarray: object array of tile names
+    """
+    known = ~np.isnan(lat)
+    keys = np.full(len(lat), None, dtype=object)
+    rows = np.floor(lat[known] / size).astype('int64')
+    columns = np.floor(lon[known] / size).astype('int64')
+    keys[known] = [
+        '%d_%d' % key for key in zip(rows.tolist(), columns.tolist())]
+    return keys
+
+
+def slug(name):
+    """ASCII, lowercase, hyphenated form of a name, to use in file names.
+
+    E.g. 'VALENCIA / VALÈNCIA' and 'Valencia_València' are both
+    'valencia-valencia'.
+    """
+    text = unicodedata.normalize('NFKD', str(name))
+    text = text.encode('ascii', 'ignore').decode('ascii').lower()
+    return re.sub(r'[^a-z0-9]+', '-', text).strip('-')
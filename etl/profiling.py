@@ -0,0 +1,127 @@
+"""Stage-level timing and memory instrumentation.
+
+execute_stage() runs a stage and returns its metrics:
+
+    {
+        "name": "regiones",
+        "rows_in": 4370,          # rows of the input dataframes used
+        "input_memory": 1081432,  # bytes used by the input dataframes
+        "wall_time": 0.84,        # seconds, loading the inputs included
+        "load_time": 0.05,        # seconds spent loading inputs not
+                                  # loaded by a previous stage
+        "cpu_time": 0.83,         # seconds
+        "tracemalloc_peak": 0,    # peak traced memory, only with --profile
+        "max_rss_kb": 152340,     # peak RSS of the process so far
+        "rows_out": 4541,
+        "files": 234,             # files serialized
+        "files_written": 3,       # files whose content changed
+        "bytes_out": 1200913,
+        "bytes_written": 15524
+    }
+
+Stages report their outputs with record_rows() and record_file(). A stage
+runs entirely in one process, so the counters are module globals reset
+before every stage.
+
+"""
+
+import cProfile
+
+from collections import OrderedDict
+
+import json
+
+import os
+
+import time
+
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+COUNTERS = ['rows_out', 'files', 'files_written', 'bytes_out',
+            'bytes_written']
+
+_output = dict.fromkeys(COUNTERS, 0)
+
+
+def record_rows(rows):
+    """Count the rows of an exported dataset."""
+    _output['rows_out'] += rows
+
+
+def record_file(size, written=True):
+    """Count a serialized output file and its size in bytes."""
+    _output['files'] += 1
+    _output['bytes_out'] += size
+    if written:
+        _output['files_written'] += 1
+        _output['bytes_written'] += size
+
+
+def max_rss():
+    """Peak resident set size of the current process, in kilobytes."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def execute_stage(stage, sources, profile_dir=None):
+    """Get the inputs of a stage, run it and measure it.
+
+        stage (Stage): stage to run
+        sources (pipeline.Sources): dataframe of every input, loaded when
+                                    the stage first asks for it
+        profile_dir (str): if given, trace memory allocations and dump the
+                           cProfile stats to <profile_dir>/<stage>.prof
+
+    Returns:
+        OrderedDict: metrics of the stage
+    """
+    for counter in COUNTERS:
+        _output[counter] = 0
+    profiler = cProfile.Profile() if profile_dir else None
+    if profiler:
+        tracemalloc.start()
+        profiler.enable()
+    wall, cpu = time.perf_counter(), time.process_time()
+    loaded = set(sources.frames)
+    try:
+        stage.func(sources.select(stage.inputs))
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    finally:
+        # Stop tracing even if the stage fails, or the next stages of the
+        # process would run traced
+        if profiler:
+            profiler.disable()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    frames = [sources.frames[name] for name in stage.inputs
+              if name in sources.frames]
+    metrics = OrderedDict([
+        ('name', stage.name),
+        ('rows_in', sum(len(df) for df in frames)),
+        ('input_memory', int(sum(
+            df.memory_usage(deep=True).sum() for df in frames))),
+        ('wall_time', round(wall, 4)),
+        ('load_time', round(sum(
+            sources.times[name] for name in stage.inputs
+            if name in sources.frames and name not in loaded), 4))])
+    metrics['cpu_time'] = round(cpu, 4)
+    if profiler:
+        metrics['tracemalloc_peak'] = peak
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(profile_dir, stage.name + '.prof'))
+    metrics['max_rss_kb'] = max_rss()
+    metrics.update((counter, _output[counter]) for counter in COUNTERS)
+    return metrics
+
+
+def write_report(report, file_name):
+    """Write the run report as JSON."""
+    with open(file_name, 'w') as file:
+        json.dump(report, file, indent=2)
@@ -0,0 +1,334 @@
+"""Local HTTP service answering slice queries over the JSON-stat outputs.
+
+    python -m etl.server [--host HOST] [--port PORT]
+
+Requests:
+
+    GET /                  datasets, with the size of their dimensions
+    GET /<dataset>?ccaa=Cantabria,Madrid&from=2020-04-01&Variables=casos
+
+Every dimension of a dataset can be filtered with a comma-separated list
+of category ids; 'from' and 'to' limit the 'fecha' dimension, both
+included. 'format' is 'jsonstat' (default) or 'csv'. The dataset name is
+the file name without the .json-stat extension.
+
+Datasets are read from etl_cfg.output.path when first queried, into an
+array with one axis per dimension, and read again when the ETL rewrites
+their file; a file that cannot be read, e.g. while it is being replaced,
+gets a 503 response. Serialized responses are kept in an LRU cache and carry an
+ETag, so a client sending If-None-Match gets a 304 if nothing changed.
+
+"""
+
+import argparse
+
+from collections import OrderedDict
+
+from .config import etl_cfg
+
+import csv
+
+import hashlib
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import io
+
+from itertools import product
+
+import json
+
+import os
+
+import threading
+
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+
+EXTENSION = '.json-stat'
+
+FORMATS = {
+    'jsonstat': 'application/json; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8'}
+
+
+class QueryError(ValueError):
+    """Invalid slice query."""
+
+
+class DatasetUnavailable(Exception):
+    """Dataset file that cannot be read, e.g. while being written."""
+
+
+class Dataset(object):
+    """JSON-stat dataset with its values as a multidimensional array."""
+
+    def __init__(self, document):
+        self.document = document
+        self.ids = document['id']
+        self.categories = [
+            sorted(document['dimension'][name]['category']['index'],
+                   key=document['dimension'][name]['category']['index'].get)
+            for name in self.ids]
+        self.values = np.array(document['value'], dtype=object).reshape(
+            document['size'])
+
+    def positions(self, name, keys=None, start=None, end=None):
+        """Positions of the selected categories of a dimension.
+
+            name (str): dimension id
+            keys (list): category ids, all of them if None
+            start (str), end (str): first and last category ids to keep,
+                                    compared as strings (ISO dates)
+        """
+        categories = self.categories[self.ids.index(name)]
+        if keys is None:
+            positions = range(len(categories))
+        else:
+            index = self.document['dimension'][name]['category']['index']
+            unknown = [key for key in keys if key not in index]
+            if unknown:
+                raise QueryError('Unknown %s: %s' % (name, ', '.join(unknown)))
+            positions = [index[key] for key in keys]
+        return [i for i in positions
+                if (start is None or categories[i] >= start) and
+                (end is None or categories[i] <= end)]
+
+    def slice(self, filters, start=None, end=None):
+        """Return the dataset restricted to some categories.
+
+            filters (dict): dimension id as key and list of category ids
+                            as value
+            start (str), end (str): range of the 'fecha' dimension
+
+        Returns:
+            tuple: list of the category ids kept for every dimension and
+                   array of the values
+        """
+        unknown = [name for name in filters if name not in self.ids]
+        if unknown:
+            raise QueryError('Unknown dimension: ' + ', '.join(unknown))
+        if (start or end) and 'fecha' not in self.ids:
+            raise QueryError('The dataset has no fecha dimension')
+        positions = [
+            self.positions(name, filters.get(name),
+                           *((start, end) if name == 'fecha' else ()))
+            for name in self.ids]
+        keys = [[categories[i] for i in kept] for categories, kept
+                in zip(self.categories, positions)]
+        return keys, self.values[np.ix_(*positions)]
+
+    def to_jsonstat(self, keys, values):
+        """Serialize a slice as a JSON-stat dataset."""
+        document = OrderedDict(self.document)
+        dimension = OrderedDict()
+        for name, kept in zip(self.ids, keys):
+            old = self.document['dimension'][name]
+            category = OrderedDict([
+                ('index', OrderedDict((key, i) for i, key in enumerate(kept))),
+                ('label', OrderedDict(
+                    (key, old['category']['label'][key]) for key in kept))])
+            if 'unit' in old['category']:
+                category['unit'] = OrderedDict(
+                    (key, old['category']['unit'][key]) for key in kept
+                    if key in old['category']['unit'])
+            dimension[name] = OrderedDict([
+                ('label', old['label']), ('category', category)])
+        document['dimension'] = dimension
+        document['value'] = values.ravel().tolist()
+        document['size'] = list(values.shape)
+        return json.dumps(document, separators=(',', ':'))
+
+    def to_csv(self, keys, values):
+        """Serialize a slice as a table, one row per cell."""
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerow(self.ids + ['value'])
+        for row, value in zip(product(*keys), values.ravel()):
+            writer.writerow(row + ('' if value is None else value,))
+        return output.getvalue()
+
+
+class Store(object):
+    """Datasets of a directory, read when first used and when changed."""
+
+    def __init__(self, path):
+        self.path = path
+        self.datasets = {}
+        self.lock = threading.Lock()
+
+    def names(self):
+        """Names of the datasets in the directory."""
+        return sorted(name[:-len(EXTENSION)] for name in os.listdir(self.path)
+                      if name.endswith(EXTENSION))
+
+    def get(self, name):
+        """Return a dataset and its version, reading it if it changed.
+
+        Raises:
+            KeyError: if there is no such dataset
+            DatasetUnavailable: if its file cannot be read
+        """
+        file_name = os.path.join(self.path, name + EXTENSION)
+        if os.path.basename(name) != name:
+            raise KeyError(name)
+        try:
+            stat = os.stat(file_name)
+        except FileNotFoundError:
+            raise KeyError(name)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if name in self.datasets and self.datasets[name][1] == version:
+                return self.datasets[name]
+            try:
+                with open(file_name, encoding='utf-8') as file:
+                    dataset = Dataset(json.load(
+                        file, object_pairs_hook=OrderedDict))
+            except (ValueError, OSError) as error:
+                raise DatasetUnavailable(name) from error
+            self.datasets[name] = dataset, version
+            return self.datasets[name]
+
+
+class LRUCache(object):
+    """Thread-safe mapping that keeps the most recently used items."""
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return an item, or None, marking it as the most recently used."""
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def put(self, key, value):
+        """Add an item, dropping the least recently used if full."""
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+
+def parse_query(query):
+    """Split a query string into filters, date range and format."""
+    params = parse_qs(query, keep_blank_values=True)
+    single = {}
+    for name in ['from', 'to', 'format']:
+        values = params.pop(name, [None])
+        if len(values) > 1:
+            raise QueryError('Repeated parameter: ' + name)
+        single[name] = values[0]
+    fmt = single['format'] or 'jsonstat'
+    if fmt not in FORMATS:
+        raise QueryError('Unknown format: ' + fmt)
+    filters = {name: [key for value in values for key in value.split(',')]
+               for name, values in params.items()}
+    return filters, single['from'], single['to'], fmt
+
+
+def respond(store, cache, path, query):
+    """Serialize the response to a request.
+
+    Returns:
+        tuple: body, content type and ETag
+    """
+    name = path.strip('/')
+    if not name:
+        index = OrderedDict()
+        for name in store.names():
+            dataset = store.get(name)[0]
+            index[name] = OrderedDict(zip(dataset.ids, dataset.values.shape))
+        body = json.dumps(index).encode('utf-8')
+        return body, FORMATS['jsonstat'], etag(body)
+    dataset, version = store.get(name)
+    filters, start, end, fmt = parse_query(query)
+    key = (name, version, fmt, start, end,
+           tuple(sorted((k, tuple(v)) for k, v in filters.items())))
+    response = cache.get(key)
+    if response is None:
+        keys, values = dataset.slice(filters, start, end)
+        if fmt == 'csv':
+            body = dataset.to_csv(keys, values)
+        else:
+            body = dataset.to_jsonstat(keys, values)
+        body = body.encode('utf-8')
+        response = body, FORMATS[fmt], etag(body)
+        cache.put(key, response)
+    return response
+
+
+def etag(body):
+    """Strong ETag of a response body."""
+    return '"%s"' % hashlib.sha1(body).hexdigest()[:20]
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Answer GET requests with slices of the datasets of the server."""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            body, content_type, tag = respond(
+                self.server.store, self.server.cache, url.path, url.query)
+        except KeyError:
+            self.send_error(404, 'Unknown dataset')
+            return
+        except QueryError as error:
+            self.send_error(400, str(error))
+            return
+        except DatasetUnavailable:
+            self.send_error(503, 'Dataset being updated')
+            return
+        matches = self.headers.get('If-None-Match', '')
+        if tag in [match.strip() for match in matches.split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', tag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', tag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(path, host, port, cache_size=256):
+    """Return an HTTP server over the datasets of a directory."""
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.store = Store(path)
+    server.cache = LRUCache(cache_size)
+    return server
+
+
+def main(argv=None):
+    """Serve the outputs of the ETL until interrupted."""
+    cfg = etl_cfg.server
+    parser = argparse.ArgumentParser(
+        description='Slice queries over the COVID-19 datasets.')
+    parser.add_argument('--host', default=cfg.host)
+    parser.add_argument('--port', type=int, default=cfg.port)
+    args = parser.parse_args(argv)
+    server = make_server(
+        etl_cfg.output.path, args.host, args.port, cfg.cache_size)
+    print("Sirviendo %s en http://%s:%d/" % (
+        etl_cfg.output.path, args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
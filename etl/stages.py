@@ -0,0 +1,966 @@
+"""ETL stages: one function per group of output datasets.
+
+Every stage receives a mapping with the dataframes of its declared inputs
+and writes its outputs to etl_cfg.output.path. Each input is loaded and
+prepared once per run (see load and pipeline.Sources): national totals
+dropped, columns renamed and dates shifted a single time. The same
+dataframe is shared by all the stages that use it, so stages must not
+modify it; they derive new frames with rename, selections or merges.
+
+"""
+
+from .artifacts import build_artifacts
+
+from collections import OrderedDict, namedtuple
+
+from concurrent.futures import ProcessPoolExecutor
+
+from .config import etl_cfg
+
+from datetime import datetime
+
+import hashlib
+
+from .history import record_files
+
+import json
+
+from .ingest import read_chunks, read_input
+
+from .jsonstat import (
+    column_arrays, columns_to_jsonstat, long_to_jsonstat, stream_jsonstat,
+    to_jsonstat)
+
+from numpy import concatenate, isnan, nan, repeat
+
+import os
+
+import pandas as pd
+
+import pickle
+
+from .pipeline import Stage
+
+from .points import coordinates, slug, stream_columns, tile_keys, to_columns
+
+from .profiling import record_file, record_rows
+
+import re
+
+import tempfile
+
+from .transforms import (
+    deacumulate, delay_date, doubling_time, variation, window_sum)
+
+from .writers import WRITERS, available, long_table, to_table, write_formats
+
+
+# Update date of a serialized dataset, ignored when comparing contents
+UPDATED = re.compile(r'"updated":\s*"[^"]*"')
+
+
+def prepare_series(df):
+    """Drop the national total, sort by region and date and shift dates."""
+    df = df[df.CCAA != 'Total'].sort_values(
+        by=['cod_ine', 'fecha'], kind='mergesort').reset_index(drop=True)
+    return delay_date(df)
+
+
+def prepare_eess(df):
+    """Rename columns, number rows and use decimal points."""
+    df = df.rename(columns={
+        'Horario': 'horario',
+        'Provincia': 'provincia',
+        'Municipio': 'municipio',
+        'Código\nPostal': 'codigo_postal',
+        'Dirección': 'direccion',
+        'Margen': 'margen',
+        'Rótulo': 'rotulo'})
+    df['id'] = df.index.to_numpy()
+    # Series.replace, unlike the .str accessor, leaves no reference cycle
+    # behind, so streamed chunks are freed as soon as they are written
+    df['Latitud'] = df['Latitud'].replace(',', '.', regex=True)
+    df['Longitud'] = df['Longitud'].replace(',', '.', regex=True)
+    return df
+
+
+def prepare_restauracion(df):
+    """Rename columns and number rows."""
+    df = df.rename(columns={
+        'NOMBRE': 'nombre',
+        'Tipo': 'tipo',
+        'Direccion': 'direccion',
+        'Municipio': 'municipio',
+        'Provincia': 'provincia',
+        'Comentarios': 'comentario',
+        'Horario': 'horario',
+        'Telefono': 'telefono',
+        'Bocata_Bebida_Caliente': 'bocadillo_bebida_caliente',
+        'Comida_Preparada': 'comida_preparada',
+        'Ducha': 'ducha'})
+    df['id'] = df.index.to_numpy()
+    return df
+
+
+def prepare_alojamientos(df):
+    """Rename columns, number rows and name Cantabria as a province."""
+    df = df.rename(columns={
+        'CCAA': 'ccaa', 'lat': 'Latitud', 'long': 'Longitud'})
+    # Categories cannot be replaced by another category in place
+    df['provincia'] = df.provincia.astype(object).replace(
+        'Santander', 'Cantabria').astype('category')
+    df['id'] = df.index.to_numpy()
+    return df
+
+
+# Preparation of every input, applied once after reading it
+PREPARE = {
+    'alojamientos': prepare_alojamientos,
+    'altas': prepare_series,
+    'casos': prepare_series,
+    'eess': prepare_eess,
+    'fallecidos': prepare_series,
+    'hospital': prepare_series,
+    'nacional': delay_date,
+    'restauracion': prepare_restauracion,
+    'uci': prepare_series
+}
+
+
+def load(name):
+    """Read an input .csv file into a typed dataframe and prepare it."""
+    df = read_input(
+        name, etl_cfg.input.dir_path + etl_cfg.input.files[name],
+        etl_cfg.output.cache)
+    prepare = PREPARE.get(name)
+    return prepare(df) if prepare else df
+
+
+def to_json(df, id_vars, value_vars, unit=None):
+    """Export dataframe to JSON-Stat dataset.
+
+        id_vars (list): index columns
+        value_vars (list): numeric variables (metrics)
+        unit (dict): optional unit metadata of the variables
+    """
+    record_rows(len(df))
+    return to_jsonstat(
+        df, id_vars, value_vars, etl_cfg.metadata.source, unit=unit,
+        decimals=etl_cfg.output.decimals)
+
+
+def long_to_json(df, id_vars, value, unit=None):
+    """Export long format dataframe to JSON-Stat dataset.
+
+        id_vars (list): index columns, besides 'Variables'
+        value (str): column with the values
+        unit (dict): optional unit metadata of the variables
+    """
+    record_rows(len(df))
+    return long_to_jsonstat(
+        df, id_vars, value, etl_cfg.metadata.source, unit=unit,
+        decimals=etl_cfg.output.decimals)
+
+
+def replace_file(json_data, file_name):
+    """Write a dataset to a file, unless its content did not change.
+
+    The update date is ignored in the comparison, so an unchanged dataset
+    keeps the file, and the date, of its last change. The dataset goes to
+    a temporary file first, which then replaces the file, so that readers
+    such as server.py never see it half written.
+
+    Returns:
+        tuple: size of the dataset in bytes, and True if it was written
+    """
+    try:
+        with open(file_name) as file:
+            current = file.read()
+    except IOError:
+        current = None
+    changed = current is None or \
+        UPDATED.sub('', current, 1) != UPDATED.sub('', json_data, 1)
+    if changed:
+        tmp_name = file_name + '.tmp'
+        with open(tmp_name, 'w') as file:
+            file.write(json_data)
+        os.replace(tmp_name, file_name)
+    return len(json_data.encode()), changed
+
+
+def write_to_file(json_data, file_name):
+    """Write a dataset to a file, unless its content did not change.
+
+    Returns:
+        bool: True if the file was written (see replace_file)
+    """
+    size, changed = replace_file(json_data, file_name)
+    record_file(size, changed)
+    return changed
+
+
+def dataset_formats(name):
+    """Formats of a dataset besides JSON-Stat (see writers.py).
+
+        name (str): output file name, without extension
+    """
+    return available(etl_cfg.output.formats.get(name, []))
+
+
+def dataset_outputs(names):
+    """Output files of some datasets, in JSON-Stat and their formats."""
+    return [name + extension for name in names
+            for extension in ['.json-stat'] +
+            [WRITERS[f][0] for f in dataset_formats(name)]]
+
+
+def write_tables(tables, name):
+    """Write a dataset in the formats configured for it, if any.
+
+        tables (function): returns the tables of the dataset, built by
+                           writers.to_table, only if there are formats
+        name (str): output file name, without extension
+    """
+    formats = dataset_formats(name)
+    if formats:
+        write_formats(
+            tables, etl_cfg.output.path + name, formats,
+            etl_cfg.output.row_group_size)
+
+
+def write_dataset(df, id_vars, value_vars, name, unit=None):
+    """Write a dataset as JSON-Stat and in the formats configured for it.
+
+        name (str): output file name, without extension
+    """
+    write_to_file(
+        to_json(df, id_vars, value_vars, unit=unit),
+        etl_cfg.output.path + name + '.json-stat')
+    write_tables(lambda: [to_table(
+        df, id_vars, value_vars, unit, etl_cfg.output.decimals)], name)
+
+
+def write_long_dataset(df, id_vars, value, name, unit=None):
+    """Write a long-format dataset as JSON-Stat and in its formats."""
+    write_to_file(
+        long_to_json(df, id_vars, value, unit=unit),
+        etl_cfg.output.path + name + '.json-stat')
+    write_tables(lambda: [long_table(
+        df, id_vars, value, unit, etl_cfg.output.decimals)], name)
+
+
+# Dataset exported by export_jsonstat: frame is a DataFrame or a dict of
+# Series or arrays, of which only the id_vars and value_vars are used
+Export = namedtuple(
+    'Export', ['frame', 'id_vars', 'value_vars', 'unit', 'file_name'])
+
+
+def plain(value):
+    """Copy nested settings as plain dicts.
+
+    Settings of etl_cfg pickled to another process would carry the
+    attributes of their class as an extra '__dict__' key.
+    """
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    return value
+
+
+def write_columns(batch, source, decimals=None):
+    """Serialize and write datasets given as column arrays.
+
+        batch (list): Export tuples with column_arrays as frame
+        source (str): source metadata
+        decimals (int): decimals of the metrics without unit metadata
+
+    Returns:
+        list: size and written flag of every file (see replace_file)
+    """
+    return [
+        replace_file(columns_to_jsonstat(
+            columns, id_vars, value_vars, source, unit=unit,
+            decimals=decimals), file_name)
+        for columns, id_vars, value_vars, unit, file_name in batch]
+
+
+def export_jsonstat(exports, workers=None):
+    """Export many small datasets to JSON-Stat files.
+
+        exports (list): Export tuples
+        workers (int): processes serializing the datasets, by default
+                       etl_cfg.output.export_workers; 1 serializes them in
+                       the current process
+
+    Only the columns of every dataset, as compact arrays, are sent to the
+    workers, in one batch of consecutive datasets per worker. Files are
+    written as in write_to_file; the other formats of the datasets, in this
+    process.
+    """
+    if workers is None:
+        workers = etl_cfg.output.export_workers
+    batch = []
+    for frame, id_vars, value_vars, unit, file_name in exports:
+        write_tables(
+            lambda: [to_table(frame, id_vars, value_vars, unit,
+                              etl_cfg.output.decimals)],
+            os.path.basename(os.path.splitext(file_name)[0]))
+        columns = column_arrays(frame, id_vars, value_vars)
+        record_rows(len(columns[value_vars[0]]))
+        batch.append(Export(
+            columns, id_vars, value_vars, plain(unit), file_name))
+    args = (etl_cfg.metadata.source, etl_cfg.output.decimals)
+    workers = min(workers, len(batch))
+    if workers <= 1:
+        results = write_columns(batch, *args)
+    else:
+        step = -(-len(batch) // workers)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(write_columns, batch[i:i + step], *args)
+                for i in range(0, len(batch), step)]
+            results = [result for future in futures
+                       for result in future.result()]
+    for size, changed in results:
+        record_file(size, changed)
+
+
+def content_digest(file_name, block=1 << 20):
+    """SHA-256 of a text file without its update date, read in blocks."""
+    digest = hashlib.sha256()
+    pending = ''
+    found = False
+    with open(file_name) as file:
+        for text in iter(lambda: file.read(block), ''):
+            pending += text
+            if not found:
+                match = UPDATED.search(pending)
+                if match:
+                    pending = pending[:match.start()] + pending[match.end():]
+                    found = True
+            # Keep the tail, which may hold the beginning of the date
+            keep = 0 if found else 200
+            digest.update(pending[:len(pending) - keep].encode())
+            pending = pending[len(pending) - keep:]
+    digest.update(pending.encode())
+    return digest.hexdigest()
+
+
+def write_stream(write, file_name):
+    """Write a dataset to a file with write(file), unless it did not change.
+
+    The dataset goes to a temporary file first, which replaces the file
+    only if it differs, as in write_to_file.
+
+    Returns:
+        bool: True if the file was written
+    """
+    tmp_name = file_name + '.tmp'
+    with open(tmp_name, 'w') as file:
+        write(file)
+    changed = not os.path.exists(file_name) or \
+        content_digest(tmp_name) != content_digest(file_name)
+    record_file(os.path.getsize(tmp_name), changed)
+    if changed:
+        os.replace(tmp_name, file_name)
+    else:
+        os.remove(tmp_name)
+    return changed
+
+
+def point_chunks(data, source):
+    """Records of a point-of-interest input, in chunks if so configured.
+
+        data (dict): dataframes of the inputs of the stage
+        source (str): input name
+
+    Returns:
+        function: returns a new iterator over the dataframes; the input file
+                  is read in chunks of etl_cfg.output.chunksize rows if set,
+                  otherwise the dataframe of the input is the only one
+    """
+    if etl_cfg.output.chunksize:
+        return read_chunks(
+            source, etl_cfg.input.dir_path + etl_cfg.input.files[source],
+            etl_cfg.output.chunksize, PREPARE.get(source))
+    return lambda: iter([data[source]])
+
+
+def streamed_inputs():
+    """Inputs that the stages read in chunks instead of taking whole."""
+    return list(POINTS) if etl_cfg.output.chunksize else []
+
+
+def write_points(data, source, name, variables, categorical=()):
+    """Export a point-of-interest dataset in the configured formats.
+
+        data (dict): dataframes of the inputs of the stage
+        source (str): input name
+        name (str): output file name, without extension
+        variables (list): exported columns; Latitud and Longitud are
+                          written as numbers in the columns format
+        categorical (list): columns dictionary-encoded in the columns format
+
+    If etl_cfg.output.chunksize is set, the input file is read and the
+    outputs are written in chunks of that many rows instead. The formats of
+    etl_cfg.output.formats are written with Latitud and Longitud as numbers.
+    """
+    formats = etl_cfg.output.points
+    numeric = ['Latitud', 'Longitud']
+    path = etl_cfg.output.path + name
+
+    def table(df):
+        return to_table(
+            df, ['id'], variables, decimals=etl_cfg.output.decimals,
+            numeric=numeric, whole=False)
+
+    if etl_cfg.output.chunksize:
+        chunks = point_chunks(data, source)
+        write_tables(lambda: (table(chunk) for chunk in chunks()), name)
+        if 'jsonstat' in formats:
+            write_stream(lambda file: record_rows(stream_jsonstat(
+                file, chunks(), 'id', variables, etl_cfg.metadata.source,
+                decimals=etl_cfg.output.decimals)),
+                path + '.json-stat')
+        if 'columns' in formats:
+            write_stream(lambda file: record_rows(stream_columns(
+                file, chunks, variables, etl_cfg.metadata.source,
+                categorical=categorical, numeric=numeric)),
+                path + '.columns.json')
+        return
+    df = data[source]
+    write_tables(lambda: [table(df)], name)
+    if 'jsonstat' in formats:
+        json_file = to_json(df, ['id'], variables)
+        write_to_file(json_file, path + '.json-stat')
+    if 'columns' in formats:
+        record_rows(len(df))
+        json_file = to_columns(
+            df, variables, etl_cfg.metadata.source,
+            categorical=categorical, numeric=numeric)
+        write_to_file(json_file, path + '.columns.json')
+
+
+def point_outputs(name):
+    """Output files of a point-of-interest dataset."""
+    extensions = {'jsonstat': '.json-stat', 'columns': '.columns.json'}
+    return [name + extensions[f] for f in etl_cfg.output.points] + \
+        [name + WRITERS[f][0] for f in dataset_formats(name)]
+
+
+# Point-of-interest datasets: input name as key; output name, exported
+# columns and columns dictionary-encoded in the columns format as value
+POINTS = {
+    'eess': (
+        'eess_horario_flexible_habitual',
+        ['horario', 'provincia', 'municipio',
+         'codigo_postal', 'direccion', 'Latitud', 'Longitud',
+         'margen', 'rotulo'],
+        ['horario', 'provincia', 'municipio', 'margen', 'rotulo']),
+    'restauracion': (
+        'puntos_restauracion',
+        ['nombre', 'tipo', 'direccion', 'municipio',
+         'provincia', 'Latitud', 'Longitud', 'comentario',
+         'horario', 'telefono', 'bocadillo_bebida_caliente',
+         'comida_preparada', 'ducha'],
+        ['tipo', 'municipio', 'provincia', 'comentario',
+         'horario', 'bocadillo_bebida_caliente',
+         'comida_preparada', 'ducha']),
+    'alojamientos': (
+        'alojamientos_turisticos',
+        ['ccaa', 'provincia', 'localidad', 'nombre', 'Latitud', 'Longitud'],
+        ['ccaa', 'provincia', 'localidad'])
+}
+
+
+def eess(data):
+    """Estaciones de servicio."""
+    write_points(data, 'eess', *POINTS['eess'])
+
+
+def restauracion(data):
+    """Puntos de restauración."""
+    write_points(data, 'restauracion', *POINTS['restauracion'])
+
+
+def alojamientos(data):
+    """Alojamientos turísticos BOE 2020 4194."""
+    write_points(data, 'alojamientos', *POINTS['alojamientos'])
+
+
+def shard_index(name):
+    """Index file of the shards of a point-of-interest dataset."""
+    return 'puntos/' + name + '/index.json'
+
+
+def shard_parts(file_name, columns, rows):
+    """Iterate over the records appended to a file by write_shards.
+
+        file_name (str): file with a list of arrays, one per column, for
+                         every chunk of the dataset
+        columns (list): names of the columns
+        rows (int): the arrays are joined in dataframes of at least this
+                    number of rows, but the last one
+    """
+    block = []
+    with open(file_name, 'rb') as file:
+        while True:
+            try:
+                block.append(pickle.load(file))
+            except EOFError:
+                break
+            if sum(len(arrays[0]) for arrays in block) >= rows:
+                yield pd.DataFrame(OrderedDict(
+                    zip(columns, map(concatenate, zip(*block)))))
+                block = []
+    if block:
+        yield pd.DataFrame(OrderedDict(
+            zip(columns, map(concatenate, zip(*block)))))
+
+
+def write_shards(chunks, name, variables, categorical=()):
+    """Export a point-of-interest dataset by province and by grid tile.
+
+        chunks (function): returns a new iterator over dataframes with
+                           consecutive prepared records, with their 'id'
+        name (str): output name of the dataset
+        variables (list): exported columns, besides 'id'
+        categorical (list): columns dictionary-encoded
+
+    Shards are written in the columns format to puntos/<name>/provincia/
+    <province>.columns.json and puntos/<name>/tesela/<row>_<column>
+    .columns.json, with tiles of etl_cfg.output.tile_size degrees (see
+    points.tile_keys). puntos/<name>/index.json lists the shards with
+    their number of records and bounding box [lon, lat, lon, lat].
+    Shards of provinces or tiles left without records are removed.
+
+    The records of every chunk are appended to a temporary file per shard,
+    from which the shard is then written with stream_columns, so memory
+    use depends on the size of the chunks, not on that of the dataset.
+    """
+    size = etl_cfg.output.tile_size
+    folder = etl_cfg.output.path + shard_index(name)[:-len('index.json')]
+    columns = ['id'] + variables
+    kinds = ['provincia', 'tesela']
+    sizes = {kind: {} for kind in kinds}
+    names = {}
+    # Bounding box of the known coordinates of every province
+    bounds = {}
+    total = 0
+    with tempfile.TemporaryDirectory() as parts:
+        for kind in kinds:
+            os.mkdir(os.path.join(parts, kind))
+        for chunk in chunks():
+            total += len(chunk)
+            lat, lon = coordinates(chunk)
+            provinces = chunk.provincia.astype(object)
+            values = [chunk[column].to_numpy(object) for column in columns]
+            for kind, keys in [
+                    ('provincia',
+                     provinces.map(slug, na_action='ignore').to_numpy()),
+                    ('tesela', tile_keys(lat, lon, size))]:
+                groups = pd.Series(keys).groupby(keys).indices
+                for key, rows in groups.items():
+                    sizes[kind][key] = sizes[kind].get(key, 0) + len(rows)
+                    with open(os.path.join(parts, kind, key), 'ab') as file:
+                        pickle.dump([array[rows] for array in values], file)
+                    if kind != 'provincia':
+                        continue
+                    names.setdefault(key, set()).update(
+                        provinces.iloc[rows].astype(str))
+                    known = ~isnan(lat[rows])
+                    if known.any():
+                        x, y = lon[rows][known], lat[rows][known]
+                        box = [x.min(), y.min(), x.max(), y.max()]
+                        if key in bounds:
+                            old = bounds[key]
+                            box = [min(box[0], old[0]), min(box[1], old[1]),
+                                   max(box[2], old[2]), max(box[3], old[3])]
+                        bounds[key] = box
+
+        index = OrderedDict([
+            ('dataset', name), ('size', total), ('tile_size', size),
+            ('provincia', OrderedDict()), ('tesela', OrderedDict())])
+        for kind in kinds:
+            os.makedirs(folder + kind, exist_ok=True)
+            for key in sorted(sizes[kind]):
+                file_name = kind + '/' + key + '.columns.json'
+                part = os.path.join(parts, kind, key)
+                write_stream(lambda file: record_rows(stream_columns(
+                    file, lambda: shard_parts(
+                        part, columns, etl_cfg.output.chunksize or 1),
+                    columns, etl_cfg.metadata.source,
+                    categorical=categorical, numeric=['Latitud', 'Longitud'])),
+                    folder + file_name)
+                entry = OrderedDict([
+                    ('file', file_name), ('size', sizes[kind][key])])
+                if kind == 'provincia':
+                    entry['nombres'] = sorted(names[key])
+                    entry['bbox'] = [
+                        round(float(v), 6) for v in bounds[key]
+                    ] if key in bounds else None
+                else:
+                    row, column = map(int, key.split('_'))
+                    entry['bbox'] = [
+                        round(column * size, 6), round(row * size, 6),
+                        round((column + 1) * size, 6),
+                        round((row + 1) * size, 6)]
+                index[kind][key] = entry
+            for file_name in os.listdir(folder + kind):
+                if file_name[:-len('.columns.json')] not in index[kind]:
+                    os.remove(folder + kind + '/' + file_name)
+    write_to_file(
+        json.dumps(index, separators=(',', ':')), folder + 'index.json')
+
+
+def teselas(data):
+    """Puntos de interés por provincia y por teselas."""
+    for source, (name, variables, categorical) in POINTS.items():
+        write_shards(point_chunks(data, source), name, variables, categorical)
+
+
+def ccaa_long(data, variables):
+    """Accumulated series of several variables, as one long table.
+
+        data (dict): prepared long format data of every variable
+        variables (list): variables; the first one gives the dates and
+                          CCAA of the table, as in a left merge on it
+
+    Returns:
+        DataFrame: one row per fecha, ccaa and Variables, value in 'total'
+    """
+    long = pd.concat(
+        [data[variable][['fecha', 'CCAA', 'total']] for variable in variables],
+        ignore_index=True)
+    variable = repeat(variables, [len(data[v]) for v in variables])
+    # Integer key of every (fecha, CCAA) pair; the first variable comes first
+    fecha, fechas = pd.factorize(long.fecha, sort=True)
+    region, regions = pd.factorize(long.CCAA, sort=True)
+    key = pd.Series(fecha.astype('int64') * len(regions) + region)
+    keep = key.isin(key.iloc[:len(data[variables[0]])]).to_numpy()
+    return pd.DataFrame({
+        'fecha': pd.Categorical.from_codes(
+            fecha[keep], fechas, ordered=True),
+        'ccaa': pd.Categorical.from_codes(region[keep], regions),
+        'Variables': pd.Categorical(
+            variable[keep], categories=sorted(variables)),
+        'total': long.total.array[keep]})
+
+
+def ccaa(data):
+    """Datos nacionales acumulados, por comunidad autónoma."""
+    todos_ccaa = ccaa_long(
+        data, ['casos', 'altas', 'fallecidos', 'hospital', 'uci'])
+    write_long_dataset(
+        todos_ccaa, ['fecha', 'ccaa'], 'total', 'todos_ccaa_acumulado')
+    # Cifras más recientes, por CCAA
+    last_date = todos_ccaa['fecha'].max()
+    casos_ccaa_last = todos_ccaa[
+        (todos_ccaa.Variables == 'casos') & (todos_ccaa.fecha == last_date)]
+    write_long_dataset(casos_ccaa_last, ['ccaa'], 'total', 'casos_ccaa_1_dato')
+
+
+def ccaa_wide(df):
+    """Accumulated series of every CCAA, one column each, by cod_ine.
+
+        df (DataFrame): prepared long format data: fecha,cod_ine,CCAA,total
+
+    Days missing from the source are empty rows, so that windows of N rows
+    span N days.
+
+    Returns:
+        tuple: DataFrame with one row per day, and the days of the source
+    """
+    wide = pd.DataFrame({
+        'fecha': pd.to_datetime(df.fecha, format='%Y-%m-%d'),
+        'cod_ine': df.cod_ine,
+        'total': df.total.to_numpy('float64', na_value=nan)}).pivot(
+            index='fecha', columns='cod_ine', values='total')
+    days = wide.index
+    return wide.reindex(pd.date_range(days.min(), days.max())), days
+
+
+def indicadores(data):
+    """Indicadores por comunidad autónoma.
+
+    Medias de 7 días de casos y fallecidos diarios, incidencia acumulada en
+    14 días por 100.000 habitantes y tiempo de duplicación de los casos,
+    calculados para todas las comunidades a la vez.
+    """
+    population = pd.read_csv(
+        etl_cfg.input.population, index_col='cod_ine').poblacion
+    casos, casos_days = ccaa_wide(data['casos'])
+    fallecidos, fallecidos_days = ccaa_wide(data['fallecidos'])
+    indicators = {
+        'casos-duplicacion': (doubling_time(casos, 7), casos_days),
+        'casos-ia-14d': (
+            window_sum(casos, 14) * 1e5 / population[casos.columns],
+            casos_days),
+        'casos-media-7d': (window_sum(casos, 7) / 7, casos_days),
+        'fallecidos-ia-14d': (
+            window_sum(fallecidos, 14) * 1e5 / population[fallecidos.columns],
+            fallecidos_days),
+        'fallecidos-media-7d': (window_sum(fallecidos, 7) / 7, fallecidos_days)
+    }
+    unit = etl_cfg.metadata.indicadores
+    # One row per day and CCAA, empty values included
+    long = pd.concat([
+        indicator.loc[days].round(unit[variable]['decimals'])
+        .rename_axis(index='fecha', columns='cod_ine').reset_index()
+        .melt(id_vars='fecha', value_name='total')
+        .assign(Variables=variable)
+        for variable, (indicator, days) in indicators.items()],
+        ignore_index=True)
+    names = data['casos'].drop_duplicates('cod_ine').set_index('cod_ine').CCAA
+    long['ccaa'] = long.cod_ine.map(names.astype(str))
+    long['fecha'] = long.fecha.dt.strftime('%Y-%m-%d')
+    write_long_dataset(
+        long, ['fecha', 'ccaa'], 'total', 'indicadores_ccaa', unit=unit)
+    # Cifras más recientes, por CCAA
+    long = long[long.fecha == long.fecha.max()]
+    write_long_dataset(
+        long, ['ccaa'], 'total', 'indicadores_ccaa_1_dato', unit=unit)
+
+
+def nacional(data):
+    """Datos nacionales acumulados diarios."""
+    # fecha,casos,altas,fallecimientos,ingresos_uci,hospitalizados
+    nacional = data['nacional'].rename(columns={
+        'casos_total': 'casos-acumulado',
+        'altas': 'altas-acumulado',
+        'fallecimientos': 'fallecidos-acumulado',
+        'ingresos_uci': 'uci-acumulado',
+        'hospitalizados': 'hospital-acumulado'})
+    # Calcular datos diarios no acumulados
+    nacional = deacumulate(nacional, 'casos-acumulado', 'casos')
+    nacional = deacumulate(nacional, 'altas-acumulado', 'altas')
+    nacional = deacumulate(nacional, 'fallecidos-acumulado', 'fallecidos')
+    nacional = deacumulate(nacional, 'uci-acumulado', 'uci')
+    nacional = deacumulate(nacional, 'hospital-acumulado', 'hospital')
+
+    path = etl_cfg.output.path
+    variables = ['casos', 'altas', 'fallecidos', 'uci', 'hospital']
+    fecha = nacional['fecha']
+    # Datos acumulados
+    nacional_acumulado = OrderedDict([('fecha', fecha)])
+    for variable in variables:
+        nacional_acumulado[variable] = nacional[variable + '-acumulado']
+    # Tasa de variación diaria (porcentaje)
+    # T(d) = 100 * ((Casos(d) - Casos(d-1))/Casos(d-1))
+    casos_nacional_tasa = variation(
+        pd.DataFrame({'fecha': fecha, 'casos': nacional_acumulado['casos']}),
+        'casos')
+    exports = [
+        Export(nacional_acumulado, ['fecha'], variables, None,
+               path + 'todos_nacional_acumulado.json-stat'),
+        Export(casos_nacional_tasa, ['fecha'], ['variacion'],
+               etl_cfg.metadata.variacion,
+               path + 'casos_nacional_variacion.json-stat'),
+        # Datos diarios
+        Export(nacional, ['fecha'], variables, etl_cfg.metadata.diario,
+               path + 'todos_nacional_diario.json-stat')]
+    for variable in variables:
+        # Cifra más reciente
+        exports.append(Export(
+            {'fecha': fecha.iloc[-1:],
+             variable: nacional_acumulado[variable].iloc[-1:]},
+            ['fecha'], [variable], None,
+            path + variable + '_nacional_1_dato.json-stat'))
+        # Serie diaria
+        exports.append(Export(
+            nacional, ['fecha'], [variable], etl_cfg.metadata.diario,
+            path + variable + '_nacional_diario.json-stat'))
+    export_jsonstat(exports)
+
+
+def nacional_edad(data):
+    """Datos nacionales por rango de edad y sexo."""
+    nacional_edad = data['nacional_edad']
+    nacional_edad = nacional_edad[
+        (nacional_edad.rango_edad != 'Total') &
+        (nacional_edad.sexo != 'ambos')]
+    last_date = nacional_edad.fecha.max()
+    nacional_edad = nacional_edad[nacional_edad.fecha == last_date]
+    nacional_edad = nacional_edad.drop(columns='fecha').rename(columns={
+        'casos_confirmados': 'casos',
+        'hospitalizados': 'hospital',
+        'ingresos_uci': 'uci'
+    })
+
+    export_jsonstat([
+        Export(nacional_edad, ['rango_edad', 'sexo'], [variable], None,
+               etl_cfg.output.path + variable +
+               '_nacional_edad_sexo.json-stat')
+        for variable in ['casos', 'hospital', 'uci', 'fallecidos']])
+
+
+def region_series(df, variable):
+    """Compute accumulated and daily series of every region.
+
+        df (DataFrame): prepared long format data: fecha,cod_ine,CCAA,total
+        variable (str): name of the daily variable; the accumulated one is
+                        named variable + '-acumulado'
+    """
+    region = df.rename(columns={'total': variable + '-acumulado'})
+    return deacumulate(region, variable + '-acumulado', variable, by='cod_ine')
+
+
+def regiones(data):
+    """Series por comunidad autónoma: casos, altas, uci y fallecidos."""
+    # fecha,cod_ine,CCAA,total
+    exports = []
+    for variable in ['casos', 'altas', 'uci', 'fallecidos']:
+        region = region_series(data[variable], variable)
+        if variable == 'casos':
+            # tasa de variación diaria (porcentaje), sin los 10 primeros días
+            # T(d) = 100 * ((Casos(d) - Casos(d-1))/Casos(d-1))
+            tasa = region[region.groupby('cod_ine').cumcount() >= 10].copy()
+            tasa = variation(tasa, variable + '-acumulado', by='cod_ine')
+            # Regions of 10 days or fewer have an empty series
+            empty = tasa.iloc[:0]
+            tasa = dict(list(tasa.groupby('cod_ine')))
+        for cod_ine, region_data in region.groupby('cod_ine'):
+            name = etl_cfg.output.path + variable + '_' + \
+                etl_cfg.regions[cod_ine] + '_'
+            fecha = region_data['fecha']
+            acumulado = region_data[variable + '-acumulado']
+            # cifra más reciente
+            exports.append(Export(
+                {'fecha': fecha.iloc[-1:], variable: acumulado.iloc[-1:]},
+                ['fecha'], [variable], None, name + '1_dato.json-stat'))
+            # acumulado
+            exports.append(Export(
+                {'fecha': fecha, variable: acumulado}, ['fecha'], [variable],
+                etl_cfg.metadata.get(variable + '_acumulado'),
+                name + 'acumulado.json-stat'))
+            # diario
+            exports.append(Export(
+                region_data, ['fecha'], [variable], etl_cfg.metadata.diario,
+                name + 'diario.json-stat'))
+            # tasa de variación diaria
+            if variable == 'casos':
+                exports.append(Export(
+                    tasa.get(cod_ine, empty), ['fecha'], ['variacion'],
+                    etl_cfg.metadata.variacion, name + 'variacion.json-stat'))
+    export_jsonstat(exports)
+
+
+def cantabria(data):
+    """Todas las variables en Cantabria, y comparación con España."""
+    series = {}
+    for variable in ['casos', 'altas', 'uci', 'fallecidos']:
+        df = data[variable]
+        series[variable] = region_series(df[df.cod_ine == 6], variable)[
+            ['fecha', variable + '-acumulado', variable]]
+    casos = series['casos']
+    altas = series['altas']
+    uci = series['uci']
+    fallecidos = series['fallecidos']
+
+    # Todas las variables acumulado en Cantabria
+    todas_acumulado = casos.merge(altas, how='left', on='fecha')
+    todas_acumulado = todas_acumulado.merge(fallecidos, how='left', on='fecha')
+    todas_acumulado = todas_acumulado.merge(uci, how='left', on='fecha')
+    todas_acumulado.drop('casos', axis=1, inplace=True)
+    todas_acumulado.drop('altas', axis=1, inplace=True)
+    todas_acumulado.drop('fallecidos', axis=1, inplace=True)
+    todas_acumulado.drop('uci', axis=1, inplace=True)
+    todas_acumulado.rename(columns={
+        'casos-acumulado': 'casos',
+        'altas-acumulado': 'altas',
+        'fallecidos-acumulado': 'fallecidos',
+        'uci-acumulado': 'uci'}, inplace=True)
+    write_dataset(
+        todas_acumulado,
+        ['fecha'],
+        ['casos', 'altas', 'fallecidos', 'uci'],
+        'todos_cantabria',
+        unit=etl_cfg.metadata.todos_cantabria)
+
+    # Comparación casos Cantabria y España
+    espana = data['nacional'][['fecha', 'casos_total']].rename(
+        columns={'casos_total': 'casos-espana'})
+    cant_esp = espana.merge(
+        casos[['fecha', 'casos-acumulado']].rename(
+            columns={'casos-acumulado': 'casos-cantabria'}),
+        how='left', on='fecha')
+    write_dataset(
+        cant_esp, ['fecha'], ['casos-espana', 'casos-cantabria'],
+        'casos_cantabria_espana',
+        unit=etl_cfg.metadata.casos_cantabria_espana)
+
+
+# Cubes kept in the history database (see history.py)
+HISTORY = ['todos_ccaa_acumulado', 'todos_nacional_acumulado']
+
+
+def source_release():
+    """Date and commit of the source data, from the HEAD of its repository.
+
+    Without a repository, the release is now and the commit is unknown.
+    """
+    from git import InvalidGitRepositoryError, NoSuchPathError, Repo
+
+    try:
+        commit = Repo(etl_cfg.input.source).head.commit
+    except (InvalidGitRepositoryError, NoSuchPathError, ValueError):
+        return datetime.today().isoformat(timespec='seconds'), ''
+    return commit.committed_datetime.isoformat(), commit.hexsha
+
+
+def historial(data):
+    """Cifras que han cambiado desde la publicación anterior."""
+    record_files(
+        etl_cfg.output.history, etl_cfg.output.path, HISTORY,
+        *source_release())
+
+
+def artefactos(data):
+    """Copias comprimidas y con hash de contenido de los resultados."""
+    build_artifacts(
+        etl_cfg.output.path,
+        [output for stage in STAGES if stage.name != 'artefactos'
+         for output in stage.outputs],
+        etl_cfg.output.compression)
+
+
+VARIABLES = ['casos', 'altas', 'fallecidos', 'hospital', 'uci']
+
+STAGES = [
+    Stage('eess', eess, ['eess'],
+          point_outputs('eess_horario_flexible_habitual')),
+    Stage('restauracion', restauracion, ['restauracion'],
+          point_outputs('puntos_restauracion')),
+    Stage('alojamientos', alojamientos, ['alojamientos'],
+          point_outputs('alojamientos_turisticos')),
+    Stage('teselas', teselas, list(POINTS),
+          [shard_index(name) for name, _, _ in POINTS.values()]),
+    Stage('ccaa', ccaa, ['altas', 'casos', 'fallecidos', 'hospital', 'uci'],
+          dataset_outputs(['todos_ccaa_acumulado', 'casos_ccaa_1_dato'])),
+    Stage('indicadores', indicadores, ['casos', 'fallecidos'],
+          dataset_outputs(['indicadores_ccaa', 'indicadores_ccaa_1_dato'])),
+    Stage('nacional', nacional, ['nacional'],
+          dataset_outputs(
+              ['todos_nacional_acumulado', 'todos_nacional_diario',
+               'casos_nacional_variacion'] +
+              [variable + '_nacional_' + kind
+               for variable in VARIABLES for kind in ['1_dato', 'diario']])),
+    Stage('nacional_edad', nacional_edad, ['nacional_edad'],
+          dataset_outputs([variable + '_nacional_edad_sexo'
+                           for variable in VARIABLES if variable != 'altas'])),
+    Stage('regiones', regiones, ['casos', 'altas', 'uci', 'fallecidos'],
+          dataset_outputs(
+              ['casos_' + region + '_variacion'
+               for region in etl_cfg.regions.values()] +
+              [variable + '_' + region + '_' + kind
+               for variable in VARIABLES if variable != 'hospital'
+               for region in etl_cfg.regions.values()
+               for kind in ['1_dato', 'acumulado', 'diario']])),
+    Stage('cantabria', cantabria,
+          ['casos', 'altas', 'uci', 'fallecidos', 'nacional'],
+          dataset_outputs(['todos_cantabria', 'casos_cantabria_espana']))
+]
+STAGES.append(
+    Stage('historial', historial, [], [], ['ccaa', 'nacional']))
+STAGES.append(
+    Stage('artefactos', artefactos, [], ['manifest.json'],
+          [stage.name for stage in STAGES]))
@@ -0,0 +1,67 @@
+"""Keep track of input files between runs to support incremental builds.
+
+The state file stores the git blob SHA-1 of every input file processed in
+the last successful run, and the output files built from each input
+(see pipeline.outputs_by_input), and the git blob SHA-1 of the output files
+last sent to every gist (see gist.py):
+
+    {
+        "inputs": {"casos": "<sha1>", ...},
+        "outputs": {"casos": ["casos_cantabria_diario.json-stat", ...], ...},
+        "gists": {"<gist id>": {"todos_cantabria.json-stat": "<sha1>", ...}}
+    }
+
+"""
+
+import hashlib
+
+import json
+
+import os
+
+
+def blob_sha(file_name):
+    """Return the git blob SHA-1 of a file, as in `git hash-object`."""
+    with open(file_name, 'rb') as file:
+        content = file.read()
+    header = b'blob %d\0' % len(content)
+    return hashlib.sha1(header + content).hexdigest()
+
+
+def load_state(file_name):
+    """Read the state saved by the previous run, if any."""
+    try:
+        with open(file_name) as file:
+            return json.load(file)
+    except (IOError, ValueError):
+        return {'inputs': {}, 'outputs': {}}
+
+
+def save_state(state, file_name):
+    """Write the state file atomically."""
+    tmp_name = file_name + '.tmp'
+    with open(tmp_name, 'w') as file:
+        json.dump(state, file, indent=2, sort_keys=True)
+    os.replace(tmp_name, file_name)
+
+
+def changed_inputs(state, files, dir_path):
+    """Return the inputs whose content changed since the last run.
+
+        state (dict): state saved by the previous run
+        files (dict): input name as key and file name as value
+        dir_path (str): directory of the input files
+
+    An input is also considered changed if it was never processed.
+
+    Returns:
+        tuple: set of changed input names, and dict with the current hash
+               of every input
+    """
+    hashes = {
+        name: blob_sha(dir_path + file_name)
+        for name, file_name in files.items()}
+    changed = set(
+        name for name, sha in hashes.items()
+        if state['inputs'].get(name) != sha)
+    return changed, hashes
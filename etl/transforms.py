@@ -0,0 +1,89 @@
+"""Vectorized transformations shared by the ETL steps.
+
+All functions operate on whole columns instead of walking the dataframe
+row by row with .loc, so their cost grows with numpy speed rather than
+with Python-level indexing.
+
+"""
+
+import numpy as np
+
+import pandas as pd
+
+
+def deacumulate(df, variable1, variable2, by=None):
+    """Compute daily figures from an accumulated series.
+
+        df (DataFrame): rows sorted by date
+        variable1 (str): accumulated variable
+        variable2 (str): name of the new daily variable
+        by (str): optional grouping column, e.g. 'cod_ine'
+
+    The first row (of each group) has no previous value, so it is left empty.
+    """
+    if by is None:
+        df[variable2] = df[variable1].diff()
+    else:
+        df[variable2] = df.groupby(by)[variable1].diff()
+    return df
+
+
+def delay_date(df):
+    """Change dates to previous day.
+
+    'fecha' may hold %Y-%m-%d strings or datetimes; the result is a string.
+    """
+    fecha = pd.to_datetime(df['fecha'], format='%Y-%m-%d')
+    df['fecha'] = (fecha - pd.Timedelta(days=1)).dt.strftime('%Y-%m-%d')
+    return df
+
+
+def variation(df, variable, rate='variacion', by=None):
+    """Compute the daily variation rate of a variable, in percentage.
+
+        df (DataFrame): rows sorted by date
+        variable (str): accumulated variable
+        rate (str): name of the new rate variable
+        by (str): optional grouping column, e.g. 'cod_ine'
+
+    T(d) = 100 * ((V(d) - V(d-1)) / V(d-1)). Rows whose previous value is
+    zero, negative or missing are left empty.
+    """
+    if by is None:
+        previous = df[variable].shift(1)
+    else:
+        previous = df.groupby(by)[variable].shift(1)
+    df[rate] = (100 * ((df[variable] - previous) / previous)).where(
+        previous > 0)
+    return df
+
+
+def window_sum(df, days):
+    """Sum the daily figures of the last days, from accumulated series.
+
+        df (DataFrame): accumulated series, one row per consecutive day and
+                        one column per region
+        days (int): length of the window
+
+    S(d) = V(d) - V(d-days), the rolling sum of the daily figures, for all
+    the columns at once. The first rows, without a full window, are left
+    empty.
+    """
+    return df - df.shift(days)
+
+
+def doubling_time(df, days=7):
+    """Compute the days accumulated series take to double.
+
+        df (DataFrame): accumulated series, one row per consecutive day and
+                        one column per region
+        days (int): window of the growth rate
+
+    Td(d) = days * ln(2) / ln(V(d) / V(d-days)). Rows where the series did
+    not grow, or was not positive days before (a series growing from zero
+    has no doubling time, rather than 0 days), are left empty.
+    """
+    previous = df.shift(days)
+    growth = df / previous
+    return days * np.log(2) / np.log(growth.where(
+        (previous > 0) & np.isfinite(growth) & (growth > 1)))
@@ -0,0 +1,227 @@
+"""Data-quality checks of the time series inputs.
+
+validate() runs, on the prepared dataframes of the inputs in RULES, the
+checks configured in etl_cfg.validation:
+
+    schema      columns of the input schema (see ingest.SCHEMAS) missing,
+                with a non-numeric count, or empty keys
+    regions     rows whose cod_ine is not an autonomous community, such as
+                a national total left in a regional series
+    duplicates  rows repeating the keys of another row (fecha, cod_ine...)
+    continuity  days missing inside a series, and series ending before
+                the last date of their input
+    monotonic   accumulated figures lower than the day before, which
+                deacumulate would turn into negative daily figures
+
+Every check is a vectorized expression over the whole dataframe: the
+series of every region (or age range and sex) are compared with numpy
+after a single sort of the rows, so the checks cost a small fraction of
+the export of the same rows. The result is a report:
+
+    {
+        "valid": false,         # no check failed with severity 'error'
+        "time": 0.012,          # seconds, loading the inputs excluded
+        "issues": [
+            {
+                "input": "casos",
+                "check": "duplicates",
+                "severity": "error",
+                "rows": 2,
+                "examples": [{"fecha": "2020-04-01", "cod_ine": 13, ...}]
+            }
+        ]
+    }
+
+"""
+
+from collections import OrderedDict
+
+from .config import etl_cfg
+
+from .ingest import SCHEMAS
+
+import json
+
+import numpy as np
+
+import pandas as pd
+
+import time
+
+
+# Keys, grouping and accumulated columns of every checked input
+SERIES = {
+    'keys': ['fecha', 'cod_ine'],
+    'by': ['cod_ine'],
+    'accumulated': ['total'],
+    'regions': 'cod_ine',
+    'continuous': True
+}
+
+RULES = {
+    'altas': SERIES,
+    'casos': SERIES,
+    'fallecidos': SERIES,
+    'hospital': SERIES,
+    'nacional': {
+        'keys': ['fecha'],
+        'by': [],
+        'accumulated': ['casos_total', 'altas', 'fallecimientos',
+                        'ingresos_uci', 'hospitalizados'],
+        'continuous': True
+    },
+    'nacional_edad': {
+        'keys': ['fecha', 'rango_edad', 'sexo'],
+        'by': ['rango_edad', 'sexo'],
+        'accumulated': ['casos_confirmados', 'hospitalizados',
+                        'ingresos_uci', 'fallecidos'],
+        # Published on some dates only
+        'continuous': False
+    },
+    'uci': SERIES
+}
+
+
+def _records(df, limit):
+    """First rows of a dataframe as JSON-serializable dicts."""
+    df = df.head(limit)
+    for column in df.select_dtypes('datetime').columns:
+        df = df.assign(**{column: df[column].dt.strftime('%Y-%m-%d')})
+    return json.loads(df.to_json(orient='records', force_ascii=False))
+
+
+def _series(df, rule):
+    """Sort the rows by series and date.
+
+    Returns:
+        tuple: positions of the sorted rows, their dates as days, and
+               whether each sorted row follows a row of the same series
+    """
+    days = pd.to_datetime(df['fecha'], format='%Y-%m-%d').to_numpy(
+        dtype='datetime64[D]')
+    codes = [pd.factorize(df[column])[0] for column in rule['by']]
+    order = np.lexsort([days] + codes[::-1])
+    same = np.ones(len(df), dtype=bool)
+    same[:1] = False
+    for code in codes:
+        code = code[order]
+        same[1:] &= code[1:] == code[:-1]
+    return order, days[order], same
+
+
+def check_schema(df, name, rule):
+    """Missing or mistyped columns of the schema, and empty keys.
+
+    Returns:
+        tuple: number of rows affected and example rows
+    """
+    schema = SCHEMAS.get(name, {})
+    missing = [column for column in schema if column not in df]
+    if missing:
+        return len(df), [{'missing': missing}]
+    mistyped = [
+        column for column, dtype in schema.items()
+        if dtype == 'Int64' and not pd.api.types.is_numeric_dtype(df[column])]
+    if mistyped:
+        return len(df), [{'mistyped': mistyped}]
+    empty = df[rule['keys']].isna().any(axis=1)
+    return int(empty.sum()), df[empty]
+
+
+def check_regions(df, name, rule):
+    """Rows of a regional series outside etl_cfg.regions."""
+    if 'regions' not in rule:
+        return 0, df.iloc[:0]
+    outside = ~df[rule['regions']].isin(list(etl_cfg.regions))
+    return int(outside.sum()), df[outside]
+
+
+def check_duplicates(df, name, rule):
+    """Rows with the same keys as another row."""
+    repeated = df.duplicated(rule['keys'], keep=False)
+    return int(repeated.sum()), df[repeated]
+
+
+def check_continuity(df, name, rule):
+    """First day after every gap, and last day of every late series."""
+    if not rule['continuous'] or df.empty:
+        return 0, df.iloc[:0]
+    order, days, same = _series(df, rule)
+    gap = np.zeros(len(df), dtype=bool)
+    gap[1:] = same[1:] & (np.diff(days) > np.timedelta64(1, 'D'))
+    last = np.ones(len(df), dtype=bool)
+    last[:-1] = ~same[1:]
+    failed = order[gap | (last & (days < days.max()))]
+    return len(failed), df.iloc[np.sort(failed)]
+
+
+def check_monotonic(df, name, rule):
+    """Accumulated figures lower than the previous figure of the series."""
+    if df.empty:
+        return 0, df.iloc[:0]
+    order, _, same = _series(df, rule)
+    values = df[rule['accumulated']].astype('float64').to_numpy()[order]
+    previous = np.full_like(values, np.nan)
+    previous[1:] = values[:-1]
+    previous[~same] = np.nan
+    lower = (values < previous).any(axis=1)
+    failed = order[lower]
+    examples = df.iloc[failed].join(pd.DataFrame(
+        previous[lower], index=df.index[failed],
+        columns=[column + '_anterior' for column in rule['accumulated']]))
+    return len(failed), examples
+
+
+CHECKS = OrderedDict([
+    ('schema', check_schema),
+    ('regions', check_regions),
+    ('duplicates', check_duplicates),
+    ('continuity', check_continuity),
+    ('monotonic', check_monotonic)])
+
+
+def validate(data, names):
+    """Check the time series inputs.
+
+        data (Mapping): dataframe of every input, such as pipeline.Sources
+        names (list): inputs to check; those without rules are skipped
+
+    A failing schema check skips the other checks of the input.
+
+    Returns:
+        OrderedDict: report (see the module docstring)
+    """
+    cfg = etl_cfg.validation
+    elapsed = 0
+    issues = []
+    for name in sorted(set(names) & set(RULES)):
+        df = data[name]
+        start = time.perf_counter()
+        for check, func in CHECKS.items():
+            severity = cfg.checks.get(check)
+            if not severity:
+                continue
+            rows, examples = func(df, name, RULES[name])
+            if not rows:
+                continue
+            if isinstance(examples, pd.DataFrame):
+                examples = _records(examples, cfg.examples)
+            issues.append(OrderedDict([
+                ('input', name), ('check', check), ('severity', severity),
+                ('rows', rows), ('examples', examples)]))
+            if check == 'schema':
+                break
+        elapsed += time.perf_counter() - start
+    return OrderedDict([
+        ('valid', not any(
+            issue['severity'] == 'error' for issue in issues)),
+        ('time', round(elapsed, 4)),
+        ('issues', issues)])
+
+
+def print_report(report):
+    """Print the issues of a report, one per line."""
+    for issue in report['issues']:
+        print("  %s %s/%s: %d filas" % (
+            issue['severity'], issue['input'], issue['check'],
+            issue['rows']))
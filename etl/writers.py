@@ -0,0 +1,235 @@
+"""Writers of the output datasets in tabular formats.
+
+Besides JSON-stat, the datasets listed in etl_cfg.output.formats are
+written in the formats given for each of them, next to the JSON-stat file:
+
+    csv       <name>.csv       UTF-8, with a header row; nulls are empty
+    ndjson    <name>.ndjson    one JSON object per row
+    parquet   <name>.parquet   typed columns, with min/max statistics for
+                               every row group; needs the pyarrow package
+                               of the Pipfile, and is skipped without it
+
+Every format is written from the same table, built once per dataset by
+to_table: one row per combination of the dimensions, sorted by them as in
+the JSON-stat cube, and one column per dimension and variable. Figures are
+rounded as in the JSON-stat file and typed: integers as Int64, other
+numbers as float64, text as strings. In Parquet 'fecha' is a date, and
+since rows are sorted by date the statistics of the row groups let
+warehouse queries skip the groups outside a range of dates.
+
+Writers take a function returning the tables with consecutive rows of a
+dataset, so that datasets read in chunks are written chunk by chunk; each
+chunk becomes one Parquet row group or more.
+
+"""
+
+from collections import OrderedDict
+
+import csv
+
+import filecmp
+
+import io
+
+import json
+
+import os
+
+import numpy as np
+
+import pandas as pd
+
+from .profiling import record_file
+
+try:
+    import pyarrow as pa
+    from pyarrow import parquet
+except ImportError:
+    parquet = None
+
+
+def to_table(df, id_vars, value_vars, unit=None, decimals=None, numeric=(),
+             whole=True):
+    """Build the table of a dataset written by the writers.
+
+        df (DataFrame): one row per combination of the id_vars, or a dict
+                        of Series or arrays of the same length
+        id_vars (list): dimensions
+        value_vars (list): variables, in the order of the table
+        unit (dict): unit metadata of the variables, with their 'decimals'
+        decimals (int): decimals of the variables without unit metadata;
+                        None leaves them unrounded
+        numeric (list): text columns to convert to numbers, e.g. coordinates
+        whole (bool): store float variables whose values are all whole
+                      numbers as integers; chunks of a dataset must not
+                      use it, or their types could differ
+
+    Returns:
+        DataFrame: table of the dataset
+    """
+    table = OrderedDict()
+    for column in id_vars:
+        values = pd.Series(df[column])
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(values.cat.categories.dtype)
+        table[column] = values.array
+    for column in value_vars:
+        values = pd.Series(df[column])
+        if column in numeric:
+            values = pd.to_numeric(values, errors='coerce')
+        if pd.api.types.is_bool_dtype(values.dtype):
+            values = values.astype('boolean')
+        elif pd.api.types.is_integer_dtype(values.dtype):
+            values = values.astype('Int64')
+        elif pd.api.types.is_float_dtype(values.dtype):
+            places = (unit or {}).get(column, {}).get('decimals', decimals)
+            if places is not None:
+                values = values.round(places)
+            present = values.dropna().to_numpy(dtype='float64')
+            if whole and np.isfinite(present).all() and \
+                    (present == np.floor(present)).all():
+                values = values.astype('Int64')
+        else:
+            values = values.astype(object)
+        table[column] = values.array
+    table = pd.DataFrame(table)
+    if id_vars:
+        table = table.sort_values(id_vars, kind='mergesort')
+    return table.reset_index(drop=True)
+
+
+def long_table(df, id_vars, value, unit=None, decimals=None):
+    """Build the table of a long-format dataset, as to_table.
+
+        df (DataFrame): one row per cell, with a 'Variables' column naming
+                        the variable of the cell
+        id_vars (list): dimensions, besides 'Variables'
+        value (str): column with the value of every cell
+    """
+    index = pd.MultiIndex.from_arrays(
+        [np.asarray(df[column], dtype=object)
+         for column in list(id_vars) + ['Variables']],
+        names=list(id_vars) + ['Variables'])
+    wide = pd.Series(df[value].array, index=index).unstack('Variables')
+    wide.columns = list(wide.columns)
+    return to_table(
+        wide.reset_index(), id_vars, list(wide.columns), unit, decimals)
+
+
+def _default(obj):
+    """Encode the numpy scalars of the columns."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(repr(obj) + ' is not JSON serializable')
+
+
+def _records(table):
+    """Columns of a table as lists, with None as null."""
+    return [
+        [None if pd.isnull(value) else value
+         for value in table[column].tolist()]
+        for column in table.columns]
+
+
+def write_csv(file, tables):
+    """Write tables to a binary file as CSV, with one header row."""
+    header = True
+    for table in tables:
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator='\n')
+        if header:
+            writer.writerow(table.columns)
+            header = False
+        writer.writerows(zip(*_records(table)))
+        file.write(output.getvalue().encode())
+
+
+def write_ndjson(file, tables):
+    """Write the rows of tables to a binary file as JSON lines."""
+    for table in tables:
+        names = list(table.columns)
+        for row in zip(*_records(table)):
+            file.write(json.dumps(
+                OrderedDict(zip(names, row)), default=_default,
+                ensure_ascii=False, separators=(',', ':')).encode() + b'\n')
+
+
+def _arrow(table, schema=None):
+    """Convert a table to Arrow, with 'fecha' as a date."""
+    if 'fecha' in table and table['fecha'].dtype == object:
+        table = table.assign(fecha=pd.to_datetime(
+            table['fecha'], format='%Y-%m-%d').dt.date)
+    if schema is None:
+        schema = pa.Schema.from_pandas(table, preserve_index=False)
+        # Columns without values in the first table hold text
+        for i, field in enumerate(schema):
+            if pa.types.is_null(field.type):
+                schema = schema.set(i, field.with_type(pa.string()))
+    return pa.Table.from_pandas(table, schema=schema, preserve_index=False)
+
+
+def write_parquet(file, tables, row_group_size=None):
+    """Write tables to a binary file as Parquet, with statistics.
+
+        row_group_size (int): maximum rows of every row group
+    """
+    writer = None
+    for table in tables:
+        data = _arrow(table, writer.schema if writer else None)
+        if writer is None:
+            writer = parquet.ParquetWriter(
+                file, data.schema, write_statistics=True)
+        writer.write_table(data, row_group_size=row_group_size)
+    if writer is not None:
+        writer.close()
+
+
+# Extension and writer of every format
+WRITERS = OrderedDict([
+    ('csv', ('.csv', write_csv)),
+    ('ndjson', ('.ndjson', write_ndjson)),
+    ('parquet', ('.parquet', write_parquet))])
+
+
+def available(formats):
+    """Formats that can be written, Parquet only with pyarrow."""
+    return [f for f in formats if f != 'parquet' or parquet is not None]
+
+
+def write_formats(tables, file_name, formats, row_group_size=None):
+    """Write a dataset in several formats, unless its content did not change.
+
+        tables (function): returns a new iterable of the tables with
+                           consecutive rows of the dataset, every call
+        file_name (str): output file name, without extension
+        formats (list): keys of WRITERS
+        row_group_size (int): maximum rows of every Parquet row group
+
+    Every file is written to a temporary file first, which replaces it only
+    if it differs.
+
+    Returns:
+        list: names of the files written
+    """
+    if 'parquet' in formats and parquet is None:
+        print("Paquete pyarrow no instalado: no se genera " +
+              os.path.basename(file_name) + ".parquet")
+    written = []
+    for fmt in available(formats):
+        extension, write = WRITERS[fmt]
+        name = file_name + extension
+        tmp_name = name + '.tmp'
+        with open(tmp_name, 'wb') as file:
+            if fmt == 'parquet':
+                write(file, tables(), row_group_size)
+            else:
+                write(file, tables())
+        changed = not os.path.exists(name) or \
+            not filecmp.cmp(tmp_name, name, shallow=False)
+        record_file(os.path.getsize(tmp_name), changed)
+        if changed:
+            os.replace(tmp_name, name)
+            written.append(name)
+        else:
+            os.remove(tmp_name)
+    return written
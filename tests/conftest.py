@@ -0,0 +1,116 @@
+"""Fixtures shared by the tests: settings and offline ETL workspaces."""
+
+import os
+
+import shutil
+
+from etl import benchmark
+from etl.config import etl_cfg
+
+from git import Repo
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def etl_settings():
+    """etl_cfg, restored after the test."""
+    saved = {section: dict(values) for section, values in etl_cfg.items()
+             if isinstance(values, dict)}
+    yield etl_cfg
+    for section, values in saved.items():
+        for key, value in values.items():
+            etl_cfg[section][key] = value
+
+
+def commit_all(repo, message):
+    """Commit every change of a working tree."""
+    repo.git.add('--all')
+    repo.git.commit('-q', '-m', message)
+
+
+class Workspace(object):
+    """Source and output repositories of an offline ETL run.
+
+    The output repository has the layout of this one: outputs in etl/data,
+    state, report and history next to them, and the same .gitignore. Both
+    repositories push to bare origins in the same directory.
+    """
+
+    def __init__(self, root, inputs):
+        self.root = str(root)
+        self.source = self.clone('source', 'source.git')
+        self.output = self.clone('output', 'output.git')
+        shutil.copy(os.path.join(ROOT, '.gitignore'),
+                    os.path.join(self.output.working_dir, '.gitignore'))
+        commit_all(self.output, 'init')
+        self.output.remote('origin').push('HEAD')
+        self.write_inputs(inputs)
+        commit_all(self.source, 'init')
+        self.source.remote('origin').push('HEAD')
+
+    def clone(self, name, origin):
+        """Clone an empty bare repository, with a committer configured."""
+        Repo.init(os.path.join(self.root, origin), bare=True)
+        repo = Repo.clone_from(
+            os.path.join(self.root, origin), os.path.join(self.root, name))
+        with repo.config_writer() as writer:
+            writer.set_value('user', 'name', 'test')
+            writer.set_value('user', 'email', 'test@example.com')
+        return repo
+
+    @property
+    def etl(self):
+        return os.path.join(self.output.working_dir, 'etl') + '/'
+
+    @property
+    def data(self):
+        return self.etl + 'data/'
+
+    @property
+    def dir_path(self):
+        return os.path.join(self.source.working_dir, 'COVID 19') + '/'
+
+    def write_inputs(self, inputs):
+        os.makedirs(self.dir_path, exist_ok=True)
+        benchmark.write_inputs(inputs, self.dir_path)
+
+    def config(self):
+        """Settings of main.run for this workspace."""
+        os.makedirs(self.data, exist_ok=True)
+        return {
+            'input': {
+                'source': self.source.working_dir + '/',
+                'dir_path': self.dir_path},
+            'output': {
+                'repository': self.output.working_dir,
+                'path': self.data,
+                'state': self.etl + 'etl_state.json',
+                'cache': self.etl + 'cache/',
+                'history': self.etl + 'historial.sqlite',
+                'report': self.etl + 'run_report.json',
+                'profile': self.etl + 'profile/',
+                'compression': ['gzip']},
+            'github': {'api_token': ''}}
+
+    def commits(self):
+        return int(self.output.git.rev_list('--count', 'HEAD'))
+
+
+def small_inputs(seed=0):
+    """Synthetic inputs of benchmark.py, with few points of interest."""
+    points = dict(benchmark.POINTS)
+    benchmark.POINTS.update(eess=300, restauracion=200, alojamientos=100)
+    try:
+        return benchmark.synthetic_inputs(1, seed)
+    finally:
+        benchmark.POINTS.update(points)
+
+
+@pytest.fixture
+def workspace(tmp_path, etl_settings):
+    """Offline workspace with small synthetic inputs."""
+    return Workspace(tmp_path, small_inputs())
@@ -0,0 +1,43 @@
+"""Compressed and content-hashed copies of the outputs."""
+
+import gzip
+
+import json
+
+import os
+
+from etl.artifacts import build_artifacts, compress
+
+
+def test_compress_is_deterministic():
+    data = b'{"version": "2.0"}' * 100
+    assert compress(data, 'gzip') == compress(data, 'gzip')
+    assert gzip.decompress(compress(data, 'gzip')) == data
+
+
+def test_build_artifacts(tmp_path):
+    path = str(tmp_path) + '/'
+    for name, data in [('casos.json-stat', b'{"value": [1, 2]}'),
+                       ('casos.parquet', b'PAR1')]:
+        with open(path + name, 'wb') as file:
+            file.write(data)
+    files = ['casos.json-stat', 'casos.parquet', 'missing.json-stat']
+    assert build_artifacts(path, files, ['gzip']) == [
+        'casos.json-stat', 'casos.parquet']
+    with open(path + 'manifest.json') as file:
+        manifest = json.load(file)
+    assert list(manifest) == ['casos.json-stat', 'casos.parquet']
+    entry = manifest['casos.json-stat']
+    with gzip.open(path + 'casos.json-stat.gz') as file:
+        assert file.read() == b'{"value": [1, 2]}'
+    with gzip.open(path + entry['gzip']) as file:
+        assert file.read() == b'{"value": [1, 2]}'
+    assert os.path.exists(path + entry['file'])
+    # Parquet is not compressed again
+    assert 'gzip' not in manifest['casos.parquet']
+    # Nothing to rebuild, then only the changed file
+    assert build_artifacts(path, files, ['gzip']) == []
+    with open(path + 'casos.json-stat', 'wb') as file:
+        file.write(b'{"value": [1, 3]}')
+    assert build_artifacts(path, files, ['gzip']) == ['casos.json-stat']
+    assert not os.path.exists(path + entry['file'])
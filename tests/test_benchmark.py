@@ -0,0 +1,29 @@
+"""Benchmarks leave the outputs and the history of the ETL untouched."""
+
+import os
+
+from etl import benchmark
+from etl.config import etl_cfg
+from etl.stages import STAGES
+
+
+def test_benchmark_does_not_record_history(tmp_path, etl_settings):
+    history = str(tmp_path / 'historial.sqlite')
+    etl_settings.output['history'] = history
+    etl_settings.output['path'] = str(tmp_path / 'data') + '/'
+    points = dict(benchmark.POINTS)
+    benchmark.POINTS.update(eess=30, restauracion=20, alojamientos=10)
+    try:
+        result = benchmark.run_benchmark(
+            1, [stage for stage in STAGES
+                if stage.name in ['ccaa', 'nacional', 'historial']],
+            repeat=1)
+    finally:
+        benchmark.POINTS.update(points)
+    assert [stage['name'] for stage in result['stages']] == [
+        'ccaa', 'nacional', 'historial']
+    # Neither the history nor the outputs of the configuration were written
+    assert os.listdir(str(tmp_path)) == []
+    # and the settings point to them again
+    assert etl_cfg.output.history == history
+    assert etl_cfg.output.path == str(tmp_path / 'data') + '/'
@@ -0,0 +1,120 @@
+"""Batching and retries of the gist updates."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import json
+
+import threading
+
+from unittest import mock
+
+from etl.gist import make_session, publish_gists
+from etl.state import blob_sha
+
+import pytest
+
+import requests
+
+
+GISTS = {
+    'g1': {'description': 'Uno', 'files': ['a.json-stat', 'b.json-stat']},
+    'g2': {'description': 'Dos', 'files': ['c.json-stat']},
+    'g3': {'description': 'Tres', 'files': ['d.json-stat']}}
+
+
+@pytest.fixture
+def path(tmp_path):
+    """Directory with the files of GISTS but d.json-stat."""
+    for name in ['a', 'b', 'c']:
+        (tmp_path / (name + '.json-stat')).write_text('{"%s": 1}' % name)
+    return str(tmp_path) + '/'
+
+
+def patched(session):
+    """Payload of every PATCH request by gist id."""
+    payloads = {}
+    for args, kwargs in session.patch.call_args_list:
+        payloads[args[0].rsplit('/', 1)[1]] = json.loads(kwargs['data'])
+    return payloads
+
+
+def test_one_request_per_gist_with_changed_files(path):
+    session = mock.Mock()
+    sent = {'g2': {'c.json-stat': blob_sha(path + 'c.json-stat')}}
+    published, errors = publish_gists(
+        GISTS, path, sent, session, 'https://api/gists/')
+    assert errors == {}
+    # g2 did not change and g3 has no file built
+    assert session.patch.call_count == 1
+    payload = patched(session)['g1']
+    assert payload['description'] == 'Uno'
+    assert payload['files'] == {
+        'a.json-stat': {'content': '{"a": 1}'},
+        'b.json-stat': {'content': '{"b": 1}'}}
+    assert published == {'g1': {
+        'a.json-stat': blob_sha(path + 'a.json-stat'),
+        'b.json-stat': blob_sha(path + 'b.json-stat')}}
+
+
+def test_failed_gist_is_reported_and_not_published(path):
+    session = mock.Mock()
+    response = session.patch.return_value
+    response.raise_for_status.side_effect = [
+        requests.HTTPError('503'), None]
+    published, errors = publish_gists(
+        GISTS, path, {}, session, 'https://api/gists/', jobs=1)
+    assert session.patch.call_count == 2
+    assert list(errors) == ['g1']
+    assert list(published) == ['g2']
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Answer 503 to the first requests of every path, then 200."""
+
+    def do_PATCH(self):
+        server = self.server
+        self.rfile.read(int(self.headers['Content-Length']))
+        with server.lock:
+            server.requests.append(self.path)
+            failed = server.requests.count(self.path) <= server.failures
+        self.send_response(503 if failed else 200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def flaky_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+    server.requests = []
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_requests_are_retried(path, flaky_server):
+    flaky_server.failures = 2
+    url = 'http://127.0.0.1:%d/gists/' % flaky_server.server_address[1]
+    with make_session('token', jobs=2, retries=3, backoff=0) as session:
+        published, errors = publish_gists(GISTS, path, {}, session, url)
+    assert errors == {}
+    assert sorted(published) == ['g1', 'g2']
+    assert sorted(flaky_server.requests) == ['/gists/g1'] * 3 + \
+        ['/gists/g2'] * 3
+
+
+def test_retries_give_up(path, flaky_server):
+    flaky_server.failures = 10
+    url = 'http://127.0.0.1:%d/gists/' % flaky_server.server_address[1]
+    with make_session('token', retries=2, backoff=0) as session:
+        published, errors = publish_gists(
+            {'g2': GISTS['g2']}, path, {}, session, url)
+    assert published == {}
+    assert isinstance(errors['g2'], requests.RequestException)
+    assert flaky_server.requests == ['/gists/g2'] * 3
@@ -0,0 +1,41 @@
+"""History of the published figures."""
+
+from etl.history import as_of, connect, latest, record
+
+import pytest
+
+
+@pytest.fixture
+def connection(tmp_path):
+    connection = connect(str(tmp_path / 'historial.sqlite'))
+    yield connection
+    connection.close()
+
+
+def test_release_is_not_overwritten(connection):
+    cells = {('2020-04-01', 'Madrid', 'casos'): 10,
+             ('2020-04-01', 'Madrid', 'uci'): 2}
+    assert record(connection, 'ccaa', cells, '2020-04-02T10:00:00', 'a') == 2
+    # Running again on the same commit, e.g. after a fix of the ETL
+    revised = dict(cells)
+    revised['2020-04-01', 'Madrid', 'casos'] = 11
+    revised['2020-04-01', 'Madrid', 'hospital'] = 5
+    assert record(connection, 'ccaa', revised, '2020-04-02T10:00:00', 'a') == 0
+    assert latest(connection, 'ccaa') == cells
+    # The new figures go to the next release
+    assert record(connection, 'ccaa', revised, '2020-04-03T10:00:00', 'b') == 2
+    assert latest(connection, 'ccaa') == revised
+    assert as_of(connection, 'ccaa', '2020-04-02') == [
+        ('2020-04-01', 'Madrid', 'casos', 10),
+        ('2020-04-01', 'Madrid', 'uci', 2)]
+
+
+def test_datasets_share_a_release(connection):
+    record(connection, 'ccaa', {('2020-04-01', 'Madrid', 'casos'): 10},
+           '2020-04-02T10:00:00', 'a')
+    record(connection, 'nacional', {('2020-04-01', '', 'casos'): 50},
+           '2020-04-02T10:00:00', 'a')
+    assert connection.execute(
+        'SELECT COUNT(*) FROM releases').fetchone()[0] == 1
+    assert latest(connection, 'nacional') == {
+        ('2020-04-01', '', 'casos'): 50}
@@ -0,0 +1,81 @@
+"""Incremental and --only runs of the ETL on small synthetic inputs."""
+
+import json
+
+import os
+
+import re
+
+from etl.main import run
+from etl.stages import UPDATED
+
+import pytest
+
+from .conftest import Workspace, small_inputs
+
+
+UPDATED_BYTES = re.compile(UPDATED.pattern.encode())
+
+
+def outputs(path):
+    """Contents of the output files, without their update dates.
+
+    The compressed and hashed copies are left out: they follow the files.
+    """
+    files = {}
+    for dir_path, dir_names, file_names in os.walk(path):
+        dir_names[:] = [name for name in dir_names if name != 'dist']
+        for name in file_names:
+            if name == 'manifest.json' or name.endswith(('.gz', '.br')):
+                continue
+            file_name = os.path.join(dir_path, name)
+            with open(file_name, 'rb') as file:
+                files[os.path.relpath(file_name, path)] = \
+                    UPDATED_BYTES.sub(b'', file.read())
+    return files
+
+
+def revise(inputs):
+    """Inputs of a later release: revised altas of one region."""
+    altas = inputs['altas']
+    revised = (altas.cod_ine == 13) & (altas.fecha >= '2020-04-01')
+    altas.loc[revised, 'total'] += 5
+    return inputs
+
+
+def stages_run(workspace):
+    with open(workspace.etl + 'run_report.json') as file:
+        return [stage['name'] for stage in json.load(file)['stages']]
+
+
+def test_incremental_matches_full_run(tmp_path, etl_settings):
+    incremental = Workspace(tmp_path / 'incremental', small_inputs())
+    run(incremental.config(), pull=False)
+    incremental.write_inputs(revise(small_inputs()))
+    run(incremental.config(), pull=False)
+    assert 'regiones' in stages_run(incremental)
+    assert 'eess' not in stages_run(incremental)
+
+    full = Workspace(tmp_path / 'full', revise(small_inputs()))
+    run(full.config(), pull=False)
+
+    expected = outputs(full.data)
+    assert len(expected) > 200
+    assert outputs(incremental.data) == expected
+
+
+def test_only_leaves_other_stages_for_the_update(workspace):
+    run(workspace.config(), pull=False)
+    # --only runs the stage even if its inputs did not change
+    run(workspace.config(), only=['ccaa'], pull=False)
+    assert 'ccaa' in stages_run(workspace)
+    assert 'regiones' not in stages_run(workspace)
+    # and leaves the other stages using the revised altas for the update
+    workspace.write_inputs(revise(small_inputs()))
+    run(workspace.config(), only=['ccaa'], pull=False)
+    assert 'regiones' not in stages_run(workspace)
+    run(workspace.config(), pull=False)
+    assert 'regiones' in stages_run(workspace)
+    assert 'eess' not in stages_run(workspace)
+    with pytest.raises(ValueError):
+        run(workspace.config(), only=['provincias'], pull=False)
@@ -0,0 +1,77 @@
+"""Typed reading of the inputs and their Feather snapshots."""
+
+import glob
+
+import os
+
+from unittest import mock
+
+from etl import ingest
+from etl.ingest import read_chunks, read_csv, read_input, SCHEMAS
+
+import pandas as pd
+
+import pandas.testing as pdt
+
+import pytest
+
+from .conftest import small_inputs
+
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture
+def casos_file(tmp_path):
+    file_name = str(tmp_path / 'casos.csv')
+    small_inputs()['casos'].to_csv(file_name, index=False)
+    return file_name
+
+
+def test_schema_types(casos_file):
+    df = read_csv(casos_file, SCHEMAS['casos'])
+    assert pd.api.types.is_datetime64_dtype(df.fecha)
+    assert str(df.cod_ine.dtype) == 'Int64'
+    assert str(df.total.dtype) == 'Int64'
+    assert isinstance(df.CCAA.dtype, pd.CategoricalDtype)
+
+
+def test_snapshot_round_trip(casos_file, tmp_path):
+    cache = str(tmp_path / 'cache') + '/'
+    df = read_input('casos', casos_file, cache)
+    snapshots = glob.glob(cache + 'casos.*.feather')
+    assert len(snapshots) == 1
+    # Read back from the snapshot, not from the .csv file
+    with mock.patch.object(ingest, 'read_csv') as parse:
+        cached = read_input('casos', casos_file, cache)
+    parse.assert_not_called()
+    pdt.assert_frame_equal(cached, df)
+    pdt.assert_frame_equal(df, read_csv(casos_file, SCHEMAS['casos']))
+    # A new version of the input replaces the snapshot
+    revised = small_inputs()['casos']
+    revised.loc[0, 'total'] += 1
+    revised.to_csv(casos_file, index=False)
+    df = read_input('casos', casos_file, cache)
+    assert df.loc[0, 'total'] == revised.loc[0, 'total']
+    assert len(glob.glob(cache + 'casos.*.feather')) == 1
+    assert not os.path.exists(snapshots[0])
+
+
+def test_chunks_match_whole(tmp_path):
+    file_name = str(tmp_path / 'eess.csv')
+    eess = small_inputs()['eess']
+    # Integer column with a missing value in the last chunk only
+    eess['Código\nPostal'] = eess['Código\nPostal'].astype(float)
+    eess.loc[len(eess) - 1, 'Código\nPostal'] = None
+    eess.to_csv(file_name, index=False)
+    chunks = read_chunks('eess', file_name, 70)
+    parts = list(chunks())
+    assert len(parts) == 5
+    whole = read_csv(file_name, SCHEMAS['eess'])
+    plain = {'Provincia': object}
+    for part in parts:
+        # Categories are those of the chunk
+        assert isinstance(part.Provincia.dtype, pd.CategoricalDtype)
+        assert part.astype(plain).dtypes.equals(whole.astype(plain).dtypes)
+    pdt.assert_frame_equal(
+        pd.concat(part.astype(plain) for part in parts), whole.astype(plain))
@@ -0,0 +1,173 @@
+"""Direct JSON-stat writer against pyjstat and the published datasets."""
+
+from datetime import datetime
+
+import glob
+
+import json
+
+import os
+
+from etl.config import etl_cfg
+from etl.jsonstat import (
+    column_arrays, columns_to_jsonstat, long_to_jsonstat, to_jsonstat)
+from etl.main import run
+from etl.stages import Export, export_jsonstat, prepare_series, UPDATED
+
+import numpy as np
+
+import pandas as pd
+
+from pyjstat import pyjstat
+
+import pytest
+
+from .conftest import small_inputs
+
+
+DATA = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'etl/data')
+
+
+def pyjstat_to_json(df, id_vars, value_vars, source):
+    """Original export, through pyjstat."""
+    df = df.melt(id_vars=id_vars, value_vars=value_vars,
+                 var_name='Variables')
+    df = df.sort_values(by=id_vars + ['Variables'])
+    dataset = pyjstat.Dataset.read(df, source=source)
+    dataset.setdefault('role', {'metric': ['Variables']})
+    return dataset.write(output='jsonstat')
+
+
+def categories(dataset, name):
+    """Categories of a dimension, in the order of its index."""
+    index = dataset['dimension'][name]['category']['index']
+    return sorted(index, key=index.get)
+
+
+def cells(dataset):
+    """Value of every cell of a dataset, by its categories."""
+    keys = pd.MultiIndex.from_product(
+        [categories(dataset, name) for name in dataset['id']])
+    return dict(zip(keys, dataset['value']))
+
+
+def assert_equivalent(dataset, expected):
+    """Check that two datasets have the same structure and values."""
+    assert dataset['id'] == expected['id']
+    assert dataset['size'] == expected['size']
+    assert dataset['role'] == expected['role']
+    assert dataset['source'] == expected['source']
+    for name in expected['id']:
+        assert categories(dataset, name) == categories(expected, name)
+        assert dataset['dimension'][name]['label'] == \
+            expected['dimension'][name]['label']
+    values, expected_values = cells(dataset), cells(expected)
+    assert list(values) == list(expected_values)
+    for key, value in expected_values.items():
+        if value is None or isinstance(value, str):
+            assert values[key] == value, key
+        else:
+            assert values[key] == pytest.approx(value), key
+
+
+def read_long(dataset):
+    """Read a JSON-stat dataset into a long-format dataframe.
+
+    Categories that are all digits, such as the ids of the points of
+    interest, are read as integers, so that they sort as written.
+    """
+    columns = []
+    for name in dataset['id']:
+        keys = categories(dataset, name)
+        if all(key.isdigit() for key in keys):
+            keys = [int(key) for key in keys]
+        columns.append(keys)
+    df = pd.MultiIndex.from_product(
+        columns, names=dataset['id']).to_frame(index=False)
+    df['value'] = pd.Series(dataset['value'], dtype=object)
+    return df
+
+
+def test_matches_pyjstat():
+    df = pd.DataFrame({
+        'fecha': ['2020-03-02', '2020-03-01', '2020-03-01', '2020-03-02'],
+        'ccaa': ['Madrid', 'Madrid', 'Cantabria', 'Cantabria'],
+        'casos': [5, 3, 1, np.nan],
+        'fallecidos': [1.0, 0.0, 0.0, 0.0]})
+    for id_vars in [['fecha', 'ccaa'], ['ccaa', 'fecha']]:
+        expected = json.loads(pyjstat_to_json(
+            df, list(id_vars), ['casos', 'fallecidos'], 'DATADISTA'))
+        dataset = json.loads(to_jsonstat(
+            df, id_vars, ['casos', 'fallecidos'], 'DATADISTA'))
+        assert_equivalent(dataset, expected)
+
+
+@pytest.mark.parametrize(
+    'file_name', sorted(glob.glob(os.path.join(DATA, '*.json-stat'))),
+    ids=os.path.basename)
+def test_rewrites_published_dataset(file_name):
+    with open(file_name) as file:
+        expected = json.load(file)
+    df = read_long(expected)
+    id_vars = expected['id'][:-1]
+    unit = expected['dimension']['Variables']['category'].get('unit')
+    dataset = json.loads(long_to_jsonstat(
+        df, id_vars, 'value', expected['source'], unit))
+    assert_equivalent(dataset, expected)
+    # Wide table, one column per variable
+    wide = df.pivot(index=id_vars, columns='Variables', values='value')
+    wide = wide.reset_index()
+    variables = categories(expected, 'Variables')
+    dataset = json.loads(to_jsonstat(
+        wide, id_vars, variables, expected['source'], unit))
+    assert_equivalent(dataset, expected)
+    # Units of the variables of the dataset
+    written = dataset['dimension']['Variables']['category'].get('unit', {})
+    assert written == {key: value for key, value in (unit or {}).items()
+                       if key in variables}
+
+
+def test_daily_series_have_units(workspace):
+    run(workspace.config(), pull=False)
+    file_names = glob.glob(workspace.data + '*_diario.json-stat')
+    # Every variable, national and of every region, and all of them
+    assert len(file_names) == 5 + 4 * 19 + 1
+    for file_name in file_names:
+        with open(file_name) as file:
+            dataset = json.load(file)
+        category = dataset['dimension']['Variables']['category']
+        assert sorted(category.get('unit', {})) == \
+            sorted(category['index']), file_name
+        for unit in category['unit'].values():
+            assert unit == {'decimals': 0, 'label': 'Número de personas'}
+
+
+def test_column_arrays_match_dataframe():
+    df = pd.DataFrame({
+        'fecha': ['2020-03-02', '2020-03-01', '2020-03-03'],
+        'casos': pd.array([5, None, 7], dtype='Int64'),
+        'variacion': [1.23456, np.nan, 2.0],
+        'nota': ['a', None, 'c']})
+    unit = {'variacion': {'decimals': 2, 'label': '%'}}
+    updated = datetime(2020, 5, 1)
+    for value_vars in [['casos', 'variacion'], ['casos', 'nota']]:
+        assert columns_to_jsonstat(
+            column_arrays(df, ['fecha'], value_vars), ['fecha'], value_vars,
+            'DATADISTA', unit, updated) == to_jsonstat(
+                df, ['fecha'], value_vars, 'DATADISTA', unit, updated)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_batch_export_matches_one_by_one(tmp_path, etl_settings, workers):
+    casos = prepare_series(small_inputs()['casos'])
+    exports = [
+        Export(region, ['fecha'], ['total'], etl_cfg.metadata.diario,
+               str(tmp_path / ('casos_%d.json-stat' % cod_ine)))
+        for cod_ine, region in casos.groupby('cod_ine')]
+    export_jsonstat(exports, workers)
+    for frame, id_vars, value_vars, unit, file_name in exports:
+        with open(file_name) as file:
+            written = UPDATED.sub('', file.read())
+        assert written == UPDATED.sub('', to_jsonstat(
+            frame, id_vars, value_vars, etl_cfg.metadata.source, unit))
@@ -0,0 +1,98 @@
+"""Memory bound of the point-of-interest exports read in chunks."""
+
+import os
+
+import tracemalloc
+
+from etl import benchmark, stages
+from etl.ingest import read_input
+from etl.stages import UPDATED
+
+import pytest
+
+
+def peak_memory(func):
+    """Peak of the memory traced while running a function, in bytes."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.fixture
+def eess_input(tmp_path, etl_settings):
+    """Write a synthetic eess input of some rows; return its file name."""
+    def write(rows):
+        points = dict(benchmark.POINTS)
+        benchmark.POINTS['eess'] = rows
+        try:
+            inputs = benchmark.synthetic_inputs(1)
+        finally:
+            benchmark.POINTS.update(points)
+        path = tmp_path / str(rows)
+        (path / 'output').mkdir(parents=True)
+        etl_settings.input['dir_path'] = str(path) + '/'
+        etl_settings.output['path'] = str(path / 'output') + '/'
+        benchmark.write_inputs({'eess': inputs['eess']}, str(path) + '/')
+        return str(path) + '/' + etl_settings.input.files['eess']
+    etl_settings.output['chunksize'] = 1000
+    return write
+
+
+def test_write_points_memory_bound(eess_input):
+    eess_input(8000)
+    # The stage must not load the whole input: data is empty. The first
+    # run also imports and caches what the stage uses
+    stages.eess({})
+    small = peak_memory(lambda: stages.eess({}))
+    file_name = eess_input(32000)
+    large = peak_memory(lambda: stages.eess({}))
+    whole = peak_memory(lambda: read_input('eess', file_name))
+    # Four times the rows take about the same memory, a fraction of the
+    # memory of reading the input whole
+    assert large < 1.5 * small
+    assert large < whole / 2
+
+
+def write_eess_shards(data):
+    name, variables, categorical = stages.POINTS['eess']
+    stages.write_shards(
+        stages.point_chunks(data, 'eess'), name, variables, categorical)
+
+
+def test_write_shards_memory_bound(eess_input, etl_settings):
+    # Few large tiles, to keep the test fast
+    etl_settings.output['tile_size'] = 2
+    eess_input(8000)
+    write_eess_shards({})
+    small = peak_memory(lambda: write_eess_shards({}))
+    file_name = eess_input(32000)
+    large = peak_memory(lambda: write_eess_shards({}))
+    whole = peak_memory(lambda: read_input('eess', file_name))
+    assert large < 1.5 * small
+    assert large < whole / 2
+
+
+def shard_files(path):
+    """Content of every shard file, without its update date."""
+    files = {}
+    for folder, _, names in os.walk(path):
+        for name in names:
+            with open(os.path.join(folder, name)) as file:
+                files[os.path.relpath(os.path.join(folder, name), path)] = \
+                    UPDATED.sub('', file.read())
+    return files
+
+
+def test_shards_in_chunks_match_whole(eess_input, etl_settings):
+    file_name = eess_input(3000)
+    path = etl_settings.output.path + 'puntos'
+    write_eess_shards({})
+    chunked = shard_files(path)
+    etl_settings.output['chunksize'] = None
+    write_eess_shards(
+        {'eess': stages.PREPARE['eess'](read_input('eess', file_name))})
+    assert shard_files(path) == chunked
+    assert len(chunked) > 3
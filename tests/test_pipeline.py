@@ -0,0 +1,31 @@
+"""Inputs loaded by the process pool of the stages."""
+
+from etl.pipeline import Stage, run_stages
+
+import pandas as pd
+
+
+# Inputs loaded in this process
+LOADED = []
+
+
+def load_input(name):
+    LOADED.append(name)
+    return pd.DataFrame()
+
+
+def use_inputs(data):
+    for name in data:
+        data[name]
+
+
+def test_streamed_inputs_are_not_loaded_before_forking():
+    del LOADED[:]
+    stages = [Stage('ccaa', use_inputs, ['casos'], []),
+              Stage('teselas', use_inputs, ['casos', 'eess'], []),
+              Stage('eess', use_inputs, ['eess'], [])]
+    done = [stage.name for stage, _ in run_stages(
+        stages, load_input, jobs=2, streamed=['eess'])]
+    assert sorted(done) == ['ccaa', 'eess', 'teselas']
+    # Only the input shared by two stages that is not streamed
+    assert LOADED == ['casos']
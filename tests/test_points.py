@@ -0,0 +1,115 @@
+"""Columns format and shards of the point-of-interest datasets."""
+
+import json
+
+import numpy as np
+
+from etl.main import run
+from etl.points import coordinates, stream_columns, to_columns
+from etl.stages import POINTS, PREPARE
+
+import pandas as pd
+
+import pandas.testing as pdt
+
+import pytest
+
+from .conftest import small_inputs
+
+
+def decode(dataset):
+    """Read a table of the columns format into a dataframe."""
+    columns = {}
+    for column, values in dataset['columns'].items():
+        if isinstance(values, dict):
+            categories = values['categories']
+            values = [None if code is None else categories[code]
+                      for code in values['codes']]
+        columns[column] = pd.Series(values, dtype=object)
+    df = pd.DataFrame(columns)
+    assert len(df) == dataset['size']
+    return df
+
+
+@pytest.fixture
+def eess():
+    """Prepared eess records, with missing values and a bad coordinate."""
+    df = PREPARE['eess'](small_inputs()['eess'])
+    df.loc[3, 'provincia'] = np.nan
+    df.loc[5, 'direccion'] = np.nan
+    df.loc[7, 'Latitud'] = 'N/D'
+    return df
+
+
+def expected(df, columns, numeric):
+    """Records as the columns format should give them back."""
+    df = df[columns].astype(object)
+    for column in numeric:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+    return df.astype(object).where(df.notnull(), None)
+
+
+def test_columns_round_trip(eess):
+    _, variables, categorical = POINTS['eess']
+    numeric = ['Latitud', 'Longitud']
+    dataset = json.loads(to_columns(
+        eess, variables, 'DATADISTA', categorical=categorical,
+        numeric=numeric))
+    assert dataset['class'] == 'table'
+    assert sorted(dataset['columns']['provincia']['categories']) == \
+        dataset['columns']['provincia']['categories']
+    assert isinstance(dataset['columns']['Latitud'][0], float)
+    pdt.assert_frame_equal(
+        decode(dataset), expected(eess, variables, numeric))
+
+
+def test_stream_columns_matches_whole(eess, tmp_path):
+    _, variables, categorical = POINTS['eess']
+    numeric = ['Latitud', 'Longitud']
+    updated = pd.Timestamp('2020-05-01').to_pydatetime()
+    # Chunks of different sizes, some missing a category
+    bounds = [0, 1, 40, 41, 180, len(eess)]
+    file_name = str(tmp_path / 'eess.columns.json')
+    with open(file_name, 'w') as file:
+        rows = stream_columns(
+            file, lambda: (eess.iloc[i:j] for i, j in zip(bounds, bounds[1:])),
+            variables, 'DATADISTA', categorical=categorical,
+            numeric=numeric, updated=updated)
+    assert rows == len(eess)
+    with open(file_name) as file:
+        assert file.read() == to_columns(
+            eess, variables, 'DATADISTA', categorical=categorical,
+            numeric=numeric, updated=updated)
+
+
+def test_shards_partition_the_records(workspace):
+    run(workspace.config(), pull=False)
+    for source, (name, variables, _) in POINTS.items():
+        with open(workspace.data + name + '.columns.json') as file:
+            whole = decode(json.load(file))
+        whole.insert(0, 'id', range(len(whole)))
+        with open(workspace.data + 'puntos/' + name + '/index.json') as file:
+            index = json.load(file)
+        assert index['size'] == len(whole)
+        lat, lon = coordinates(whole)
+        for kind in ['provincia', 'tesela']:
+            shards = []
+            for key, entry in index[kind].items():
+                with open(workspace.data + 'puntos/' + name + '/' +
+                          entry['file']) as file:
+                    shard = decode(json.load(file))
+                assert len(shard) == entry['size']
+                # Coordinates inside the bounding box of the shard
+                x0, y0, x1, y1 = entry['bbox']
+                inside = (shard.Longitud.astype(float).between(x0, x1) &
+                          shard.Latitud.astype(float).between(y0, y1))
+                assert inside.all(), key
+                shards.append(shard)
+            shards = pd.concat(shards).astype({'id': int})
+            shards = shards.sort_values('id').reset_index(drop=True)
+            if kind == 'provincia':
+                records = whole[whole.provincia.notnull()]
+            else:
+                records = whole[~np.isnan(lat)]
+            pdt.assert_frame_equal(
+                shards, records.reset_index(drop=True), check_dtype=False)
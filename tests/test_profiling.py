@@ -0,0 +1,44 @@
+"""Metrics and profiles of the stages."""
+
+import sys
+
+import tracemalloc
+
+from etl.pipeline import Sources, Stage
+from etl.profiling import execute_stage
+
+import pandas as pd
+
+import pytest
+
+
+def load_input(name):
+    return pd.DataFrame({'casos': [1, 2, 3]})
+
+
+def count_rows(data):
+    len(data['casos'])
+
+
+def fail(data):
+    raise ValueError('failed stage')
+
+
+def test_execute_stage_profile(tmp_path):
+    profile_dir = str(tmp_path / 'profile')
+    metrics = execute_stage(Stage('ccaa', count_rows, ['casos'], []),
+                            Sources(load_input), profile_dir)
+    assert metrics['name'] == 'ccaa'
+    assert metrics['rows_in'] == 3
+    assert metrics['tracemalloc_peak'] > 0
+    assert (tmp_path / 'profile' / 'ccaa.prof').exists()
+    assert not tracemalloc.is_tracing()
+
+
+def test_failed_stage_stops_profiling(tmp_path):
+    with pytest.raises(ValueError):
+        execute_stage(Stage('ccaa', fail, ['casos'], []),
+                      Sources(load_input), str(tmp_path))
+    assert not tracemalloc.is_tracing()
+    assert sys.getprofile() is None
+    assert list(tmp_path.iterdir()) == []
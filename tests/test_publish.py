@@ -0,0 +1,31 @@
+"""Commits of the output repository."""
+
+import os
+
+from etl.config import etl_cfg
+from etl.main import changed_files, run
+
+
+def test_unchanged_outputs_make_no_commit(workspace):
+    run(workspace.config(), pull=False)
+    commits = workspace.commits()
+    # New release of an input with the same data
+    with open(workspace.dir_path + etl_cfg.input.files['casos'], 'a') as file:
+        file.write('\n')
+    run(workspace.config(), pull=False)
+    run(workspace.config(), only=['ccaa'], pull=False)
+    assert workspace.commits() == commits
+    assert changed_files(workspace.output) == []
+
+
+def test_changed_files_exclude(workspace):
+    os.makedirs(workspace.data)
+    # State and default benchmark results, in .gitignore
+    for name in ['etl_state.json', 'benchmarks.jsonl']:
+        with open(workspace.etl + name, 'w') as file:
+            file.write('{}')
+    with open(workspace.data + 'casos.json-stat', 'w') as file:
+        file.write('{}')
+    assert changed_files(workspace.output) == ['etl/data/casos.json-stat']
+    assert changed_files(
+        workspace.output, [workspace.data + 'casos.json-stat']) == []
@@ -0,0 +1,191 @@
+"""Query server over the datasets, also while the ETL rewrites them."""
+
+import json
+
+import os
+
+import threading
+
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from etl.jsonstat import to_jsonstat
+from etl.server import DatasetUnavailable, LRUCache, Store, make_server
+from etl.stages import replace_file
+
+import pandas as pd
+
+import pytest
+
+
+def dataset():
+    return to_jsonstat(
+        pd.DataFrame({'fecha': ['2020-04-01', '2020-04-02'],
+                      'casos': [10, 12]}),
+        ['fecha'], ['casos'], 'Fuente')
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = make_server(str(tmp_path) + '/', '127.0.0.1', 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def todos():
+    """Dataset of three dimensions: fecha, ccaa and Variables."""
+    rows = [(fecha, ccaa, 10 * day + region, day + region)
+            for day, fecha in enumerate(['2020-04-01', '2020-04-02',
+                                         '2020-04-03'])
+            for region, ccaa in enumerate(['Cantabria', 'Madrid', 'Murcia'])]
+    return to_jsonstat(
+        pd.DataFrame(rows, columns=['fecha', 'ccaa', 'casos', 'uci']),
+        ['fecha', 'ccaa'], ['casos', 'uci'], 'Fuente')
+
+
+def get(server, path, headers=None):
+    """Status, body and headers of a GET request."""
+    url = 'http://127.0.0.1:%d%s' % (server.server_address[1], path)
+    try:
+        with urlopen(Request(url, headers=headers or {})) as response:
+            return response.status, response.read(), response.headers
+    except HTTPError as error:
+        return error.code, error.read(), error.headers
+
+
+def test_half_written_file_is_unavailable(tmp_path):
+    (tmp_path / 'casos.json-stat').write_text(dataset()[:50])
+    with pytest.raises(DatasetUnavailable):
+        Store(str(tmp_path) + '/').get('casos')
+
+
+def test_half_written_file_gets_503(tmp_path, server):
+    file_name = str(tmp_path / 'casos.json-stat')
+    with open(file_name, 'w') as file:
+        file.write(dataset()[:50])
+    assert get(server, '/casos')[0] == 503
+    replace_file(dataset(), file_name)
+    status, body, _ = get(server, '/casos?fecha=2020-04-02')
+    assert status == 200
+    assert json.loads(body)['value'] == [12]
+    assert get(server, '/casos?fecha=2020-05-01')[0] == 400
+
+
+def test_replace_file_leaves_no_temporary_file(tmp_path):
+    file_name = str(tmp_path / 'casos.json-stat')
+    json_data = dataset()
+    assert replace_file(json_data, file_name)[1]
+    assert os.listdir(str(tmp_path)) == ['casos.json-stat']
+    with open(file_name) as file:
+        assert file.read() == json_data
+
+
+@pytest.fixture
+def todos_file(tmp_path):
+    file_name = str(tmp_path / 'todos.json-stat')
+    replace_file(todos(), file_name)
+    return file_name
+
+
+def test_index(server, todos_file):
+    status, body, _ = get(server, '/')
+    assert status == 200
+    assert json.loads(body) == {
+        'todos': {'fecha': 3, 'ccaa': 3, 'Variables': 2}}
+
+
+def test_slice_several_dimensions(server, todos_file):
+    status, body, headers = get(
+        server, '/todos?ccaa=Murcia,Cantabria&Variables=uci'
+        '&from=2020-04-02&to=2020-04-03')
+    assert status == 200
+    assert headers['Content-Type'].startswith('application/json')
+    dataset = json.loads(body)
+    assert dataset['id'] == ['fecha', 'ccaa', 'Variables']
+    assert dataset['size'] == [2, 2, 1]
+    assert list(dataset['dimension']['fecha']['category']['index']) == [
+        '2020-04-02', '2020-04-03']
+    # Categories in the order of the query
+    assert dataset['dimension']['ccaa']['category']['index'] == {
+        'Murcia': 0, 'Cantabria': 1}
+    assert dataset['value'] == [3, 1, 4, 2]
+    # Open ranges
+    status, body, _ = get(server, '/todos?from=2020-04-03')
+    assert json.loads(body)['size'] == [1, 3, 2]
+    status, body, _ = get(server, '/todos?to=2020-04-01&ccaa=Madrid')
+    assert json.loads(body)['value'] == [1, 1]
+
+
+def test_csv(server, todos_file):
+    status, body, headers = get(
+        server, '/todos?format=csv&ccaa=Madrid&fecha=2020-04-01')
+    assert status == 200
+    assert headers['Content-Type'].startswith('text/csv')
+    assert body.decode() == (
+        'fecha,ccaa,Variables,value\n'
+        '2020-04-01,Madrid,casos,1\n'
+        '2020-04-01,Madrid,uci,1\n')
+
+
+def test_errors(server, todos_file):
+    assert get(server, '/missing')[0] == 404
+    assert get(server, '/../todos')[0] == 404
+    assert get(server, '/todos?provincia=Madrid')[0] == 400
+    assert get(server, '/todos?ccaa=Narnia')[0] == 400
+    assert get(server, '/todos?format=xml')[0] == 400
+    assert get(server, '/todos?from=1&from=2')[0] == 400
+
+
+def test_etag(server, todos_file):
+    status, body, headers = get(server, '/todos?ccaa=Madrid')
+    tag = headers['ETag']
+    status, body, headers = get(
+        server, '/todos?ccaa=Madrid', {'If-None-Match': tag})
+    assert status == 304
+    assert body == b''
+    assert headers['ETag'] == tag
+    # Another slice, or another version of the dataset, has another ETag
+    assert get(server, '/todos?ccaa=Murcia', {'If-None-Match': tag})[0] == 200
+    replace_file(dataset(), todos_file)
+    status, body, headers = get(
+        server, '/todos', {'If-None-Match': tag})
+    assert status == 200
+    assert headers['ETag'] != tag
+
+
+def test_reload_after_rewrite(server, todos_file):
+    assert json.loads(get(server, '/todos')[1])['size'] == [3, 3, 2]
+    replace_file(dataset(), todos_file)
+    status, body, _ = get(server, '/todos')
+    assert status == 200
+    assert json.loads(body)['value'] == [10, 12]
+    assert get(server, '/todos?ccaa=Madrid')[0] == 400
+
+
+def test_cache_size(tmp_path, todos_file):
+    server = make_server(str(tmp_path) + '/', '127.0.0.1', 0, cache_size=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        for ccaa in ['Cantabria', 'Madrid', 'Murcia']:
+            assert get(server, '/todos?ccaa=' + ccaa)[0] == 200
+        cached = [key[-1] for key in server.cache.items]
+        assert cached == [(('ccaa', ('Madrid',)),),
+                          (('ccaa', ('Murcia',)),)]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    # b is now the least recently used
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
@@ -0,0 +1,28 @@
+"""Outputs of the stages on edge cases of the inputs."""
+
+import json
+
+from etl.stages import prepare_series, regiones
+
+from .conftest import small_inputs
+
+
+def test_regions_with_short_series(tmp_path, etl_settings):
+    etl_settings.output['path'] = str(tmp_path) + '/'
+    inputs = small_inputs()
+    data = {}
+    for name in ['casos', 'altas', 'uci', 'fallecidos']:
+        df = inputs[name]
+        # Ceuta only published in the last 5 days
+        ceuta = df[df.cod_ine == 10]
+        df = df.drop(ceuta.index[:-5])
+        data[name] = prepare_series(df)
+    regiones(data)
+    with open(str(tmp_path / 'casos_ceuta_variacion.json-stat')) as file:
+        dataset = json.load(file)
+    assert dataset['size'] == [0, 1]
+    assert dataset['value'] == []
+    with open(str(tmp_path / 'casos_ceuta_diario.json-stat')) as file:
+        assert json.load(file)['size'] == [5, 1]
+    with open(str(tmp_path / 'casos_madrid_variacion.json-stat')) as file:
+        assert json.load(file)['size'] == [80, 1]
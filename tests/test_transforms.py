@@ -0,0 +1,118 @@
+"""Vectorized transforms against the row-by-row loops they replaced."""
+
+from datetime import datetime, timedelta
+
+from etl.transforms import deacumulate, delay_date, doubling_time, variation
+
+import numpy as np
+
+import pandas as pd
+
+import pandas.testing as pdt
+
+
+def loop_deacumulate(df, variable1, variable2):
+    """Original implementation of deacumulate."""
+    for i in range(1, len(df)):
+        df.loc[i, variable2] = df.loc[i, variable1] - \
+            df.loc[i - 1, variable1]
+    return df
+
+
+def loop_delay_date(df):
+    """Original implementation of delay_date."""
+    for i in range(0, len(df)):
+        date = datetime.strptime(df.loc[i, 'fecha'], '%Y-%m-%d')
+        df.loc[i, 'fecha'] = (date - timedelta(days=1)).strftime('%Y-%m-%d')
+    return df
+
+
+def loop_variation(df, variable):
+    """Original computation of the daily variation rate."""
+    for i in range(1, len(df)):
+        if df.loc[i - 1, variable] > 0:
+            df.loc[i, 'variacion'] = 100 * (
+                (df.loc[i, variable] - df.loc[i - 1, variable]) /
+                df.loc[i - 1, variable])
+        else:
+            df.loc[i, 'variacion'] = None
+    return df
+
+
+def series():
+    return pd.DataFrame({
+        'fecha': ['2020-03-01', '2020-03-02', '2020-03-03', '2020-03-04',
+                  '2020-03-05'],
+        'casos': [0.0, 4.0, 10.0, 10.0, 25.0]})
+
+
+def test_deacumulate_matches_loop():
+    expected = loop_deacumulate(series(), 'casos', 'diario')
+    result = deacumulate(series(), 'casos', 'diario')
+    pdt.assert_frame_equal(result, expected)
+    assert np.isnan(result.loc[0, 'diario'])
+    assert result['diario'].tolist()[1:] == [4.0, 6.0, 0.0, 15.0]
+
+
+def test_deacumulate_by_group():
+    df = pd.concat([series().assign(cod_ine=1),
+                    series().assign(cod_ine=2, casos=lambda d: d.casos * 2)],
+                   ignore_index=True)
+    result = deacumulate(df.copy(), 'casos', 'diario', by='cod_ine')
+    for cod_ine, group in df.groupby('cod_ine'):
+        expected = loop_deacumulate(
+            group.reset_index(drop=True), 'casos', 'diario')
+        pdt.assert_series_equal(
+            result.loc[result.cod_ine == cod_ine, 'diario'].reset_index(
+                drop=True),
+            expected['diario'])
+
+
+def test_delay_date_matches_loop():
+    df = pd.DataFrame({'fecha': ['2020-03-01', '2020-01-01', '2020-02-29'],
+                       'casos': [1, 2, 3]})
+    pdt.assert_frame_equal(delay_date(df.copy()), loop_delay_date(df.copy()))
+    assert delay_date(df.copy())['fecha'].tolist() == [
+        '2020-02-29', '2019-12-31', '2020-02-28']
+
+
+def test_delay_date_datetimes():
+    df = pd.DataFrame({'fecha': pd.to_datetime(['2020-03-01'])})
+    assert delay_date(df)['fecha'].tolist() == ['2020-02-29']
+
+
+def test_variation_matches_loop():
+    expected = loop_variation(series(), 'casos')
+    result = variation(series(), 'casos')
+    # The loop leaves None in an object column on pandas 2
+    pdt.assert_series_equal(
+        result['variacion'], expected['variacion'].astype('float64'))
+    # No previous value, and previous value zero
+    assert np.isnan(result.loc[0, 'variacion'])
+    assert np.isnan(result.loc[1, 'variacion'])
+    assert result['variacion'].tolist()[2:] == [150.0, 0.0, 150.0]
+
+
+def test_variation_by_group():
+    df = pd.concat([series().assign(cod_ine=1),
+                    series().assign(cod_ine=2)], ignore_index=True)
+    result = variation(df, 'casos', by='cod_ine')
+    # The first row of every group has no previous value
+    assert result['variacion'].isna().tolist() == [
+        True, True, False, False, False] * 2
+
+
+def test_doubling_time():
+    df = pd.DataFrame({'cantabria': [10.0, 20.0, 40.0, 40.0]})
+    result = doubling_time(df, days=1)['cantabria']
+    # No previous value, doubling every day, no growth
+    assert np.isnan(result[0])
+    assert result.tolist()[1:3] == [1.0, 1.0]
+    assert np.isnan(result[3])
+
+
+def test_doubling_time_from_zero():
+    # A region going from 0 to some cases does not double in 0 days
+    df = pd.DataFrame({'madrid': [0.0] * 7 + [5.0, 9.0]})
+    result = doubling_time(df)['madrid']
+    assert result.isna().all()
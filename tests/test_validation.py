@@ -0,0 +1,123 @@
+"""Checks of the time series inputs."""
+
+import json
+
+import os
+
+from etl.config import etl_cfg
+from etl.ingest import SCHEMAS, read_csv
+from etl.main import run
+from etl.stages import prepare_series
+from etl.validation import validate
+
+import pandas as pd
+
+import pytest
+
+from .conftest import Workspace, small_inputs
+
+
+def typed(df, name, tmp_path):
+    """Read an input as load does: typed, then prepared."""
+    file_name = str(tmp_path / (name + '.csv'))
+    df.to_csv(file_name, index=False)
+    return prepare_series(read_csv(file_name, SCHEMAS[name]))
+
+
+def issues(report):
+    return {(issue['input'], issue['check']): issue
+            for issue in report['issues']}
+
+
+@pytest.fixture
+def casos():
+    return small_inputs()['casos']
+
+
+def test_valid_inputs(casos, tmp_path, etl_settings):
+    report = validate({'casos': typed(casos, 'casos', tmp_path)}, ['casos'])
+    assert report['valid']
+    assert report['issues'] == []
+
+
+def test_issues(casos, tmp_path, etl_settings):
+    madrid = casos.index[casos.cod_ine == 13]
+    # Repeated row, and an unknown region
+    casos = pd.concat([casos, casos.loc[madrid[:1]]], ignore_index=True)
+    casos.loc[casos.cod_ine == 19, 'cod_ine'] = 20
+    # Day missing in Cantabria, accumulated figure falling in Madrid
+    cantabria = casos.index[casos.cod_ine == 6]
+    casos = casos.drop(cantabria[10]).reset_index(drop=True)
+    madrid = casos.index[casos.cod_ine == 13]
+    casos.loc[madrid[30], 'total'] = casos.loc[madrid[29], 'total'] - 1
+    etl_settings.validation['examples'] = 2
+    report = validate({'casos': typed(casos, 'casos', tmp_path)}, ['casos'])
+    assert not report['valid']
+    found = issues(report)
+    assert set(found) == {
+        ('casos', 'regions'), ('casos', 'duplicates'),
+        ('casos', 'continuity'), ('casos', 'monotonic')}
+    assert found['casos', 'regions']['severity'] == 'error'
+    assert found['casos', 'regions']['rows'] == \
+        int((casos.cod_ine == 20).sum())
+    assert found['casos', 'duplicates']['rows'] == 2
+    assert found['casos', 'continuity']['severity'] == 'warning'
+    assert [row['cod_ine'] for row in
+            found['casos', 'continuity']['examples']] == [6]
+    monotonic = found['casos', 'monotonic']
+    assert monotonic['severity'] == 'warning'
+    assert monotonic['rows'] == 1
+    example, = monotonic['examples']
+    assert example['cod_ine'] == 13
+    assert example['total'] == example['total_anterior'] - 1
+    assert all(len(issue['examples']) <= 2 for issue in found.values())
+    json.dumps(report)
+
+
+def test_severity(casos, tmp_path, etl_settings):
+    casos = casos.reset_index(drop=True)
+    casos.loc[casos.cod_ine == 19, 'cod_ine'] = 20
+    df = typed(casos, 'casos', tmp_path)
+    etl_settings.validation['checks'] = dict(
+        etl_cfg.validation.checks, regions='warning')
+    report = validate({'casos': df}, ['casos'])
+    assert report['valid']
+    assert [issue['check'] for issue in report['issues']] == ['regions']
+    etl_settings.validation['checks'] = dict(
+        etl_cfg.validation.checks, regions=None)
+    assert validate({'casos': df}, ['casos'])['issues'] == []
+
+
+def test_missing_column(casos, tmp_path, etl_settings):
+    df = typed(casos, 'casos', tmp_path).drop(columns='total')
+    report = validate({'casos': df}, ['casos'])
+    assert not report['valid']
+    issue, = report['issues']
+    assert issue['check'] == 'schema'
+    assert issue['examples'] == [{'missing': ['total']}]
+
+
+def test_invalid_inputs_block_publishing(tmp_path, etl_settings):
+    inputs = small_inputs()
+    uci = inputs['uci']
+    madrid = uci.index[uci.cod_ine == 13]
+    uci.loc[madrid[-1], 'total'] = uci.loc[madrid[-2], 'total'] - 1
+    workspace = Workspace(tmp_path, inputs)
+    commits = workspace.commits()
+    config = workspace.config()
+    config['validation'] = {'checks': dict(
+        etl_cfg.validation.checks, monotonic='error')}
+    run(config, pull=False)
+    with open(workspace.etl + 'run_report.json') as file:
+        report = json.load(file)
+    assert not report['validation']['valid']
+    assert ('uci', 'monotonic') in issues(report['validation'])
+    assert 'stages' not in report
+    assert os.listdir(workspace.data) == []
+    assert not os.path.exists(workspace.etl + 'etl_state.json')
+    assert workspace.commits() == commits
+    # Publishing anyway
+    config['validation']['block'] = False
+    run(config, pull=False)
+    assert os.listdir(workspace.data)
+    assert workspace.commits() == commits + 1
@@ -0,0 +1,106 @@
+"""Watch mode against a local source repository and its bare origin."""
+
+import json
+
+import os
+
+from unittest import mock
+
+from etl import benchmark
+from etl.main import run
+
+from git import Repo
+
+from .conftest import commit_all, small_inputs
+
+
+def publish_release(workspace):
+    """Push new casos of Cantabria to the origin of the source."""
+    path = os.path.join(workspace.root, 'publisher')
+    if os.path.exists(path):
+        repo = Repo(path)
+    else:
+        repo = Repo.clone_from(
+            os.path.join(workspace.root, 'source.git'), path)
+        with repo.config_writer() as writer:
+            writer.set_value('user', 'name', 'test')
+            writer.set_value('user', 'email', 'test@example.com')
+    inputs = small_inputs()
+    casos = inputs['casos']
+    casos.loc[(casos.cod_ine == 6) & (casos.fecha >= '2020-05-01'),
+              'total'] += 3
+    benchmark.write_inputs(
+        {'casos': casos}, os.path.join(path, 'COVID 19') + '/')
+    commit_all(repo, 'release')
+    repo.remote('origin').push('HEAD')
+    return repo.head.commit.hexsha
+
+
+def sleeps(*actions):
+    """Patch time.sleep of main.py to run one action per call, then stop."""
+    calls = iter(actions)
+
+    def sleep(seconds):
+        action = next(calls, None)
+        if action is None:
+            raise KeyboardInterrupt
+        action()
+    return mock.patch('etl.main.time.sleep', side_effect=sleep)
+
+
+def report(workspace):
+    with open(workspace.etl + 'run_report.json') as file:
+        return json.load(file)
+
+
+def test_watch_runs_new_releases(workspace):
+    released = []
+    with sleeps(lambda: released.append(publish_release(workspace))):
+        run(workspace.config(), watch_seconds=60)
+    assert workspace.source.head.commit.hexsha == released[0]
+    assert report(workspace)['changed_inputs'] == ['casos']
+    # Full build and release
+    assert workspace.commits() == 3
+
+
+def test_watch_survives_fetch_error_at_startup(workspace):
+    origin = workspace.source.remote('origin')
+    url = origin.url
+    origin.set_url(os.path.join(workspace.root, 'missing.git'))
+    released = []
+
+    def recover():
+        origin.set_url(url)
+        released.append(publish_release(workspace))
+
+    with sleeps(lambda: None, recover):
+        run(workspace.config(), watch_seconds=60)
+    # The first update ran on the local copy, the release after the error
+    assert workspace.source.head.commit.hexsha == released[0]
+    assert report(workspace)['changed_inputs'] == ['casos']
+    assert workspace.commits() == 3
+    assert os.path.exists(workspace.data + 'todos_cantabria.json-stat')
+
+
+def test_watch_survives_failing_update(workspace):
+    from etl import main
+
+    update = main.update
+    calls = []
+
+    def failing_update(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise ValueError('malformed input')
+        update(*args, **kwargs)
+
+    released = []
+    with mock.patch('etl.main.update', side_effect=failing_update), \
+            sleeps(lambda: None,
+                   lambda: released.append(publish_release(workspace))):
+        run(workspace.config(), watch_seconds=60)
+    # Failed at startup, run again at the next check, then the release
+    assert len(calls) == 3
+    assert workspace.source.head.commit.hexsha == released[0]
+    assert report(workspace)['changed_inputs'] == ['casos']
+    assert workspace.commits() == 3
@@ -0,0 +1,111 @@
+"""CSV, NDJSON and Parquet writers of the datasets."""
+
+import io
+
+import json
+
+import os
+
+from etl.writers import (
+    long_table, to_table, write_csv, write_formats, write_ndjson)
+
+import numpy as np
+
+import pandas as pd
+
+import pandas.testing as pdt
+
+import pytest
+
+
+@pytest.fixture
+def todos():
+    """Accumulated series of two regions, in long format."""
+    rows = []
+    for ccaa, factor in [('Madrid', 10), ('Cantabria', 1)]:
+        for day in range(1, 4):
+            fecha = '2020-04-%02d' % day
+            rows.append((fecha, ccaa, 'casos', factor * day * 1.0))
+            rows.append((fecha, ccaa, 'variacion', factor / 3 * day))
+    rows.append(('2020-04-04', 'Madrid', 'casos', 50.0))
+    return pd.DataFrame(
+        rows, columns=['fecha', 'ccaa', 'Variables', 'total'])
+
+
+def test_table(todos):
+    unit = {'variacion': {'decimals': 2}}
+    table = long_table(todos, ['fecha', 'ccaa'], 'total', unit)
+    assert list(table.columns) == ['fecha', 'ccaa', 'casos', 'variacion']
+    assert table[['fecha', 'ccaa']].values.tolist() == sorted(
+        table[['fecha', 'ccaa']].values.tolist())
+    # Whole floats as integers, the others rounded, missing cells null
+    assert str(table.casos.dtype) == 'Int64'
+    assert table.variacion.dropna().tolist() == [
+        0.33, 3.33, 0.67, 6.67, 1.0, 10.0]
+    assert table.variacion.isna().sum() == 1
+
+
+def written(write, tables):
+    file = io.BytesIO()
+    write(file, tables)
+    return file.getvalue()
+
+
+def test_csv_and_ndjson_round_trip(todos):
+    table = long_table(todos, ['fecha', 'ccaa'], 'total')
+    chunks = [table.iloc[:3], table.iloc[3:]]
+    csv = written(write_csv, chunks)
+    assert csv == written(write_csv, [table])
+    pdt.assert_frame_equal(
+        pd.read_csv(io.BytesIO(csv), dtype={'casos': 'Int64'}), table)
+    ndjson = written(write_ndjson, chunks)
+    records = [json.loads(line) for line in ndjson.decode().splitlines()]
+    assert records[-1] == {
+        'fecha': '2020-04-04', 'ccaa': 'Madrid', 'casos': 50,
+        'variacion': None}
+    pdt.assert_frame_equal(
+        pd.DataFrame(records).astype({'casos': 'Int64'}), table)
+
+
+def test_parquet_round_trip(todos, tmp_path):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    table = long_table(todos, ['fecha', 'ccaa'], 'total')
+    file_name = str(tmp_path / 'todos')
+    chunks = [table.iloc[:4], table.iloc[4:]]
+    assert write_formats(
+        lambda: chunks, file_name, ['csv', 'ndjson', 'parquet'],
+        row_group_size=3) == [
+        file_name + '.csv', file_name + '.ndjson', file_name + '.parquet']
+    metadata = parquet.ParquetFile(file_name + '.parquet').metadata
+    assert metadata.num_rows == len(table)
+    assert metadata.num_row_groups == 3
+    # Dates, with the statistics of every row group
+    statistics = metadata.row_group(0).column(0).statistics
+    assert str(statistics.min) == '2020-04-01'
+    read = pd.read_parquet(file_name + '.parquet')
+    assert read.fecha.tolist() == [
+        pd.Timestamp(fecha).date() for fecha in table.fecha]
+    pdt.assert_frame_equal(
+        read.assign(fecha=table.fecha), table, check_dtype=False)
+    assert read.casos.dtype.kind == 'i'
+    # Unchanged content is not written again
+    mtimes = [os.path.getmtime(file_name + ext)
+              for ext in ['.csv', '.ndjson', '.parquet']]
+    assert write_formats(
+        lambda: chunks, file_name, ['csv', 'ndjson', 'parquet'],
+        row_group_size=3) == []
+    assert mtimes == [os.path.getmtime(file_name + ext)
+                      for ext in ['.csv', '.ndjson', '.parquet']]
+
+
+def test_points_table():
+    df = pd.DataFrame({
+        'id': [1, 0], 'provincia': ['B', np.nan],
+        'Latitud': ['40.5', 'N/D'], 'telefono': [942000000, 942000001]})
+    table = to_table(
+        df, ['id'], ['provincia', 'Latitud', 'telefono'],
+        numeric=['Latitud'], whole=False)
+    assert table.id.tolist() == [0, 1]
+    assert table.Latitud.dtype == 'float64'
+    assert str(table.telefono.dtype) == 'Int64'
+    assert table.provincia.isna().tolist() == [True, False]